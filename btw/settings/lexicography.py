@@ -8,3 +8,22 @@ s.LEXICOGRAPHY_THROTTLING = 30
 
 # The timeout of the XML data in the article_display cache, in seconds.
 s.LEXICOGRAPHY_XML_TIMEOUT = 30 * 60
+
+# The maximum number of seconds a request for the display data of an
+# article waits for the data to be prepared before giving up. 0 means
+# do not wait.
+s.LEXICOGRAPHY_DISPLAY_WAIT = 10
+
+# The timeout of the search results in the article_display cache, in
+# seconds. The results are also invalidated as soon as the display
+# collection changes.
+s.LEXICOGRAPHY_SEARCH_TIMEOUT = 10 * 60
+
+# The dotted path of the class of the backend used for searching
+# articles. See lexicography.search.
+s.LEXICOGRAPHY_SEARCH_BACKEND = "lexicography.search.ExistBackend"
+
+# The maximum number of KWIC snippets shown for each article found by
+# a search, and for a whole page of search results.
+s.LEXICOGRAPHY_KWIC_SNIPPETS_PER_ROW = 10
+s.LEXICOGRAPHY_KWIC_SNIPPETS_PER_REQUEST = 100
@@ -6,3 +6,28 @@ s.PIPELINE["STYLESHEETS"]["semantic_fields"] = {
     ),
     'output_filename': 'css/semantic_fields.css'
 }
+
+s.CACHES = lambda s: {**{
+    "semantic_fields": {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': s.BTW_REDIS_CACHING_LOCATION,
+        'KEY_PREFIX': s.BTW_GLOBAL_KEY_PREFIX + '!semantic_fields',
+        'OPTIONS': {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient"
+        },
+        'TIMEOUT': 3153600000,
+    }
+}, **s.CACHES}
+
+# The timeout of the responses of the semantic field REST API in the
+# semantic_fields cache, in seconds. The responses are also
+# invalidated as soon as the semantic fields change.
+s.SEMANTIC_FIELDS_RESPONSE_TIMEOUT = 60 * 60
+
+# Whether to serve some lookups of semantic fields from a copy of the
+# hierarchy held in memory by each process. See semantic_fields.tree.
+s.SEMANTIC_FIELDS_TREE = False
+
+# The maximum number of seconds between checks of whether the copy of
+# the hierarchy held in memory is stale.
+s.SEMANTIC_FIELDS_TREE_CHECK_INTERVAL = 5
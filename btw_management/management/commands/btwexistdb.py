@@ -13,6 +13,7 @@ from lib.existdb import get_admin_db, get_collection_path, running
 from lib import xquery
 from lib.command import SubCommand, required
 from lexicography.models import Chunk
+from lexicography.caching import bump_search_generation
 
 def assert_running():
     if not running():
@@ -183,6 +184,7 @@ class Dropdb(SubCommand):
         assert_running()
         db = get_admin_db()
         db.removeCollection(settings.EXISTDB_ROOT_COLLECTION, True)
+        bump_search_generation()
 
 class Load(SubCommand):
     """
@@ -191,7 +193,19 @@ class Load(SubCommand):
 
     name = "load"
 
-    def __call__(self, command, _options):
+    def add_to_parser(self, subparsers):
+        sp = super(Load, self).add_to_parser(subparsers)
+        sp.add_argument("--workers",
+                        type=int,
+                        default=None,
+                        help="Prepare the articles with a pool of this "
+                        "many worker processes. 0 prepares the articles "
+                        "in bulk but without using worker processes. "
+                        "By default, the articles are prepared one by "
+                        "one.")
+        return sp
+
+    def __call__(self, command, options):
         """
         Load initial data into a new database. This is necessary for BTW
         to run.
@@ -207,12 +221,21 @@ class Load(SubCommand):
         if db.hasCollection(chunk_collection_path):
             db.removeCollection(chunk_collection_path)
 
-        Chunk.objects.sync_with_exist()
+        report = Chunk.objects.sync_with_exist()
+        command.stdout.write("Chunks: {} loaded, {} removed, {} unchanged."
+                             .format(*report))
 
         display_path = get_collection_path("display")
         if db.hasCollection(display_path):
             db.removeCollection(display_path)
-        Chunk.objects.prepare("xml", include_unpublished=False)
+            bump_search_generation()
+        reports = Chunk.objects.prepare("xml", include_unpublished=False,
+                                        workers=options.get("workers"))
+        if reports is not None:
+            for report in reports:
+                if report.error is not None:
+                    command.stderr.write("Failed to prepare {}: {}"
+                                         .format(report.pk, report.error))
 
 class Loadutil(SubCommand):
     """
@@ -29,6 +29,7 @@ describe("SearchView", () => {
     "depths.parent": "-1",
     "depths.related_by_pos": "1",
     fields: "@search",
+    order: "relevance",
   };
 
   before(() => {
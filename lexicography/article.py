@@ -1,21 +1,127 @@
 import re
+import hashlib
 from copy import deepcopy
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 from tatsu.exceptions import FailedParse
 import lxml.etree
+from django.conf import settings
+from django.core.cache import caches
 
 from .models import Entry
+from . import depman
+from .caching import make_hyperlink_key, make_hyperlink_version_key
 from .xml import XMLTree, default_namespace_mapping, elements_as_text, \
     element_as_text
 from bibliography.views import targets_to_dicts
 from semantic_fields.models import SemanticField, SearchWord, make_specified_sf
-from semantic_fields.util import parse_local_references
-from lib.sqlutil import select_for_share
+from semantic_fields.util import parse_local_references, memoized
 
 btw_mapping = default_namespace_mapping["btw"]
 
-def prepare_article_data(data):
+cache = caches['article_display']
+
+PreparedArticle = namedtuple("PreparedArticle", ("xml", "bibl_targets",
+                                                 "bibl_data", "sf_records",
+                                                 "sf_refs", "lemmas", "text"))
+"""
+The result of :meth:`ArticlePipeline.run`. ``sf_refs`` is the set of
+semantic field references that the prepared XML makes, as they appear
+in the ``ref`` attributes of its ``btw:sf`` elements. ``text`` is the
+text of the prepared XML, with whitespace normalized.
+"""
+
+class ArticlePipeline(object):
+    """
+    Performs all the processing needed to prepare an article for
+    display on a single parse of the article's XML. This produces the
+    prepared XML (see :meth:`run`), the bibliographical data, the
+    semantic field records used by the article and the lemmas the
+    article may link to.
+
+    :param data: The XML (in serialization form) of the article.
+    :type data: :class:`str`
+    :param sf_cache: A cache of semantic field records to use instead
+                     of querying the database for each article. See
+                     :class:`SemanticFieldCache`.
+    :type sf_cache: :class:`SemanticFieldCache`
+    :raises ValueError: If the data cannot be parsed.
+    """
+
+    def __init__(self, data, sf_cache=None):
+        self.data = data
+        self.sf_cache = sf_cache
+        self.tree = XMLTree(data.encode("utf-8"))
+        if self.tree.is_data_unclean():
+            raise ValueError("the data is not clean")
+        self._done = False
+
+    def bibliographical_data(self):
+        """
+        :returns: The bibliographical targets of the article and the
+                  data that goes with them.
+        :rtype: A pair of a :class:`set` of targets and a
+                :class:`dict` of data.
+        """
+        targets = self.tree.get_bibilographical_targets()
+        return (targets, targets_to_dicts(targets))
+
+    def run(self, bibl_data=True):
+        """
+        Run the pipeline. Since the preparation steps modify the tree,
+        this method can be called only once per pipeline.
+
+        :param bibl_data: Whether to fetch the bibliographical data.
+        :type bibl_data: :class:`bool`
+        :returns: The result of the processing. If ``bibl_data`` was
+                  false, the field ``bibl_data`` of the result is
+                  ``None``.
+        :rtype: :class:`PreparedArticle`
+        """
+        if self._done:
+            raise ValueError("the pipeline has already run")
+        self._done = True
+
+        tree = self.tree
+
+        # The preparation steps do not touch the references, so we can
+        # get the targets before or after. We do it before.
+        if bibl_data:
+            (targets, bibl) = self.bibliographical_data()
+        else:
+            targets = tree.get_bibilographical_targets()
+            bibl = None
+
+        #
+        # The series of steps we perform here will turn the article into
+        # something which no longer conforms to the btw-storage
+        # schema. See the documentation in each function to know what
+        # changes are made.
+        #
+
+        modified = combine_sense_semantic_fields(tree)
+        modified = combine_all_semantic_fields(tree) or modified
+        modified = combine_cognate_semantic_fields(tree) or modified
+        modified = add_semantic_fields_to_english_renditions(tree) or modified
+        modified, sf_records = \
+            name_semantic_fields(tree, self.sf_cache) or modified
+
+        if modified:
+            xml = lxml.etree.tostring(tree.tree, encoding="unicode")
+        else:
+            # We do not reserialize an unmodified tree.
+            xml = self.data
+
+        sf_refs = set(tree.tree.xpath(".//btw:sf/@ref",
+                                      namespaces=default_namespace_mapping))
+        (lemmas, _) = get_lemmas_and_terms(tree)
+        text = get_text(tree.tree)
+
+        return PreparedArticle(xml, targets, bibl, sf_records, sf_refs,
+                               lemmas, text)
+
+
+def prepare_article_data(data, sf_cache=None):
     """
     Modifies the file produced by the authors of the article so that
     it is suitable for display. In particular:
@@ -33,33 +139,18 @@ def prepare_article_data(data):
     This function must tolerate data that is well-formed but not valid
     according to our storage schema.
 
-    :param data: The XML (in serialization form) of the article.
-    """
+    Use :class:`ArticlePipeline` directly if you need more than the
+    prepared XML.
 
-    tree = XMLTree(data.encode("utf-8"))
-    if tree.is_data_unclean():
-        raise ValueError("the data is not clean")
-
-    #
-    # The series of steps we perform here will turn the article into
-    # something which no longer conforms to the btw-storage
-    # schema. See the documentation in each function to know what
-    # changes are made.
-    #
-
-    modified = combine_sense_semantic_fields(tree)
-    modified = combine_all_semantic_fields(tree) or modified
-    modified = combine_cognate_semantic_fields(tree) or modified
-    modified = add_semantic_fields_to_english_renditions(tree) or modified
-    modified, sf_records = name_semantic_fields(tree) or modified
-
-    if modified:
-        xml = lxml.etree.tostring(tree.tree, encoding="unicode")
-    else:
-        # We do not reserialize an unmodified tree.
-        xml = data
+    :param data: The XML (in serialization form) of the article.
 
-    return xml, sf_records
+    :param sf_cache: A cache of semantic field records to use instead
+                     of querying the database for each article. See
+                     :class:`SemanticFieldCache`.
+    :type sf_cache: :class:`SemanticFieldCache`
+    """
+    result = ArticlePipeline(data, sf_cache).run(bibl_data=False)
+    return result.xml, result.sf_records
 
 terms_xpath = lxml.etree.XPath("//*[self::btw:antonym or self::btw:cognate "
                                "or self::btw:conceptual-proximate]/btw:term | "
@@ -90,16 +181,79 @@ def get_lemmas_and_terms(xml):
 
     return (lemmas, terms)
 
-def hyperlink_prepared_data(prepared, published):
+def hyperlink_prepared_data(prepared, published, dependent=None):
+    """
+    Add hyperlinks to the prepared data of a chunk.
+
+    :param prepared: The prepared data of the chunk.
+    :type prepared: :class:`dict`
+    :param published: Whether to link only to published articles.
+    :type published: :class:`bool`
+    :param dependent: If not ``None``, we record in ``depman.lemma``
+                      that ``dependent`` depends on the lemmas the data
+                      refers to. This is done *before* looking up the
+                      entries, so that a change to the entries made
+                      after the lookup invalidates ``dependent``.
+    :returns: The hyperlinked XML.
+    :rtype: :class:`str`
+    """
     data = prepared["xml"]
     xml = XMLTree(data.encode("utf-8"))
     (lemmas, terms) = get_lemmas_and_terms(xml)
+    if dependent is not None:
+        depman.lemma.replace_dependencies(dependent, lemmas)
     modified = hyperlink_article(lemmas, terms, published)
     if modified:
         data = lxml.etree.tostring(xml.tree, encoding="unicode")
     # else we do not reserialize
     return data
 
+def get_hyperlinked_data(chunk, prepared, published):
+    """
+    Get the hyperlinked XML of a chunk. This is the same as
+    :func:`hyperlink_prepared_data` except that the result is cached
+    per chunk and audience. The cached value records a hash of the
+    prepared data it was computed from, so a cached value computed
+    from outdated prepared data is never returned. The cached values
+    are invalidated through ``depman.lemma`` when the entries they may
+    link to change. We record the dependencies here, as the prepared
+    data may not have been produced by
+    :func:`lexicography.tasks.prepare_chunk_xml` in this deployment.
+
+    The cached value also records the version of the hyperlinked data
+    of the chunk that was current when we started computing it. An
+    invalidation bumps the version, so a value computed concurrently
+    with an invalidation is not returned even if it is cached after
+    the invalidation.
+
+    :param chunk: The chunk whose data we are hyperlinking.
+    :type chunk: :class:`lexicography.models.Chunk`
+    :param prepared: The prepared data of the chunk, as returned by
+                     :meth:`lexicography.models.Chunk.get_display_data`.
+    :type prepared: :class:`dict`
+    :param published: Whether to link only to published articles.
+    :type published: :class:`bool`
+    :returns: The hyperlinked XML.
+    :rtype: :class:`str`
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(prepared["xml"].encode("utf-8"))
+    source = sha1.hexdigest()
+
+    key = make_hyperlink_key(chunk.pk, published)
+    version_key = make_hyperlink_version_key(chunk.pk)
+    values = cache.get_many([key, version_key])
+    cached = values.get(key)
+    version = values.get(version_key)
+    if cached is not None and cached["source"] == source and \
+       cached.get("version") == version:
+        return cached["xml"]
+
+    data = hyperlink_prepared_data(prepared, published, chunk.pk)
+    cache.set(key, {"source": source, "version": version, "xml": data},
+              timeout=settings.LEXICOGRAPHY_XML_TIMEOUT)
+    return data
+
 
 def hyperlink_article(lemmas, terms, published):
     # The candidates are those articles that *could* be the target of
@@ -138,14 +292,22 @@ def hyperlink_article(lemmas, terms, published):
     return bool(found_lemmas)
 
 
-def get_bibliographical_data(data):
-    tree = XMLTree(data.encode("utf-8"))
-    if tree.is_data_unclean():
-        raise ValueError("the data is not clean")
-    targets = tree.get_bibilographical_targets()
-    bibl_data = targets_to_dicts(targets)
+def get_text(tree):
+    """
+    Get the text of a prepared article, with whitespace normalized.
+    This is the text from which the hits of searches are produced.
+
+    :param tree: The prepared article, as a tree or in serialization
+                 form.
+    :type tree: :class:`lxml.etree._Element` or :class:`str`
+    :rtype: :class:`str`
+    """
+    if isinstance(tree, str):
+        tree = lxml.etree.fromstring(tree.encode("utf-8"))
+    return " ".join(" ".join(tree.itertext()).split())
 
-    return (targets, bibl_data)
+def get_bibliographical_data(data):
+    return ArticlePipeline(data).bibliographical_data()
 
 sfs_in_semantic_fields_xpath = lxml.etree.XPath(
     "//btw:sense/btw:semantic-fields/btw:sf",
@@ -249,6 +411,7 @@ def combine_semantic_fields_into(sfs, into, depth=None):
 # ``|`` or the positional suffix. (We use this *only* for the truncation.)
 truncate_re = re.compile(r"\|.*|[a-z]+.*$")
 
+@memoized(maxsize=10000)
 def truncate_to(text, depth):
     parts = truncate_re.sub("", text).split(".", depth)
 
@@ -260,6 +423,7 @@ def truncate_to(text, depth):
 
 key_re = re.compile(r"(?<!\d)(\d{2})(?!\d)")
 
+@memoized(maxsize=10000)
 def key_from_path(x):
     # We add a leading 0 to numbers that do not have it because the
     # HTE project has at least *some* semantic field codes that are
@@ -309,7 +473,52 @@ def add_semantic_fields_to_english_renditions(xml):
 
     return modified
 
-def name_semantic_fields(xml):
+class SemanticFieldCache(object):
+    """
+    A cache of :class:`SemanticField` records keyed by path. This is
+    meant to be used when preparing many articles in a row: semantic
+    fields are shared by many articles, so we fetch each of them from
+    the database only once. The records are fetched with
+    :meth:`SemanticFieldManager.resolve_for_display
+    <semantic_fields.models.SemanticFieldManager.resolve_for_display>`
+    so computing ``heading_for_display`` on them does not hit the
+    database.
+
+    Note that the records are **not** locked against modification, so
+    this should be used only for bulk operations where this does not
+    matter. (A change to a semantic field will cause the articles that
+    use it to be prepared again anyway.)
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.missing = set()
+
+    def fetch(self, paths):
+        """
+        Get the records that correspond to the paths passed. Paths that
+        do not correspond to any record in the database are silently
+        skipped.
+
+        :param paths: The paths to fetch.
+        :type paths: :class:`set` of :class:`str`
+        :returns: The records found.
+        :rtype: :class:`list` of :class:`SemanticField`
+        """
+        to_fetch = set(paths) - self.missing - set(self.records.keys())
+        if to_fetch:
+            fetched = SemanticField.objects.resolve_for_display(to_fetch)
+            for path, sf in fetched.items():
+                self.records.setdefault(path, sf)
+            self.missing |= to_fetch - set(self.records.keys())
+
+        return [self.records[path] for path in paths if path in self.records]
+
+    def clear(self):
+        self.records = {}
+        self.missing = set()
+
+def name_semantic_fields(xml, sf_cache=None):
     sfs = xml.tree.findall(".//btw:sf",
                            namespaces=default_namespace_mapping)
 
@@ -352,10 +561,15 @@ def name_semantic_fields(xml):
                 # Process the parent.
                 ref = ref.parent()
 
-    # We select for update because we do not want the records to change
-    # while we are using them.
-    sf_records = select_for_share(
-        SemanticField.objects.filter(path__in=to_fetch))
+    if sf_cache is None:
+        # We select for share because we do not want the records to
+        # change while we are using them. The records come with their
+        # parents already set, so computing ``heading_for_display``
+        # below does not query the database.
+        sf_records = list(SemanticField.objects.resolve_for_display(
+            to_fetch, for_share=True).values())
+    else:
+        sf_records = sf_cache.fetch(to_fetch)
 
     path_to_record = {sf.path: sf for sf in sf_records}
 
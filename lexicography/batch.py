@@ -0,0 +1,335 @@
+"""
+Facilities for preparing, validating and transforming chunks in bulk.
+
+Preparing a chunk is mostly CPU-bound work (parsing and transforming
+XML) interspersed with database queries. When we have to prepare all
+the chunks of the database (e.g. when reloading eXist), doing it one
+chunk at a time is slow. The functions here spread the work over a
+pool of processes. Each worker process keeps its own cache of
+semantic field records so that the records shared among articles are
+fetched only once per worker.
+"""
+import os
+import time
+import logging
+import functools
+import multiprocessing
+from collections import namedtuple, defaultdict
+
+from django.db import connections
+from pebble import ProcessPool
+
+from .article import SemanticFieldCache
+from . import xml
+from lib import util
+
+logger = logging.getLogger("lexicography")
+
+PreparationReport = namedtuple("PreparationReport", ("pk", "elapsed", "error"))
+"""
+The report for the preparation of a single chunk. ``elapsed`` is the
+time it took to prepare the chunk, in seconds. It may be ``None`` if the
+worker that was preparing the chunk died. ``error`` is ``None`` if the
+preparation was successful, or the string representation of the error
+that happened.
+"""
+
+# The cache used by the current worker.
+_sf_cache = None
+
+def _init_worker():
+    global _sf_cache  # pylint: disable=global-statement
+    _sf_cache = SemanticFieldCache()
+
+def _reset_worker():
+    global _sf_cache  # pylint: disable=global-statement
+    _sf_cache = None
+
+def _prepare(pk):
+    from .tasks import prepare_chunk_xml
+
+    start = time.time()
+    error = None
+    try:
+        prepare_chunk_xml(pk, _sf_cache)
+    except Exception as ex:  # pylint: disable=broad-except
+        logger.exception("failed to prepare chunk %s", pk)
+        error = repr(ex)
+
+    return PreparationReport(pk, time.time() - start, error)
+
+def _run(fn, items, workers, initializer=None, finalizer=None):
+    """
+    Call ``fn`` on each item, in a pool of ``workers`` processes. This
+    is a generator that yields pairs of item and result, in the order
+    of ``items``. If a worker dies while processing an item, the
+    result is the exception that was raised.
+
+    When ``workers`` is 0, the work is done in the current process:
+    ``initializer`` is called before the work starts, and
+    ``finalizer`` after it ends, so that the state set by the former
+    does not outlive the work.
+    """
+    if workers == 0:
+        if initializer is not None:
+            initializer()
+        try:
+            for item in items:
+                yield (item, fn(item))
+        finally:
+            if finalizer is not None:
+                finalizer()
+        return
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    # We must not share database connections with the child processes.
+    connections.close_all()
+    with ProcessPool(max_workers=workers, initializer=initializer) as pool:
+        futures = [(item, pool.schedule(fn, args=(item, )))
+                   for item in items]
+        for item, future in futures:
+            try:
+                yield (item, future.result())
+            except Exception as ex:  # pylint: disable=broad-except
+                yield (item, ex)
+
+def prepare_chunks(pks, workers=None):
+    """
+    Prepare the XML of the chunks passed. This is a generator which
+    yields one :class:`PreparationReport` per chunk, in the same order
+    as the keys passed.
+
+    :param pks: The primary keys of the chunks to prepare.
+    :type pks: :class:`list`
+    :param workers: The number of worker processes to use. ``None``
+                    means use as many workers as there are CPUs. ``0``
+                    means do all the work in the current process, which
+                    is useful for debugging and for testing, since
+                    worker processes cannot see the data of a
+                    transaction that has not been committed.
+    :type workers: :class:`int`
+    """
+    for pk, report in _run(_prepare, pks, workers, _init_worker,
+                           _reset_worker):
+        if isinstance(report, Exception):
+            # This happens if the worker died.
+            logger.error("worker failed while preparing chunk %s: %r",
+                         pk, report)
+            report = PreparationReport(pk, None, repr(report))
+        yield report
+
+ValidationReport = namedtuple("ValidationReport", ("pk", "valid", "error"))
+"""
+The report for the validation of a single chunk. ``valid`` is
+``None`` if the chunk could not be validated, in which case ``error``
+is the string representation of the error that happened.
+"""
+
+def _validate(pks):
+    from .models import Chunk
+
+    reports = []
+    # Map of schematron path to the chunks that must be checked with it.
+    to_check = defaultdict(list)
+    for chunk in Chunk.objects.filter(pk__in=pks):
+        if not chunk.is_normal:
+            reports.append(ValidationReport(chunk.pk, False, None))
+            continue
+
+        try:
+            # validate_with_rng caches the schemas it loads, so each
+            # worker loads each schema once.
+            valid = util.validate_with_rng(
+                xml.schema_for_version(chunk.schema_version), chunk.data)
+            sch = xml.schematron_for_version(chunk.schema_version) \
+                if valid else None
+        except Exception as ex:  # pylint: disable=broad-except
+            reports.append(ValidationReport(chunk.pk, None, repr(ex)))
+            continue
+
+        if sch:
+            to_check[sch].append(chunk)
+        else:
+            reports.append(ValidationReport(chunk.pk, valid, None))
+
+    for sch, chunks in to_check.items():
+        try:
+            results = util.schematron_many(sch,
+                                           [chunk.data for chunk in chunks])
+        except Exception:  # pylint: disable=broad-except
+            # Something in the batch is causing trouble. Check the
+            # chunks one by one to find out which.
+            results = []
+            for chunk in chunks:
+                try:
+                    results.append(util.schematron(sch, chunk.data))
+                except Exception as ex:  # pylint: disable=broad-except
+                    results.append(ex)
+
+        for chunk, result in zip(chunks, results):
+            reports.append(
+                ValidationReport(chunk.pk, None, repr(result))
+                if isinstance(result, Exception) else
+                ValidationReport(chunk.pk, result, None))
+
+    return reports
+
+def validate_chunks(pks, workers=None, batch_size=50):
+    """
+    Validate the chunks passed, without saving the results. This is a
+    generator which yields one :class:`ValidationReport` per chunk.
+    The reports are **not** in the same order as the keys passed.
+
+    The chunks are validated by batches so that the schematron check
+    can be performed for a whole batch with a single run of Saxon.
+
+    :param pks: The primary keys of the chunks to validate.
+    :type pks: :class:`list`
+    :param workers: The number of worker processes to use. See
+                    :func:`prepare_chunks`.
+    :type workers: :class:`int`
+    :param batch_size: The number of chunks per batch.
+    :type batch_size: :class:`int`
+    """
+    batches = [tuple(pks[start:start + batch_size])
+               for start in range(0, len(pks), batch_size)]
+    for batch, reports in _run(_validate, batches, workers):
+        if isinstance(reports, Exception):
+            logger.error("worker failed while validating chunks %s: %r",
+                         batch, reports)
+            reports = [ValidationReport(pk, None, repr(reports))
+                       for pk in batch]
+        yield from reports
+
+TransformReport = namedtuple("TransformReport",
+                             ("pk", "new_pk", "initially_invalid", "valid",
+                              "error"))
+"""
+The report for the transformation of a single chunk. ``new_pk`` is the
+key of the chunk produced by the transformation. It is ``None`` if the
+chunk could not be transformed, in which case ``error`` is the string
+representation of the error that happened. ``valid`` is the validity
+of the new chunk.
+"""
+
+def _write_log(path, data):
+    with open(path, 'w', encoding="utf-8") as f:
+        f.write(data)
+
+def _transform(xsl_path, after_rng, log_dir, save, pks):
+    from .models import Chunk
+
+    reports = []
+    to_convert = []
+    for chunk in Chunk.objects.filter(pk__in=pks):
+        chunk_dir = os.path.join(log_dir, chunk.pk)
+        # The directory may exist if we are resuming an interrupted
+        # transformation.
+        os.makedirs(chunk_dir, exist_ok=True)
+        _write_log(os.path.join(chunk_dir, "before.xml"), chunk.data)
+
+        if not chunk.is_normal:
+            # Abnormal chunk. We won't try to validate and convert.
+            _write_log(os.path.join(chunk_dir, "after.xml"), chunk.data)
+            reports.append(TransformReport(chunk.pk, chunk.pk, True, False,
+                                           None))
+            continue
+
+        if chunk.schema_version == "":
+            chunk.schema_version = \
+                xml.XMLTree(chunk.data.encode('utf-8')).extract_version()
+        to_convert.append(chunk)
+
+    try:
+        # We do not use lxml for this because lxml only supports xslt
+        # 1.0 and we want to be able to run 2.0 transforms.
+        results = util.run_saxon_many(xsl_path,
+                                      [chunk.data for chunk in to_convert])
+    except Exception:  # pylint: disable=broad-except
+        # Something in the batch is causing trouble. Transform the
+        # chunks one by one to find out which.
+        results = []
+        for chunk in to_convert:
+            try:
+                results.append(util.run_saxon(xsl_path, chunk.data))
+            except Exception as ex:  # pylint: disable=broad-except
+                results.append(ex)
+
+    for chunk, converted in zip(to_convert, results):
+        if isinstance(converted, Exception):
+            reports.append(TransformReport(chunk.pk, None, None, None,
+                                           repr(converted)))
+            continue
+
+        try:
+            initially_invalid = not chunk.valid
+            new_chunk = Chunk(data=converted)
+            new_chunk.schema_version = \
+                xml.XMLTree(converted.encode('utf-8')).extract_version()
+            new_chunk._valid = util.validate_with_rng(after_rng, converted)
+            new_chunk.clean()  # Generate the pk
+
+            chunk_dir = os.path.join(log_dir, chunk.pk)
+            _write_log(os.path.join(chunk_dir, "after.xml"), converted)
+            if not initially_invalid and not new_chunk.valid:
+                _write_log(os.path.join(chunk_dir, "BECAME_INVALID"), "")
+
+            if save:
+                new_chunk.save()
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.exception("failed to transform chunk %s", chunk.pk)
+            reports.append(TransformReport(chunk.pk, None, None, None,
+                                           repr(ex)))
+            continue
+
+        reports.append(TransformReport(chunk.pk, new_chunk.pk,
+                                       initially_invalid, new_chunk.valid,
+                                       None))
+
+    return reports
+
+def transform_chunks(xsl_path, after_rng, log_dir, pks, save=True,
+                     workers=None, batch_size=50):
+    """
+    Transform the chunks passed with an XSLT transformation. The
+    chunks are transformed by batches so that the transformation can
+    be performed for a whole batch with a single run of Saxon. This is
+    a generator which yields the list of :class:`TransformReport`
+    objects of each batch, as each batch is completed. The batches are
+    yielded in the order of the keys passed.
+
+    The chunks that result from the transformations are saved to the
+    database but nothing refers to them. It is up to the caller to
+    make use of them. The chunks passed are left untouched. For each
+    chunk, the data before and after transformation is logged in a
+    subdirectory of ``log_dir`` which has the chunk's key for name.
+
+    :param xsl_path: The path of the XSLT to run.
+    :type xsl_path: :class:`str`
+    :param after_rng: The path of the schema with which to validate
+                      the transformed chunks.
+    :type after_rng: :class:`str`
+    :param log_dir: The directory in which to log the transformations.
+    :type log_dir: :class:`str`
+    :param pks: The primary keys of the chunks to transform.
+    :type pks: :class:`list`
+    :param save: Whether to save the transformed chunks.
+    :type save: :class:`bool`
+    :param workers: The number of worker processes to use. See
+                    :func:`prepare_chunks`.
+    :type workers: :class:`int`
+    :param batch_size: The number of chunks per batch.
+    :type batch_size: :class:`int`
+    """
+    batches = [tuple(pks[start:start + batch_size])
+               for start in range(0, len(pks), batch_size)]
+    fn = functools.partial(_transform, xsl_path, after_rng, log_dir, save)
+    for batch, reports in _run(fn, batches, workers):
+        if isinstance(reports, Exception):
+            logger.error("worker failed while transforming chunks %s: %r",
+                         batch, reports)
+            reports = [TransformReport(pk, None, None, None, repr(reports))
+                       for pk in batch]
+        yield reports
@@ -1,6 +1,13 @@
+import time
+import json
+import hashlib
+
+from django.conf import settings
 from django.dispatch import receiver
 from django.core.cache import caches
+from django.db import transaction
 
+from lib import util
 from . import depman
 from . import signals
 from bibliography import signals as bibsignals
@@ -51,6 +58,147 @@ def make_display_key(kind, pk):
         raise ValueError("unknown display key kind {}".format(kind))
     return "{}_{}".format(pk, kind).encode("ascii")
 
+def make_display_channel(pk):
+    """
+    Make the name of the channel on which we announce that some
+    display data of a chunk has been prepared.
+
+    :param pk: The primary key of the chunk.
+    """
+    return "{}_ready".format(pk)
+
+def make_hyperlink_key(pk, published):
+    """
+    Make the key under which the hyperlinked XML of a chunk is cached.
+
+    :param pk: The primary key of the chunk.
+    :param published: Whether the XML is hyperlinked for an audience
+                      that sees only published articles.
+    :type published: :class:`bool`
+    """
+    return "{}_link_{}".format(
+        pk, "published" if published else "unpublished").encode("ascii")
+
+def make_text_key(pk):
+    """
+    Make the key under which the text of the prepared XML of a chunk
+    is cached. The text is used to produce the hits of searches.
+
+    :param pk: The primary key of the chunk.
+    """
+    return "{}_text".format(pk).encode("ascii")
+
+def make_hyperlink_version_key(pk):
+    """
+    Make the key under which the version of the hyperlinked XML of a
+    chunk is recorded. See
+    :func:`lexicography.article.get_hyperlinked_data`.
+
+    :param pk: The primary key of the chunk.
+    """
+    return "{}_link_version".format(pk).encode("ascii")
+
+def delete_hyperlinks(pks):
+    """
+    Delete the hyperlinked XML of chunks, for all audiences, and bump
+    the version of their hyperlinked XML so that values being computed
+    right now are not used once they are cached.
+
+    :param pks: The primary keys of the chunks.
+    """
+    pks = list(pks)
+    if not pks:
+        return
+
+    # We must never delete the versions: a value computed before the
+    # deletion would become current again.
+    util.incr_many('article_display',
+                   [make_hyperlink_version_key(pk) for pk in pks])
+    cache.delete_many([make_hyperlink_key(pk, published) for pk in pks
+                       for published in (True, False)])
+
+SEARCH_GENERATION_KEY = "search_generation"
+
+def get_search_generation():
+    """
+    Get the current generation of the display collection. The
+    generation changes whenever a document is added to or removed
+    from the collection, which makes all cached search results stale.
+
+    :returns: The generation.
+    :rtype: :class:`int`
+    """
+    generation = cache.get(SEARCH_GENERATION_KEY)
+    if generation is None:
+        # We start from the current time rather than 0 so that if the
+        # counter is lost, we do not reuse the generation of search
+        # results that are still cached.
+        cache.add(SEARCH_GENERATION_KEY, int(time.time() * 1000),
+                  timeout=None)
+        generation = cache.get(SEARCH_GENERATION_KEY)
+    return generation
+
+def bump_search_generation():
+    """
+    Mark the cached search results as stale. Call this whenever a
+    document is added to or removed from the display collection.
+    """
+    try:
+        cache.incr(SEARCH_GENERATION_KEY)
+    except ValueError:
+        # The counter does not exist yet. Creating it is enough to
+        # start a new generation.
+        get_search_generation()
+
+def make_search_key(query, lemmata_only, publication_status, search_all):
+    """
+    Make the key under which the results of a search are cached. The
+    key includes the current generation of the display collection so
+    that results are not reused once the collection has changed. It
+    also includes the search backend in use, since backends do not
+    produce the same results.
+
+    :param query: The Lucene query. Runs of whitespace are not
+                  significant.
+    :type query: :class:`str`
+    :param lemmata_only: Whether the search is limited to lemmata.
+    :type lemmata_only: :class:`bool`
+    :param publication_status: The publication status searched.
+    :type publication_status: :class:`str`
+    :param search_all: Whether all the change records are searched.
+    :type search_all: :class:`bool`
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps([settings.LEXICOGRAPHY_SEARCH_BACKEND,
+                            " ".join(query.split()), lemmata_only,
+                            publication_status, search_all]).encode("utf-8"))
+    return "search_{}_{}".format(get_search_generation(),
+                                 sha1.hexdigest()).encode("ascii")
+
+def invalidate_lemma_dependents(lemmas):
+    """
+    Invalidate the hyperlinked XML of the chunks that refer to any of
+    the lemmas passed. This happens when the current transaction
+    commits so that no one caches data computed from the state of the
+    database prior to the commit.
+
+    :param lemmas: The lemmas that have changed status.
+    :type lemmas: :class:`list` of :class:`str`
+    """
+    transaction.on_commit(lambda: _invalidate_lemma_dependents(lemmas))
+
+def _invalidate_lemma_dependents(lemmas):
+    deps = depman.lemma.get_union(lemmas)
+    if deps:
+        delete_hyperlinks(dep.decode("ascii") for dep in deps)
+
+@receiver(signals.entry_available)
+@receiver(signals.entry_unavailable)
+@receiver(signals.entry_newly_published)
+@receiver(signals.entry_unpublished)
+def invalidate_hyperlinks(sender, **kwargs):
+    invalidate_lemma_dependents([kwargs['instance'].lemma])
+
 @receiver(signals.changerecord_hidden)
 @receiver(signals.changerecord_shown)
 def recheck_chunk(sender, **kwargs):
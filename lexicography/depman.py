@@ -47,6 +47,46 @@ class DependencyManager(object):
         util.add_to_set('article_display', self.make_key(dependee),
                         dependent)
 
+    def make_reverse_key(self, dependent):
+        """
+        Create the key name to use for recording the dependees of
+        ``dependent``. This is used by :meth:`replace_dependencies`.
+
+        :param dependent: The dependent.
+        :type dependent: :class:`str` or :class:`bytes`
+        :returns: The key.
+        :rtype: :class:`str`
+        """
+        if isinstance(dependent, bytes):
+            dependent = dependent.decode("utf-8")
+        return self.prefix + "!" + dependent
+
+    def replace_dependencies(self, dependent, dependees):
+        """
+        Record that ``dependent`` depends on exactly ``dependees``. The
+        dependencies previously recorded with this method that are not
+        among ``dependees`` are removed. This is atomic and done in a
+        single round trip.
+
+        :returns: The number of dependencies removed.
+        :rtype: :class:`int`
+        """
+        return util.replace_set_memberships(
+            'article_display',
+            self.make_reverse_key(dependent),
+            [self.make_key(i) for i in dependees],
+            dependent)
+
+    def remove_dependent(self, dependent):
+        """
+        Remove all the dependencies of ``dependent`` recorded with
+        :meth:`replace_dependencies`.
+
+        :returns: The number of dependencies removed.
+        :rtype: :class:`int`
+        """
+        return self.replace_dependencies(dependent, [])
+
     def remove(self, dependee, dependent):
         """
         Remove ``dependent`` from the list of dependents of ``dependee``.
@@ -98,3 +138,9 @@ class DependencyManager(object):
         return ret
 
 bibl = DependencyManager("bibl")
+
+lemma = DependencyManager("lemma")
+"""
+Records which chunks refer to which lemmas. The dependees are lemmas
+and the dependents are chunk primary keys.
+"""
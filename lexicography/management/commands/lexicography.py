@@ -1,6 +1,8 @@
 import json
+import time
+import multiprocessing
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from ...article import prepare_article_data, get_bibliographical_data
 from lib import util, testutil
@@ -40,6 +42,170 @@ class PrepareArticle(SubCommand):
             with open(options["bibl"], 'w') as bibl:
                 bibl.write(json.dumps(get_bibliographical_data(source)[1]))
 
+class Prepare(SubCommand):
+    """
+    Prepare all the articles for displaying, with a pool of worker
+    processes. Reports how long each article took and which articles
+    failed.
+    """
+
+    name = "prepare"
+
+    def add_to_parser(self, subparsers):
+        sp = super(Prepare, self).add_to_parser(subparsers)
+        sp.add_argument("--workers",
+                        type=int,
+                        default=None,
+                        help="The number of worker processes. Defaults to "
+                        "the number of CPUs. 0 means do the work in the "
+                        "current process.")
+        sp.add_argument("--include-unpublished",
+                        action="store_true",
+                        default=False,
+                        help="Also prepare the unpublished articles.")
+        return sp
+
+    def __call__(self, command, options):
+        from django.utils import translation
+        translation.activate('en-us')
+
+        from ...models import Chunk
+
+        start = time.time()
+        reports = Chunk.objects.prepare(
+            "xml", include_unpublished=options["include_unpublished"],
+            workers=options["workers"] if options["workers"] is not None
+            else multiprocessing.cpu_count())
+        total = time.time() - start
+
+        failures = [report for report in reports if report.error is not None]
+        for report in reports:
+            if report.elapsed is None:
+                command.stdout.write("{}: failed".format(report.pk))
+            else:
+                command.stdout.write("{}: {:.3f}s{}".format(
+                    report.pk, report.elapsed,
+                    " (failed)" if report.error is not None else ""))
+
+        command.stdout.write("Prepared {} articles in {:.3f}s; {} failed."
+                             .format(len(reports), total, len(failures)))
+        for report in failures:
+            command.stderr.write("{}: {}".format(report.pk, report.error))
+
+class Validate(SubCommand):
+    """
+    Validate in bulk the chunks whose validity has not been determined
+    yet, and record the results.
+    """
+
+    name = "validate"
+
+    def add_to_parser(self, subparsers):
+        sp = super(Validate, self).add_to_parser(subparsers)
+        sp.add_argument("--workers",
+                        type=int,
+                        default=None,
+                        help="The number of worker processes. Defaults to "
+                        "the number of CPUs. 0 means do the work in the "
+                        "current process.")
+        sp.add_argument("--batch-size",
+                        type=int,
+                        default=50,
+                        help="The number of chunks each worker validates "
+                        "at a time.")
+        sp.add_argument("--all",
+                        action="store_true",
+                        default=False,
+                        help="Validate all chunks, even those whose "
+                        "validity is already known.")
+        return sp
+
+    def __call__(self, command, options):
+        from ...models import Chunk
+        from ...batch import validate_chunks
+
+        chunks = Chunk.objects.all()
+        if not options["all"]:
+            chunks = chunks.filter(_valid__isnull=True)
+        pks = list(chunks.values_list("pk", flat=True))
+
+        start = time.time()
+        invalid = []
+        errors = []
+        to_save = []
+        done = 0
+        for report in validate_chunks(pks, options["workers"],
+                                      options["batch_size"]):
+            done += 1
+            if report.valid is None:
+                errors.append(report)
+                continue
+
+            if not report.valid:
+                invalid.append(report.pk)
+
+            to_save.append(Chunk(c_hash=report.pk, _valid=report.valid))
+            if len(to_save) >= 500:
+                Chunk.objects.bulk_update(to_save, ["_valid"])
+                to_save = []
+
+        if to_save:
+            Chunk.objects.bulk_update(to_save, ["_valid"])
+
+        total = time.time() - start
+        command.stdout.write(
+            "Validated {} chunks in {:.3f}s ({:.1f} chunks/s)."
+            .format(done, total, done / total if total else 0))
+        if invalid:
+            command.stdout.write("Invalid chunks:")
+            for pk in invalid:
+                command.stdout.write(pk)
+        for report in errors:
+            command.stderr.write("Could not validate {}: {}"
+                                 .format(report.pk, report.error))
+
+
+class BackfillSFRefs(SubCommand):
+    """
+    Record the semantic field references made by the articles in the
+    display collection of eXist. This is needed once to populate the
+    index of references with the articles prepared before the index
+    existed.
+    """
+
+    name = "backfill-sf-refs"
+
+    def __call__(self, command, _options):
+        from ...models import SemanticFieldReference
+
+        added, removed = SemanticFieldReference.objects.backfill()
+        command.stdout.write("Added {} references, removed {}."
+                             .format(added, removed))
+
+class CheckSFRefs(SubCommand):
+    """
+    Check that the index of semantic field references agrees with the
+    articles in the display collection of eXist.
+    """
+
+    name = "check-sf-refs"
+
+    def __call__(self, command, _options):
+        from ...models import SemanticFieldReference
+
+        missing, extra = SemanticFieldReference.objects.compare_with_exist()
+        for (chunk, path) in sorted(missing):
+            command.stdout.write("Missing: {} {}".format(chunk, path))
+        for (chunk, path) in sorted(extra):
+            command.stdout.write("Extra: {} {}".format(chunk, path))
+
+        if missing or extra:
+            raise CommandError("The index of semantic field references is "
+                               "inconsistent: {} missing, {} extra."
+                               .format(len(missing), len(extra)))
+        command.stdout.write("The index of semantic field references is "
+                             "consistent.")
+
 
 class Command(BaseCommand):
     help = """\
@@ -51,7 +217,8 @@ Management commands for the lexicography app.
         super(Command, self).__init__(*args, **kwargs)
         self.subcommands = []
 
-        for cmd in [PrepareArticle]:
+        for cmd in [PrepareArticle, Prepare, Validate, BackfillSFRefs,
+                    CheckSFRefs]:
             self.register_subcommand(cmd)
 
     def register_subcommand(self, cmd):
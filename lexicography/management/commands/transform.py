@@ -1,19 +1,19 @@
 
 
 import os
+import json
+import time
+from collections import defaultdict
 
 from django.core.management.base import BaseCommand, CommandError
 from django.utils.termcolors import colorize
-
-from optparse import make_option
+from django.db import transaction
 
 from lexicography.models import Entry, Chunk, ChangeRecord
-from lexicography import xml
-from lib import util
+from lexicography.batch import transform_chunks
 
 
 class Command(BaseCommand):
-    args = 'dir'
     help = """\
 Perform an XSLT transformation on all entries.
 
@@ -22,15 +22,39 @@ dir The directory that contains the files that drive the
        must be in a file named ``transform.xsl``. The schema to
        validate after must be in a file named ``after.rng``. The
        transformations are logged into the ``log`` subdirectory.
+
+Each distinct chunk is transformed once, by batches spread over a
+pool of worker processes. The change records that refer to the
+chunks of a batch are updated in a single transaction. The
+progress of the transformation is recorded in the file ``state``
+of ``dir``, so that an interrupted transformation can be continued
+with ``--resume``.
 """
 
-    option_list = BaseCommand.option_list + (
-        make_option('--noop',
-                    action='store_true',
-                    dest='noop',
-                    default=False,
-                    help='Do everything except performing the transformation'),
-    )
+    def add_arguments(self, parser):
+        parser.add_argument("dir")
+        parser.add_argument('--noop',
+                            action='store_true',
+                            dest='noop',
+                            default=False,
+                            help='Do everything except performing the '
+                            'transformation')
+        parser.add_argument('--resume',
+                            action='store_true',
+                            dest='resume',
+                            default=False,
+                            help='Continue an interrupted transformation.')
+        parser.add_argument('--workers',
+                            type=int,
+                            default=None,
+                            help='The number of worker processes to use. '
+                            'Defaults to the number of CPUs. Use 0 to do '
+                            'all the work in the current process.')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=50,
+                            help='The number of chunks to transform with '
+                            'a single run of Saxon.')
 
     def handle(self, *args, **options):
         self.stdout.write(colorize("""
@@ -48,13 +72,13 @@ WARNING: in general, this operation cannot be reliably undone without
 
         """, fg='red'))
 
-        if len(args) != 1:
-            raise CommandError("One argument required.")
-
-        mydir = args[0]
+        mydir = options["dir"]
+        noop = options["noop"]
+        resume = options["resume"]
         xsl_path = os.path.join(mydir, "transform.xsl")
         after_rng = os.path.join(mydir, "after.rng")
         log_dir = os.path.join(mydir, "log")
+        state_path = os.path.join(mydir, "state")
 
         if not os.path.exists(xsl_path):
             raise CommandError(xsl_path + " does not exist.")
@@ -62,11 +86,19 @@ WARNING: in general, this operation cannot be reliably undone without
         if not os.path.exists(after_rng):
             raise CommandError(after_rng + " does not exist.")
 
+        if noop and resume:
+            raise CommandError("--noop and --resume cannot be used together.")
+
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
 
-        if os.listdir(log_dir):
-            raise CommandError(log_dir + " is not empty.")
+        if resume:
+            if not os.path.exists(state_path):
+                raise CommandError(state_path + " does not exist.")
+        elif os.listdir(log_dir) or os.path.exists(state_path):
+            raise CommandError(log_dir + " is not empty or " + state_path +
+                               " exists; use --resume to continue an "
+                               "interrupted transformation.")
 
         # Make sure there are no active entry locks in the system.
         locked = Entry.objects.locked()
@@ -86,63 +118,141 @@ WARNING: in general, this operation cannot be reliably undone without
         self.stdout.write("Garbage-collecting chunks.")
         Chunk.objects.collect()
 
-        self.stdout.write("Transforming all entries.")
-        chunk_mapping = {}
-        for data in ChangeRecord.objects.all():
-            initially_invalid = False
-
-            chunk = data.c_hash
-            if chunk.pk not in chunk_mapping:
-                os.makedirs(os.path.join(log_dir, chunk.pk))
-                with open(os.path.join(log_dir, chunk.pk, "before.xml"), 'w') \
-                        as before:
-                    before.write(chunk.data.encode('utf-8'))
-
-                if chunk.is_normal:
-                    if chunk.schema_version == "":
-                        self.stdout.write("Correcting lack of version")
-                        chunk.schema_version = \
-                            xml.XMLTree(chunk.data.encode('utf-8')) \
-                               .extract_version()
-
-                    if not chunk.valid:
-                        initially_invalid = True
-
-                    # We do not use lxml for this because lxml only
-                    # supports xslt 1.0 and we want to be able to run
-                    # 2.0 transforms.
-                    converted = util.run_saxon(xsl_path, chunk.data)
-                    new_chunk = Chunk()
-                    new_chunk.data = converted
-                    new_chunk.schema_version = \
-                        xml.XMLTree(
-                            converted.encode('utf-8')).extract_version()
-                    new_chunk._valid = util.validate_with_rng(after_rng,
-                                                              converted)
-                else:
-                    # Abnormal chunk. We won't try to validate and convert.
-                    initially_invalid = True
-                    converted = chunk.data
-                    new_chunk = chunk
-
-                with open(os.path.join(log_dir, chunk.pk, "after.xml"), 'w') \
-                        as after:
-                    after.write(converted.encode('utf-8'))
-
-                new_chunk.clean()  # Generate the pk
-                chunk_mapping[chunk.pk] = new_chunk.pk
-
-                if not initially_invalid and not new_chunk.valid:
-                    with open(os.path.join(log_dir, chunk.pk,
-                                           "BECAME_INVALID"), 'w'):
-                        pass
-
-                if not options['noop']:
-                    new_chunk.save()
-
-            if not options['noop']:
-                data.c_hash = Chunk.objects.get(pk=chunk_mapping[chunk.pk])
-                data.save()
+        # The change records that have already been updated by a
+        # previous run. We must not transform them again.
+        done = {}
+        if resume:
+            done = self.read_state(state_path)
+
+        records = self.pending_records(done)
+        if resume:
+            self.stdout.write("Resuming: {0} change records already "
+                              "transformed.".format(
+                                  ChangeRecord.objects.count() -
+                                  sum(len(pks) for pks in records.values())))
+
+        pks = sorted(records.keys())
+        total = len(pks)
+        self.stdout.write("Transforming {0} chunks.".format(total))
+        start = time.time()
+        count = 0
+        failed = []
+        with open(state_path, 'a', encoding="utf-8") as state:
+            for reports in transform_chunks(
+                    xsl_path, after_rng, log_dir, pks, save=not noop,
+                    workers=options["workers"],
+                    batch_size=options["batch_size"]):
+                failed.extend(report for report in reports if report.error)
+                transformed = [report for report in reports
+                               if not report.error]
+                if not noop:
+                    self.remap(state, records, transformed)
+                count += len(reports)
+                self.report_progress(count, total, start)
+
+        if failed:
+            self.stderr.write("The following chunks could not be "
+                              "transformed:")
+            for report in failed:
+                self.stderr.write("{0}: {1}".format(report.pk, report.error))
 
         self.stdout.write("Garbage-collecting chunks.")
         Chunk.objects.collect()
+
+        if failed:
+            raise CommandError("{0} chunks could not be transformed; run "
+                               "again with --resume after fixing the "
+                               "problem.".format(len(failed)))
+
+    @staticmethod
+    def read_state(state_path):
+        """
+        Read the state file left by a previous run.
+
+        An interrupted write may leave a truncated line at the end of
+        the file. Since the state is written before the transaction
+        that updates the change records commits, the update it records
+        did not happen. We ignore the line and remove it from the file
+        so that the lines we append are not corrupted by it.
+
+        :returns: A map from the primary keys of the change records
+                  that were recorded as transformed to the primary key
+                  of the chunk that they were made to refer to.
+        :rtype: :class:`dict`
+        """
+        done = {}
+        with open(state_path, 'r+b') as state:
+            lines = state.read().split(b"\n")
+            # Complete lines end with a newline, so the last item is
+            # empty unless the last line is truncated.
+            partial = lines.pop()
+            if partial:
+                state.truncate(state.tell() - len(partial))
+
+            for line in lines:
+                try:
+                    entry = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    raise CommandError("corrupt line in {0}: {1}"
+                                       .format(state_path, line))
+                for record in entry["records"]:
+                    done[record] = entry["new"]
+        return done
+
+    @staticmethod
+    def pending_records(done):
+        """
+        Get the change records that remain to be transformed.
+
+        :param done: The value returned by :meth:`read_state`.
+        :type done: :class:`dict`
+        :returns: A map from chunk primary key to the list of the
+                  change records that refer to the chunk and remain to
+                  be transformed. A change record that was recorded as
+                  transformed still needs to be transformed if it does
+                  not refer to the chunk that the state records. This
+                  happens if the transaction that was to update it did
+                  not commit.
+        :rtype: :class:`dict`
+        """
+        records = defaultdict(list)
+        for record_pk, chunk_pk in \
+                ChangeRecord.objects.values_list("pk", "c_hash"):
+            if done.get(record_pk) != chunk_pk:
+                records[chunk_pk].append(record_pk)
+        return records
+
+    @staticmethod
+    def remap(state, records, reports):
+        """
+        Make the change records refer to the transformed chunks, and
+        record the change in the state file.
+        """
+        with transaction.atomic():
+            for report in reports:
+                if report.new_pk != report.pk:
+                    ChangeRecord.objects \
+                        .filter(pk__in=records[report.pk]) \
+                        .update(c_hash=report.new_pk)
+
+            # We record the state before committing so that there is
+            # no window in which committed changes are
+            # unrecorded. If the transaction does not commit,
+            # ``pending_records`` finds that the records do not refer
+            # to the chunks recorded here.
+            for report in reports:
+                state.write(json.dumps({
+                    "old": report.pk,
+                    "new": report.new_pk,
+                    "records": records[report.pk]
+                }) + "\n")
+            state.flush()
+            os.fsync(state.fileno())
+
+    def report_progress(self, count, total, start):
+        elapsed = time.time() - start
+        eta = elapsed / count * (total - count) if count else 0
+        self.stdout.write(
+            "{0}/{1} chunks ({2:.1f}%), elapsed: {3:.0f}s, ETA: {4:.0f}s"
+            .format(count, total, count * 100 / total if total else 100,
+                    elapsed, eta))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lexicography', '0007_changerecord_hidden'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkSearchIndex',
+            fields=[
+                ('chunk', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='lexicography.Chunk')),
+                ('lemma', models.TextField(help_text='The text of the lemmas of the chunk.')),
+                ('text', models.TextField(help_text='The whole text of the chunk.')),
+                ('lemma_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('text_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='chunksearchindex',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['lemma_vector'], name='lexicography_lemma_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='chunksearchindex',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['text_vector'], name='lexicography_text_gin'),
+        ),
+    ]
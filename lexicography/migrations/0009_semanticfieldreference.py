@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lexicography', '0008_chunksearchindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SemanticFieldReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField(db_index=True, help_text='The reference exactly as it appears in the article. It may be a complex expression that combines multiple semantic fields.')),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='lexicography.Chunk')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='semanticfieldreference',
+            unique_together={('chunk', 'path')},
+        ),
+    ]
@@ -1,6 +1,8 @@
 import hashlib
 import datetime
+import time
 import logging
+from collections import namedtuple
 
 from django.db import models
 from django.urls import reverse
@@ -9,22 +11,27 @@ from django.core.cache import caches
 from django.conf import settings
 from django.utils.decorators import method_decorator
 from django.db import transaction
+from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.indexes import GinIndex
 from pyexistdb.exceptions import ExistDBException
 
 from lib import util
 from lib.util import on_change
 from lib import existdb
 from lib.existdb import get_collection_path, list_collection, \
-    query_iterator, get_path_for_chunk_hash, ExistDB
+    query_iterator, get_path_for_chunk_hash, get_db
 from lib import xquery
 from . import usermod
 from . import xml
 from . import signals
+from . import depman
 # This is just to make sure that caching is loaded whenever models are
 # loaded. Django 1.6 does not have a neat way to do this. We could
 # load caching in __init__.py but it has side-effects.
 from . import caching as _
-from .caching import make_display_key
+from .caching import make_display_key, make_display_channel, \
+    invalidate_lemma_dependents, delete_hyperlinks, bump_search_generation, \
+    make_text_key
 from semantic_fields.models import SemanticField
 
 cache = caches['article_display']
@@ -281,12 +288,18 @@ class Entry(models.Model):
                         note)
         return True
 
+def _lemma_changed(instance):
+    # Other articles may have been linking to the old lemma, or may
+    # link to the new one.
+    invalidate_lemma_dependents([instance._prev_state, instance.lemma])
+
+on_change(Entry, lambda entry: entry.lemma, _lemma_changed)
+
 
 class ChangeRecordManager(models.Manager):
 
     def with_semantic_field(self, sf, include_unpublished=False):
-        chunks = Chunk.objects.hashes_with_semantic_field(sf)
-        qs = self.filter(c_hash__in=chunks)
+        qs = self.filter(c_hash__semanticfieldreference__path=sf)
         if not include_unpublished:
             qs = qs.filter(published=True)
 
@@ -454,6 +467,8 @@ on_change(ChangeRecord, lambda obj: obj.hidden,
           emit_changerecord_hidden_or_shown)
 
 
+SyncReport = namedtuple("SyncReport", ("loaded", "removed", "unchanged"))
+
 class ChunkManager(models.Manager):
 
     @method_decorator(transaction.atomic)
@@ -491,58 +506,119 @@ class ChunkManager(models.Manager):
                            changerecord__hidden=False).distinct()
 
     def sync_with_exist(self):
-        self.collect()
-        db = ExistDB()
-        present = set()
-        for chunk in self.all_syncable_chunks():
-            chunk.sync_with_exist(db)
-            present.add(chunk.c_hash)
+        """
+        Make the chunk collection in eXist match the chunks in the
+        database: load the chunks that are missing from eXist and
+        remove from eXist the documents of chunks that no longer exist.
 
-        self._remove_absent(db, present, get_collection_path("chunks"))
+        We list the collection once and compute what needs to be done
+        locally, rather than checking the presence of each chunk in
+        eXist.
 
-    def prepare(self, kind, include_unpublished):
+        :returns: The counts of documents loaded, removed and left as
+                  they were.
+        :rtype: :class:`SyncReport`
+        """
+        self.collect()
+        db = get_db()
+        collection_path = get_collection_path("chunks")
+        listing = list_collection(db, collection_path) \
+            if db.hasCollection(collection_path) else set()
+        in_exist = set(path.rsplit("/", 1)[-1] for path in listing)
+        present = set()
+        missing = []
+
+        for c_hash in self.all_syncable_chunks() \
+                          .values_list("c_hash", flat=True).iterator():
+            present.add(c_hash)
+            # See Chunk.sync_with_exist for why we do not reload
+            # documents that are already present.
+            if c_hash not in in_exist:
+                missing.append(c_hash)
+
+        def docs():
+            # We fetch the data in slices to avoid loading all of it
+            # in memory at once.
+            for start in range(0, len(missing), 100):
+                for chunk in self.filter(
+                        c_hash__in=missing[start:start + 100]):
+                    yield (chunk.exist_path("chunks"), chunk.data)
+
+        loaded = db.load_many(docs())
+        removed = self._remove_absent(db, present, collection_path, listing)
+
+        return SyncReport(loaded, removed, len(present) - loaded)
+
+    def prepare(self, kind, include_unpublished, workers=None):
+        """
+        Prepare all the chunks that can be prepared and remove from
+        eXist the prepared documents of those chunks that no longer
+        exist.
+
+        :param kind: The kind of data to prepare. Only ``"xml"`` is
+                     supported.
+        :param include_unpublished: Whether to prepare the chunks that
+                                    are not published.
+        :param workers: If ``None``, the chunks are prepared one by one
+                        in the current process. Otherwise, they are
+                        prepared with
+                        :func:`lexicography.batch.prepare_chunks` using
+                        this number of workers.
+        :returns: If ``workers`` is ``None``, ``None``. Otherwise, the
+                  list of :class:`lexicography.batch.PreparationReport`
+                  for all the chunks prepared.
+        """
         if kind != "xml":
             raise ValueError("the manager only supports preparing XML data; "
                              "future versions may support other kinds")
 
         self.collect()
-        db = ExistDB()
-        present = set()
+        db = get_db()
         chunks = self.all_syncable_chunks()
         if not include_unpublished:
             chunks = chunks.filter(changerecord__published=True)
-        for chunk in chunks:
-            chunk.prepare("xml", True)
-            present.add(chunk.c_hash)
 
-        self._remove_absent(db, present, get_collection_path("display"))
+        reports = None
+        if workers is None:
+            present = set()
+            for chunk in chunks:
+                chunk.prepare("xml", True)
+                present.add(chunk.c_hash)
+        else:
+            from .batch import prepare_chunks
+            present = set(chunks.values_list("c_hash", flat=True))
+            reports = list(prepare_chunks(sorted(present), workers))
+
+        from .search import get_backend
+        removed = self._remove_absent(db, present,
+                                      get_collection_path("display"))
+        SemanticFieldReference.objects.exclude(chunk_id__in=present).delete()
+        if removed + get_backend().retain(present):
+            bump_search_generation()
+
+        return reports
 
     @staticmethod
-    def _remove_absent(db, present, collection_path):
-        for path in list_collection(db, collection_path):
+    def _remove_absent(db, present, collection_path, listing=None):
+        if listing is None:
+            listing = list_collection(db, collection_path)
+
+        removed = 0
+        for path in listing:
             base = path.rsplit("/", 1)[-1]
             if base not in present:
                 db.removeDocument(path, True)
+                removed += 1
+
+        return removed
 
     def hashes_with_semantic_field(self, sf):
         """
         Returns a set of chunk *hashes* that contain the semantic field
         requested.
         """
-        db = ExistDB()
-        chunks = set()
-
-        for query_chunk in query_iterator(db, xquery.format(
-                """\
-for $m in collection({db})//btw:sf[@ref = {path}]
-return util:document-name($m)""",
-                db=get_collection_path("display"),
-                path=sf)):
-
-            for result in query_chunk.values:
-                chunks.add(result)
-
-        return chunks
+        return set(SemanticFieldReference.objects.filter(path=sf)
+                   .values_list("chunk_id", flat=True))
 
 class Chunk(models.Model):
     objects = ChunkManager()
@@ -680,7 +756,7 @@ class Chunk(models.Model):
         if not self.is_normal:
             return
 
-        db = db or ExistDB()
+        db = db or get_db()
         # Reminder: chunks are immutable. So if a chunk has been put
         # in eXist already, then we do not want to reput that data. If
         # we were to overwrite the data with the same value, it is not
@@ -750,18 +826,55 @@ class Chunk(models.Model):
             "bibl_data": bibl
         }
 
+    def wait_for_display_data(self, timeout):
+        """
+        Get the display data of this chunk, waiting for it to be
+        prepared if needed. This is like :meth:`get_display_data`
+        except that if the data is not available, we wait until the
+        tasks preparing the data announce that they are done, or until
+        the timeout expires.
+
+        :param timeout: The maximum time to wait, in seconds.
+        :type timeout: :class:`float`
+        :returns: The display data, or ``None`` if it was not
+                  available in time.
+        """
+        data = self.get_display_data()
+        if data is not None or timeout <= 0:
+            return data
+
+        deadline = time.time() + timeout
+        # We subscribe *before* checking again, so that we cannot miss
+        # an announcement made between the check and the subscription.
+        with util.subscription('article_display',
+                               make_display_channel(self.pk)) as sub:
+            while True:
+                data = self.get_display_data()
+                remaining = deadline - time.time()
+                if data is not None or remaining <= 0:
+                    return data
+                sub.get_message(timeout=remaining)
+
     def _create_cached_data(self):
         self.sync_with_exist()
         self.prepare("xml")
 
     def _delete_cached_data(self):
         if self.is_normal:
-            db = ExistDB()
+            db = get_db()
             db.removeDocument(self.exist_path("chunks"), True)
             db.removeDocument(self.exist_path("display"), True)
+            SemanticFieldReference.objects.filter(chunk=self).delete()
+            from .search import get_backend
+            get_backend().remove([self.pk])
+            bump_search_generation()
 
             cache.delete_many(self.display_key(kind)
                               for kind in self.key_kinds)
+            delete_hyperlinks([self.pk])
+            cache.delete(make_text_key(self.pk))
+            depman.bibl.remove_dependent(self.display_key("bibl"))
+            depman.lemma.remove_dependent(self.pk)
         # else:
         # We were not saved there in the first place. Remember that chunks
         # are immutable. So a normal chunk cannot become abnormal, or
@@ -823,6 +936,127 @@ class ChunkMetadata(models.Model):
     )
     semantic_fields = models.ManyToManyField(SemanticField)
 
+class SemanticFieldReferenceManager(models.Manager):
+
+    def replace_for_chunk(self, pk, paths):
+        """
+        Make the references recorded for a chunk be those passed.
+
+        :param pk: The primary key of the chunk.
+        :param paths: The references the chunk makes.
+        :type paths: :class:`set` of :class:`str`
+        :returns: Whether the references recorded changed.
+        :rtype: :class:`bool`
+        """
+        current = dict(self.filter(chunk_id=pk).values_list("path", "pk"))
+        stale = [ref_pk for (path, ref_pk) in current.items()
+                 if path not in paths]
+        if stale:
+            self.filter(pk__in=stale).delete()
+        new = [SemanticFieldReference(chunk_id=pk, path=path)
+               for path in paths if path not in current]
+        self.bulk_create(new)
+        return bool(stale or new)
+
+    @staticmethod
+    def references_in_exist():
+        """
+        Get the semantic field references made by the documents of the
+        display collection in eXist.
+
+        :returns: The references as pairs of chunk key and reference.
+        :rtype: :class:`set` of :class:`tuple`
+        """
+        db = get_db()
+        refs = set()
+        for query_chunk in query_iterator(db, xquery.format(
+                """\
+for $ref in collection({db})//btw:sf/@ref
+return concat(util:document-name($ref), " ", $ref)""",
+                db=get_collection_path("display"))):
+            for value in query_chunk.values:
+                refs.add(tuple(str(value).split(" ", 1)))
+        return refs
+
+    def compare_with_exist(self):
+        """
+        Compare the references recorded with those found in eXist.
+
+        :returns: The references that are missing from the table and
+                  the references that the table has but should not
+                  have, as sets of pairs of chunk key and reference.
+        :rtype: :class:`tuple`
+        """
+        expected = self.references_in_exist()
+        recorded = set(self.values_list("chunk_id", "path"))
+        return expected - recorded, recorded - expected
+
+    def backfill(self, batch_size=1000):
+        """
+        Make the references recorded be those found in eXist.
+
+        :returns: The number of references added and removed.
+        :rtype: :class:`tuple`
+        """
+        expected = self.references_in_exist()
+        recorded = {(chunk_id, path): pk for (pk, chunk_id, path)
+                    in self.values_list("pk", "chunk_id", "path")}
+        extra = [pk for (ref, pk) in recorded.items() if ref not in expected]
+        # We skip the references of chunks that no longer exist.
+        existing = set(Chunk.objects.filter(
+            pk__in={chunk_id for (chunk_id, _) in expected})
+                       .values_list("pk", flat=True))
+        missing = [SemanticFieldReference(chunk_id=chunk_id, path=path)
+                   for (chunk_id, path) in expected - recorded.keys()
+                   if chunk_id in existing]
+        with transaction.atomic():
+            for start in range(0, len(extra), batch_size):
+                self.filter(pk__in=extra[start:start + batch_size]).delete()
+            self.bulk_create(missing, batch_size=batch_size)
+        return len(missing), len(extra)
+
+class SemanticFieldReference(models.Model):
+    """
+    A reference to a semantic field made by the display XML of a
+    chunk. This is the index used to find the articles that refer to a
+    semantic field. It covers the chunks that are in the display
+    collection.
+    """
+    objects = SemanticFieldReferenceManager()
+
+    chunk = models.ForeignKey(Chunk, on_delete=models.CASCADE)
+    path = models.TextField(
+        db_index=True,
+        help_text="The reference exactly as it appears in the article. "
+        "It may be a complex expression that combines multiple semantic "
+        "fields."
+    )
+
+    class Meta(object):
+        unique_together = (("chunk", "path"), )
+
+class ChunkSearchIndex(models.Model):
+    """
+    The full-text index of the display XML of a chunk. This is used by
+    :class:`lexicography.search.PostgresBackend`.
+    """
+    chunk = models.OneToOneField(Chunk, on_delete=models.CASCADE,
+                                 primary_key=True)
+    lemma = models.TextField(
+        help_text="The text of the lemmas of the chunk."
+    )
+    text = models.TextField(
+        help_text="The whole text of the chunk."
+    )
+    lemma_vector = SearchVectorField(null=True)
+    text_vector = SearchVectorField(null=True)
+
+    class Meta(object):
+        indexes = [
+            GinIndex(fields=["lemma_vector"], name="lexicography_lemma_gin"),
+            GinIndex(fields=["text_vector"], name="lexicography_text_gin"),
+        ]
+
 class DeletionChange(models.Model):
     DELETE = 'D'
     UNDELETE = 'U'
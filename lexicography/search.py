@@ -0,0 +1,306 @@
+"""
+The backends that perform searches in articles.
+
+The search table goes through the backend selected by the
+``LEXICOGRAPHY_SEARCH_BACKEND`` setting, which is the dotted path of a
+:class:`SearchBackend` subclass. Two backends are available:
+
+* :class:`ExistBackend` searches the display collection of eXist-db.
+  This is the historical behavior of BTW.
+
+* :class:`PostgresBackend` searches a full-text index stored in the
+  database, which does not require eXist-db.
+
+The index of a backend is maintained by
+:func:`lexicography.tasks.prepare_chunk_xml`, which indexes each
+chunk it prepares.
+"""
+from functools import lru_cache
+from collections import OrderedDict
+
+import lxml.etree
+from django.conf import settings
+from django.db.models import F, Func, Value, TextField
+from django.contrib.postgres.search import SearchQuery, SearchRank, \
+    SearchVector
+from django.utils.module_loading import import_string
+
+from .models import ChunkSearchIndex
+from .xml import default_namespace_mapping
+from lib.existdb import query_iterator, is_lucene_query_clean, \
+    get_collection_path, get_db
+from lib import xquery, lucene
+
+class SearchBackend(object):
+    """
+    The interface of search backends. Documents are identified by
+    the primary key of the chunk they were produced from.
+    """
+
+    def is_query_clean(self, query):
+        """
+        Check whether a query is syntactically correct.
+
+        :param query: The query to check.
+        :type query: :class:`str`
+        :rtype: :class:`bool`
+        """
+        raise NotImplementedError
+
+    def search(self, query, lemmata_only):
+        """
+        Find the documents that match a query.
+
+        :param query: The query.
+        :type query: :class:`str`
+        :param lemmata_only: Whether to search only the lemmas.
+        :type lemmata_only: :class:`bool`
+        :returns: The names of the documents and their scores, in
+                  order of decreasing score.
+        :rtype: :class:`list` of (:class:`str`, :class:`float`) pairs.
+        """
+        raise NotImplementedError
+
+    def hits(self, query, names):
+        """
+        Produce the hits of a query for a set of documents.
+
+        :param query: The query.
+        :type query: :class:`str`
+        :param names: The names of the documents.
+        :type names: :class:`set` of :class:`str`
+        :returns: A map of document name to a ``<hit>`` element that
+                  contains the hits for the document, in the format
+                  produced by eXist-db's ``kwic:summarize``.
+        :rtype: :class:`dict`
+        """
+        raise NotImplementedError
+
+    def index(self, pk, data):
+        """
+        Index the display XML of a chunk.
+
+        :param pk: The primary key of the chunk.
+        :param data: The display XML.
+        :type data: :class:`str`
+        :returns: Whether the index changed.
+        :rtype: :class:`bool`
+        """
+        raise NotImplementedError
+
+    def remove(self, pks):
+        """
+        Remove chunks from the index.
+
+        :param pks: The primary keys of the chunks to remove.
+        :returns: The number of chunks removed.
+        :rtype: :class:`int`
+        """
+        raise NotImplementedError
+
+    def retain(self, pks):
+        """
+        Remove from the index all the chunks that are not among those
+        passed.
+
+        :param pks: The primary keys of the chunks to keep.
+        :returns: The number of chunks removed.
+        :rtype: :class:`int`
+        """
+        raise NotImplementedError
+
+class ExistBackend(SearchBackend):
+    """
+    A backend that searches the display collection of eXist-db. The
+    display collection is maintained independently of the search
+    backend, so the methods that maintain the index do nothing.
+    """
+
+    def is_query_clean(self, query):
+        return _is_lucene_query_clean(query)
+
+    def search(self, query, lemmata_only):
+        db = get_db()
+        scope = "//btw:lemma" if lemmata_only else "//btw:entry"
+        results = OrderedDict()
+        for query_chunk in query_iterator(db, xquery.format(
+                """\
+for $m in collection({db}){scope}[ft:query(., {search_text})]
+let $score := ft:score($m)
+order by $score descending
+return concat(util:document-name($m), " ", $score)""",
+                db=get_collection_path("display"),
+                scope=xquery.Verbatim(scope),
+                search_text=query)):
+            for value in query_chunk.values:
+                name, score = str(value).split(" ", 1)
+                # A document could appear more than once if the scope
+                # matches more than one element in it. We keep the
+                # first, which has the highest score.
+                results.setdefault(name, float(score))
+
+        return list(results.items())
+
+    def hits(self, query, names):
+        if not names:
+            return {}
+
+        db = get_db()
+        result = db.query(xquery.format(
+            """\
+import module namespace kwic="http://exist-db.org/xquery/kwic";
+for $name in {names}
+for $m in doc(concat({db}, "/", $name))//btw:entry[ft:query(., {search_text})]
+return <result><doc>{doc}</doc><hit>{hit}</hit></result>""",
+            db=get_collection_path("display"),
+            names=sorted(names),
+            doc=xquery.Verbatim("{$name}"),
+            hit=xquery.Verbatim("{kwic:summarize($m, <config width='80'/>)}"),
+            search_text=query), how_many=len(names))
+
+        # Content of <doc> -> <hit>.
+        return {item[0].text: item[1] for item in result.results}
+
+    def index(self, pk, data):
+        return False
+
+    def remove(self, pks):
+        return 0
+
+    def retain(self, pks):
+        return 0
+
+@lru_cache(maxsize=1024)
+def _is_lucene_query_clean(query):
+    # We check the syntax locally and ask eXist only if we cannot
+    # decide. The verdicts are cached because the same query is
+    # checked each time the search table is paged or sorted.
+    verdict = lucene.check_syntax(query)
+    if verdict is None:
+        verdict = is_lucene_query_clean(get_db(), query)
+    return verdict
+
+# Characters from the private use area, which do not appear in
+# articles, used to mark up the output of ts_headline.
+_START_SEL = "\ue000"
+_STOP_SEL = "\ue001"
+_FRAGMENT_DELIMITER = "\ue002"
+
+class PostgresBackend(SearchBackend):
+    """
+    A backend that searches a full-text index stored in
+    :class:`lexicography.models.ChunkSearchIndex`.
+
+    Queries are interpreted as plain text: all the words of the query
+    must appear in a document for it to match. The Lucene syntax is
+    not supported.
+    """
+
+    config = "simple"
+    """
+    The text search configuration. We do not stem words because
+    articles mix many languages.
+    """
+
+    def _query(self, query):
+        return SearchQuery(query, config=self.config)
+
+    def is_query_clean(self, query):
+        # Any string is acceptable as plain text.
+        return True
+
+    def search(self, query, lemmata_only):
+        field = "lemma_vector" if lemmata_only else "text_vector"
+        search_query = self._query(query)
+        qs = ChunkSearchIndex.objects \
+            .filter(**{field: search_query}) \
+            .annotate(score=SearchRank(F(field), search_query)) \
+            .order_by("-score", "chunk_id") \
+            .values_list("chunk_id", "score")
+        return list(qs)
+
+    def hits(self, query, names):
+        if not names:
+            return {}
+
+        options = "StartSel={}, StopSel={}, MaxFragments=3, " \
+            "FragmentDelimiter={}".format(_START_SEL, _STOP_SEL,
+                                          _FRAGMENT_DELIMITER)
+        qs = ChunkSearchIndex.objects.filter(chunk_id__in=names).annotate(
+            headline=Func(Value(self.config), F("text"), self._query(query),
+                          Value(options), function="ts_headline",
+                          output_field=TextField())) \
+            .values_list("chunk_id", "headline")
+
+        return {name: _make_hit(headline) for (name, headline) in qs}
+
+    def index(self, pk, data):
+        tree = lxml.etree.fromstring(data.encode("utf-8"))
+        lemma = _normalize_space(" ".join(
+            " ".join(el.itertext()) for el in
+            tree.iterfind(".//btw:lemma", default_namespace_mapping)))
+        text = _normalize_space(" ".join(tree.itertext()))
+
+        try:
+            current = ChunkSearchIndex.objects.get(chunk_id=pk)
+            if (current.lemma, current.text) == (lemma, text):
+                return False
+        except ChunkSearchIndex.DoesNotExist:
+            pass
+
+        ChunkSearchIndex.objects.update_or_create(
+            chunk_id=pk, defaults={"lemma": lemma, "text": text})
+        ChunkSearchIndex.objects.filter(chunk_id=pk).update(
+            lemma_vector=SearchVector("lemma", config=self.config),
+            text_vector=SearchVector("text", config=self.config))
+        return True
+
+    def remove(self, pks):
+        return ChunkSearchIndex.objects.filter(chunk_id__in=pks).delete()[0]
+
+    def retain(self, pks):
+        return ChunkSearchIndex.objects.exclude(chunk_id__in=pks) \
+                                       .delete()[0]
+
+def _normalize_space(text):
+    return " ".join(text.split())
+
+def _make_hit(headline):
+    """
+    Convert the output of ``ts_headline`` to the format produced by
+    eXist-db's ``kwic:summarize``.
+    """
+    hit = lxml.etree.Element("hit")
+    for fragment in headline.split(_FRAGMENT_DELIMITER):
+        p = lxml.etree.SubElement(hit, "p")
+        parts = fragment.replace(_STOP_SEL, _START_SEL).split(_START_SEL)
+        # Even indexes are context, odd indexes are matches.
+        previous = lxml.etree.SubElement(p, "span")
+        previous.set("class", "previous")
+        previous.text = parts[0]
+        last = previous
+        for ix in range(1, len(parts)):
+            if ix % 2:
+                last = lxml.etree.SubElement(p, "span")
+                last.set("class", "hi")
+                last.text = parts[ix]
+            elif ix == len(parts) - 1:
+                last = lxml.etree.SubElement(p, "span")
+                last.set("class", "following")
+                last.text = parts[ix]
+            else:
+                last.tail = parts[ix]
+    return hit
+
+@lru_cache(maxsize=None)
+def _get_backend(path):
+    return import_string(path)()
+
+def get_backend():
+    """
+    Get the search backend selected by the
+    ``LEXICOGRAPHY_SEARCH_BACKEND`` setting.
+
+    :rtype: :class:`SearchBackend`
+    """
+    return _get_backend(settings.LEXICOGRAPHY_SEARCH_BACKEND)
@@ -5,16 +5,22 @@ import hashlib
 from celery.utils.log import get_task_logger
 from celery import Task
 from django.core.cache import caches
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import router, transaction
 from django.conf import settings
+from django.urls import Resolver404
 
 from btw.celery import app
-from .models import Chunk, ChunkMetadata
+from .models import Chunk, ChunkMetadata, SemanticFieldReference
 from . import depman
-from .article import prepare_article_data, get_bibliographical_data
-from .caching import make_display_key
+from .article import ArticlePipeline, get_bibliographical_data, get_text
+from .search import get_backend
+from .caching import make_display_key, make_display_channel, \
+    make_text_key, bump_search_generation
+from bibliography.views import targets_to_dicts
+from lib import util
 from lib.tasks import acquire_mutex, HELD
-from lib.existdb import ExistDB, get_path_for_chunk_hash
+from lib.existdb import get_db, get_path_for_chunk_hash
 
 logger = get_task_logger(__name__)
 
@@ -52,6 +58,22 @@ def prepare_xml(pk):
     :param pk: The primary key of the chunk to prepare.
     :type pk: :class:`int`
     """
+    prepare_chunk_xml(pk)
+
+
+def prepare_chunk_xml(pk, sf_cache=None):
+    """
+    This is the function that does the actual work of
+    :func:`prepare_xml`. It is separate from the task so that it can be
+    called directly when preparing chunks in bulk. (See
+    :mod:`lexicography.batch`.)
+
+    :param pk: The primary key of the chunk to prepare.
+    :type pk: :class:`int`
+    :param sf_cache: A cache of semantic field records shared among
+                     multiple calls to this function.
+    :type sf_cache: :class:`lexicography.article.SemanticFieldCache`
+    """
 
     # By using atomicity and using select_for_update we are
     # effectively preventing other prepare_xml tasks from working on
@@ -64,17 +86,46 @@ def prepare_xml(pk):
             .select_for_update() \
             .get_or_create(chunk=chunk)
 
-        data = chunk.data
-        xml, sf_records = prepare_article_data(data)
+        # The bibliographical data is resolved separately, below, so
+        # that a problem with it does not prevent preparing the XML.
+        result = ArticlePipeline(chunk.data, sf_cache).run(bibl_data=False)
+        xml = result.xml
+        sf_records = result.sf_records
 
         cache.set(key, xml, timeout=settings.LEXICOGRAPHY_XML_TIMEOUT)
+        cache.set(make_text_key(pk), result.text,
+                  timeout=settings.LEXICOGRAPHY_XML_TIMEOUT)
 
         logger.debug("%s is set", key)
 
+        # We got the bibliographical targets for free, so we try to
+        # cache the bibliographical data too. If the targets cannot be
+        # resolved, we leave it to prepare_bibl to report the
+        # problem. We use ``add`` so as to not step on a prepare_bibl
+        # task that would hold the key.
+        bibl_key = chunk.display_key("bibl")
+        try:
+            bibl_data = targets_to_dicts(result.bibl_targets)
+        except (ValueError, Resolver404, ObjectDoesNotExist) as ex:
+            logger.debug("%s cannot be set: %s", bibl_key, ex)
+        else:
+            depman.bibl.replace_dependencies(bibl_key, result.bibl_targets)
+            if cache.add(bibl_key, bibl_data):
+                logger.debug("%s is set", bibl_key)
+
+        # We record the lemmas this chunk refers to so that changes to
+        # the entries having these lemmas invalidate the hyperlinked
+        # data of this chunk.
+        depman.lemma.replace_dependencies(pk, result.lemmas)
+
+        # We record the semantic fields the chunk refers to so that we
+        # can find the articles that refer to a semantic field.
+        SemanticFieldReference.objects.replace_for_chunk(pk, result.sf_refs)
+
         sha1 = hashlib.sha1()
         sha1.update(xml.encode('utf-8'))
         xml_hash = sha1.hexdigest()
-        db = ExistDB()
+        db = get_db()
         path = get_path_for_chunk_hash("display", pk)
         absent = not db.hasDocument(path)
         if meta.xml_hash != xml_hash or absent:
@@ -94,6 +145,16 @@ def prepare_xml(pk):
             meta.save()
             if not db.load(xml.encode("utf-8"), path):
                 raise Exception("could not sync with eXist database")
+            bump_search_generation()
+
+        if get_backend().index(pk, xml):
+            bump_search_generation()
+
+        # We announce the data only once it is durable, so that those
+        # who wait for it do not act on data that may be rolled back.
+        transaction.on_commit(
+            lambda: util.publish('article_display',
+                                 make_display_channel(pk), "xml"))
 
 
 def fetch_xml(pk):
@@ -122,12 +183,15 @@ def fetch_xml(pk):
         xml = None
         if meta:
             path = get_path_for_chunk_hash("display", pk)
-            db = ExistDB()
+            db = get_db()
             xml = db.getDocument(path).decode("utf-8")
 
             if xml:
                 cache.set(key, xml,
                           timeout=settings.LEXICOGRAPHY_XML_TIMEOUT)
+                # The text expires with the XML, so we restore it too.
+                cache.set(make_text_key(pk), get_text(xml),
+                          timeout=settings.LEXICOGRAPHY_XML_TIMEOUT)
 
         return xml
 
@@ -180,9 +244,10 @@ def prepare_bibl(self, pk, test=None):
     (targets, bibl_data) = get_bibliographical_data(data)
 
     # We record that this article (i.e. key) depends on all the targets.
-    for target in targets:
-        depman.bibl.record(target, key)
+    depman.bibl.replace_dependencies(key, targets)
 
     cache.set(key, bibl_data)
 
     logger.debug("%s is set", key)
+
+    util.publish('article_display', make_display_channel(pk), "bibl")
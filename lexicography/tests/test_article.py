@@ -972,6 +972,63 @@ class HyperlinkPreparedDataTestCase(DisableMigrationsMixin, TestCase):
             },
             "the published xml should not contain correct article links")
 
+@override_settings(ROOT_URLCONF='lexicography.tests.urls')
+class ArticlePipelineTestCase(DisableMigrationsMixin, TestCase):
+    fixtures = list(os.path.join(dirname, "fixtures", x)
+                    for x in ("users.json", "views.json")) + [hte_fixture]
+
+    def setUp(self):
+        self.data = ChangeRecord.objects.get(pk=1).c_hash.data
+        return super(ArticlePipelineTestCase, self).setUp()
+
+    def test_unclean(self):
+        """
+        The pipeline fails on data that cannot be parsed.
+        """
+        with self.assertRaisesRegex(ValueError, "^the data is not clean$"):
+            article.ArticlePipeline("<div")
+
+    def test_run(self):
+        """
+        The pipeline produces the same results as the individual
+        functions.
+        """
+        result = article.ArticlePipeline(self.data).run()
+
+        xml_data, sf_records = article.prepare_article_data(self.data)
+        self.assertEqual(result.xml, xml_data)
+        self.assertEqual(set(result.sf_records), set(sf_records))
+
+        targets, bibl_data = article.get_bibliographical_data(self.data)
+        self.assertEqual(result.bibl_targets, targets)
+        self.assertEqual(result.bibl_data, bibl_data)
+
+        lemmas, _ = article.get_lemmas_and_terms(
+            xml.XMLTree(xml_data.encode("utf-8")))
+        self.assertEqual(result.lemmas, lemmas)
+
+        refs = lxml.etree.fromstring(xml_data.encode("utf-8")).xpath(
+            "//btw:sf/@ref", namespaces=xml.default_namespace_mapping)
+        self.assertEqual(result.sf_refs, set(refs))
+
+    def test_run_without_bibl_data(self):
+        """
+        The pipeline does not get the bibliographical data if asked not
+        to.
+        """
+        result = article.ArticlePipeline(self.data).run(bibl_data=False)
+        self.assertIsNone(result.bibl_data)
+
+    def test_run_once(self):
+        """
+        The pipeline cannot run twice.
+        """
+        pipeline = article.ArticlePipeline(self.data)
+        pipeline.run()
+        with self.assertRaisesRegex(ValueError,
+                                    "^the pipeline has already run$"):
+            pipeline.run()
+
 @override_settings(ROOT_URLCONF='lexicography.tests.urls')
 class AddSemanticFieldsToEnglishRenditionsTestCase(DisableMigrationsMixin,
                                                    TestCase):
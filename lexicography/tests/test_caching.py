@@ -7,10 +7,11 @@ from django.test import TestCase
 from django.test.utils import override_settings
 from django.core.cache import caches
 from django.urls import reverse
+from django.contrib.auth import get_user_model
 
 from ..models import ChangeRecord, Entry
 from bibliography.models import Item, PrimarySource
-from .. import tasks, depman
+from .. import tasks, depman, article, caching
 from bibliography.tests import mock_zotero
 from bibliography.tasks import fetch_items
 from .util import launch_fetch_task, create_valid_article, \
@@ -165,6 +166,16 @@ class CachingTestCase(DisableMigrationsMixin, TestCase):
                      "article {0} in the article_display cache")
                     .format(entry.lemma))
 
+    def test_prepare_xml_records_lemmas(self):
+        """
+        Preparing the XML of a chunk records the lemmas it refers to.
+        """
+        entry = create_valid_article()
+        pk = entry.latest.c_hash.pk
+        tasks.prepare_xml.delay(pk).get()
+        for lemma in ("foo", "abcd"):
+            self.assertIn(pk.encode("ascii"), depman.lemma.get(lemma))
+
     def test_item_changed(self):
         """
         Changing a bibliographical item invalidates the articles that
@@ -212,3 +223,192 @@ class CachingTestCase(DisableMigrationsMixin, TestCase):
                 "changed")
 
         self._generic_article_available(entries, op, False)
+
+
+@override_settings(ROOT_URLCONF='lexicography.tests.urls')
+class HyperlinkCachingTestCase(DisableMigrationsMixin, TestCase):
+    fixtures = list(os.path.join(dirname, "fixtures", x)
+                    for x in ("users.json", "views.json"))
+
+    def setUp(self):
+        cache.clear()
+        super(HyperlinkCachingTestCase, self).setUp()
+        self.chunk = ChangeRecord.objects.get(pk=1).c_hash
+        self.prepared = {"xml": self.chunk.data}
+
+    def test_cached(self):
+        """
+        The hyperlinked data is computed once and then read from the
+        cache.
+        """
+        first = article.get_hyperlinked_data(self.chunk, self.prepared, True)
+        with mock.patch("lexicography.article.hyperlink_prepared_data") \
+                as hyperlink, self.assertNumQueries(0):
+            second = article.get_hyperlinked_data(self.chunk, self.prepared,
+                                                  True)
+            self.assertFalse(hyperlink.called)
+        self.assertEqual(first, second)
+
+    def test_cached_per_audience(self):
+        """
+        The hyperlinked data is cached separately for each audience.
+        """
+        article.get_hyperlinked_data(self.chunk, self.prepared, True)
+        with mock.patch("lexicography.article.hyperlink_prepared_data",
+                        return_value="foo") as hyperlink:
+            self.assertEqual(
+                article.get_hyperlinked_data(self.chunk, self.prepared,
+                                             False),
+                "foo")
+            self.assertTrue(hyperlink.called)
+
+    def test_prepared_data_changed(self):
+        """
+        The hyperlinked data is recomputed if the prepared data changed.
+        """
+        article.get_hyperlinked_data(self.chunk, self.prepared, True)
+        with mock.patch("lexicography.article.hyperlink_prepared_data",
+                        return_value="foo") as hyperlink:
+            self.assertEqual(
+                article.get_hyperlinked_data(self.chunk, {"xml": "<div/>"},
+                                             True),
+                "foo")
+            self.assertTrue(hyperlink.called)
+
+    def test_lemma_dependents_invalidated(self):
+        """
+        The hyperlinked data is recomputed when an entry the chunk
+        refers to changes.
+        """
+        article.get_hyperlinked_data(self.chunk, self.prepared, True)
+        depman.lemma.record("foo", self.chunk.pk)
+        # We call the private function because the public one waits
+        # for a commit that never happens in a TestCase.
+        caching._invalidate_lemma_dependents(["foo"])
+        with mock.patch("lexicography.article.hyperlink_prepared_data",
+                        return_value="foo") as hyperlink:
+            self.assertEqual(
+                article.get_hyperlinked_data(self.chunk, self.prepared,
+                                             True),
+                "foo")
+            self.assertTrue(hyperlink.called)
+
+    def test_unrelated_lemma_does_not_invalidate(self):
+        """
+        The hyperlinked data is not recomputed when an entry the chunk
+        does not refer to changes.
+        """
+        article.get_hyperlinked_data(self.chunk, self.prepared, True)
+        depman.lemma.record("foo", "something else")
+        caching._invalidate_lemma_dependents(["foo"])
+        with mock.patch("lexicography.article.hyperlink_prepared_data") \
+                as hyperlink:
+            article.get_hyperlinked_data(self.chunk, self.prepared, True)
+            self.assertFalse(hyperlink.called)
+
+    def test_lemma_dependencies_recorded(self):
+        """
+        Hyperlinking records the lemmas the chunk depends on, even if
+        the chunk was not prepared by ``prepare_chunk_xml``.
+        """
+        with mock.patch("lexicography.article.get_lemmas_and_terms",
+                        return_value=({"foo"}, [])):
+            article.get_hyperlinked_data(self.chunk, self.prepared, True)
+        self.assertEqual(depman.lemma.get("foo"),
+                         {self.chunk.pk.encode("ascii")})
+
+    def test_concurrent_invalidation(self):
+        """
+        Hyperlinked data computed while an invalidation happens is not
+        reused, even though it is cached after the invalidation.
+        """
+        def invalidate(*args):
+            caching._invalidate_lemma_dependents(["foo"])
+            return False
+
+        with mock.patch("lexicography.article.get_lemmas_and_terms",
+                        return_value=({"foo"}, [])), \
+                mock.patch("lexicography.article.hyperlink_article",
+                           side_effect=invalidate):
+            article.get_hyperlinked_data(self.chunk, self.prepared, True)
+
+        with mock.patch("lexicography.article.hyperlink_prepared_data",
+                        return_value="foo") as hyperlink:
+            self.assertEqual(
+                article.get_hyperlinked_data(self.chunk, self.prepared,
+                                             True),
+                "foo")
+            self.assertTrue(hyperlink.called)
+
+@override_settings(ROOT_URLCONF='lexicography.tests.urls')
+class SearchCachingTestCase(DisableMigrationsMixin, TestCase):
+    fixtures = list(os.path.join(dirname, "fixtures", x)
+                    for x in ("users.json", "views.json"))
+
+    def setUp(self):
+        cache.clear()
+        super(SearchCachingTestCase, self).setUp()
+
+    def search(self, query):
+        self.client.force_login(get_user_model().objects.get(username="foo"))
+        return self.client.get(reverse("lexicography_search_table"), {
+            "length": -1,
+            "search[value]": query,
+            "lemmata_only": "true",
+            "publication_status": "both",
+            "search_all": "false"
+        })
+
+    def test_search_key_normalizes_query(self):
+        """
+        Runs of whitespace in the query do not change the key.
+        """
+        self.assertEqual(
+            caching.make_search_key(" foo  bar", True, "both", False),
+            caching.make_search_key("foo bar ", True, "both", False))
+
+    def test_search_key_depends_on_parameters(self):
+        """
+        The key depends on the parameters of the search.
+        """
+        key = caching.make_search_key("foo", True, "both", False)
+        self.assertNotEqual(
+            key, caching.make_search_key("foo", False, "both", False))
+        self.assertNotEqual(
+            key, caching.make_search_key("foo", True, "published", False))
+        self.assertNotEqual(
+            key, caching.make_search_key("foo", True, "both", True))
+
+    def test_search_key_depends_on_backend(self):
+        """
+        The key depends on the search backend in use.
+        """
+        key = caching.make_search_key("foo", True, "both", False)
+        with override_settings(
+                LEXICOGRAPHY_SEARCH_BACKEND="lexicography.search."
+                "PostgresBackend"):
+            self.assertNotEqual(
+                key, caching.make_search_key("foo", True, "both", False))
+
+    def test_search_key_changes_with_generation(self):
+        """
+        Bumping the generation changes the key.
+        """
+        key = caching.make_search_key("foo", True, "both", False)
+        caching.bump_search_generation()
+        self.assertNotEqual(
+            key, caching.make_search_key("foo", True, "both", False))
+
+    def test_search_cached(self):
+        """
+        Repeating a search does not query eXist again, until the
+        display collection changes.
+        """
+        with mock.patch("lexicography.search.ExistBackend.search",
+                        return_value=[]) as search:
+            self.search("foo")
+            self.search("foo")
+            self.assertEqual(search.call_count, 1)
+            caching.bump_search_generation()
+            self.search("foo")
+            self.assertEqual(search.call_count, 2)
@@ -0,0 +1,42 @@
+from django.test import TestCase
+from django.core.cache import caches
+
+from ..depman import DependencyManager
+
+cache = caches['article_display']
+
+class DependencyManagerTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.man = DependencyManager("test")
+        return super(DependencyManagerTestCase, self).setUp()
+
+    def test_replace_dependencies(self):
+        """
+        ``replace_dependencies`` records the new dependencies and removes
+        the stale ones.
+        """
+        self.assertEqual(self.man.replace_dependencies("x", ["a", "b"]), 0)
+        self.man.record("a", "y")
+        self.assertEqual(self.man.replace_dependencies("x", ["b", "c"]), 1)
+        self.assertEqual(self.man.get("a"), {b"y"})
+        self.assertEqual(self.man.get("b"), {b"x"})
+        self.assertEqual(self.man.get("c"), {b"x"})
+
+    def test_replace_dependencies_bytes(self):
+        """
+        ``replace_dependencies`` accepts dependents that are bytes.
+        """
+        self.man.replace_dependencies(b"x", ["a"])
+        self.man.replace_dependencies(b"x", ["b"])
+        self.assertIsNone(self.man.get("a"))
+        self.assertEqual(self.man.get("b"), {b"x"})
+
+    def test_remove_dependent(self):
+        """
+        ``remove_dependent`` removes all the dependencies of a dependent.
+        """
+        self.man.replace_dependencies("x", ["a", "b"])
+        self.assertEqual(self.man.remove_dependent("x"), 2)
+        self.assertIsNone(self.man.get_union(["a", "b"]))
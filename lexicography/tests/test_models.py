@@ -1,5 +1,8 @@
 import os
+import time
+import tempfile
 import datetime
+import threading
 from collections.abc import Callable
 from unittest import mock
 
@@ -14,8 +17,8 @@ from django.db import connection
 import lxml.etree
 
 from ..models import Entry, ChangeRecord, PublicationChange, Chunk, \
-    ChunkMetadata
-from .. import locking, xml, models
+    ChunkMetadata, SemanticFieldReference
+from .. import locking, xml, models, caching, batch
 from .test_xml import as_editable
 import lib.util as util
 from lib.existdb import ExistDB
@@ -599,6 +602,41 @@ class ChunkManagerTestCase(util.DisableMigrationsMixin, TestCase):
         self.assertEqual(
             len(self.manager.hashes_with_semantic_field("01.05n")), 1)
 
+    def test_semantic_field_references_consistent(self):
+        """
+        The references recorded when preparing the chunks agree with
+        those found in eXist.
+        """
+        self.assertEqual(SemanticFieldReference.objects.compare_with_exist(),
+                         (set(), set()))
+
+    def test_semantic_field_references_backfill(self):
+        """
+        ``backfill`` records the references found in eXist.
+        """
+        refs = SemanticFieldReference.objects
+        chunk = Chunk.objects.first()
+        refs.create(chunk=chunk, path="99n")
+        expected = set(refs.exclude(path="99n")
+                       .values_list("chunk_id", "path"))
+        refs.exclude(path="99n").delete()
+        self.assertEqual(refs.backfill(), (len(expected), 1))
+        self.assertEqual(set(refs.values_list("chunk_id", "path")), expected)
+
+    def test_semantic_field_references_replace_for_chunk(self):
+        """
+        ``replace_for_chunk`` replaces the references of a chunk.
+        """
+        refs = SemanticFieldReference.objects
+        chunk = Chunk.objects.first()
+        refs.create(chunk=chunk, path="98n")
+        refs.create(chunk=chunk, path="99n")
+        self.assertTrue(refs.replace_for_chunk(chunk.pk, {"99n", "97n"}))
+        self.assertEqual(set(refs.filter(chunk=chunk)
+                             .values_list("path", flat=True)),
+                         {"99n", "97n"})
+        self.assertFalse(refs.replace_for_chunk(chunk.pk, {"99n", "97n"}))
+
 # We separate this test from the other manager tests because they have
 # different initialization needs.
 @override_common_settings()
@@ -788,6 +826,28 @@ class ChunkManagerSimpleTestCase(util.DisableMigrationsMixin, TestCase):
         self.check_deletes_documents("sync_with_exist",
                                      self.chunk_collection_path)
 
+    def test_sync_reports(self):
+        """
+        ``sync_with_exist`` reports what it did and loads only what is
+        missing.
+        """
+        c = Chunk(data="<div/>", is_normal=True)
+        c.save()
+        self.make_reachable(c)
+
+        db = ExistDB()
+        db.removeCollection(self.chunk_collection_path, True)
+        report = self.manager.sync_with_exist()
+        self.assertEqual((report.loaded, report.removed, report.unchanged),
+                         (1, 0, 0))
+
+        extra = self.chunk_collection_path + "/extra"
+        db.load("<div/>".encode("utf-8"), extra)
+        report = self.manager.sync_with_exist()
+        self.assertEqual((report.loaded, report.removed, report.unchanged),
+                         (0, 1, 1))
+        self.assertFalse(db.hasDocument(extra))
+
     def test_prepare_collects(self):
         """
         ``prepare`` causes a collection of unreachable chunks.
@@ -820,6 +880,59 @@ class ChunkManagerSimpleTestCase(util.DisableMigrationsMixin, TestCase):
                                      self.display_collection_path,
                                      "xml", True)
 
+    def test_prepare_with_workers_syncs_normal_chunks(self):
+        """
+        ``prepare`` with workers syncs normal chunks.
+        """
+        self.check_syncs_normal_chunks("prepare",
+                                       self.display_collection_path,
+                                       "xml", True, 0)
+
+    def test_prepare_with_workers_reports(self):
+        """
+        ``prepare`` with workers returns a report for each chunk.
+        """
+        c = Chunk(data="<div/>", is_normal=True)
+        c.save()
+        self.make_reachable(c)
+
+        reports = self.manager.prepare("xml", True, 0)
+        self.assertEqual(len(reports), 1)
+        report = reports[0]
+        self.assertEqual(report.pk, c.pk)
+        self.assertIsNone(report.error)
+        self.assertIsNotNone(report.elapsed)
+
+    def test_prepare_in_process_drops_sf_cache(self):
+        """
+        ``prepare`` with 0 workers does not keep the cache of semantic
+        fields once done, so that a later preparation does not use
+        stale records.
+        """
+        c = Chunk(data="<div/>", is_normal=True)
+        c.save()
+        self.make_reachable(c)
+
+        with mock.patch("lexicography.tasks.prepare_chunk_xml") as prepare:
+            self.manager.prepare("xml", True, 0)
+        self.assertIsNotNone(prepare.call_args[0][1])
+        self.assertIsNone(batch._sf_cache)
+
+    def test_prepare_with_workers_reports_failures(self):
+        """
+        ``prepare`` with workers reports failures and keeps going.
+        """
+        c = Chunk(data="<div/>", is_normal=True)
+        c.save()
+        self.make_reachable(c)
+
+        with mock.patch("lexicography.tasks.ArticlePipeline.run",
+                        side_effect=Exception("failing")):
+            reports = self.manager.prepare("xml", True, 0)
+
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0].error, repr(Exception("failing")))
+
 @override_common_settings()
 class ChunkTestCase(util.DisableMigrationsMixin, TestCase):
     chunk_collection_path = get_collection_path("chunks")
@@ -933,6 +1046,81 @@ class ChunkTestCase(util.DisableMigrationsMixin, TestCase):
         self.assertFalse(Chunk.objects.get(pk=c.pk)._valid,
                          "_valid was saved.")
 
+    def test_validate_chunks(self):
+        """
+        ``validate_chunks`` reports the validity of the chunks, and the
+        chunks that cannot be validated.
+        """
+        tree = lxml.etree.fromstring(valid_editable)
+        sfs = tree.xpath("//btw:example/btw:semantic-fields | "
+                         "//btw:example-explained/btw:semantic-fields",
+                         namespaces=xml.default_namespace_mapping)
+
+        for el in sfs:
+            el.getparent().remove(el)
+        schematron_invalid = Chunk(
+            data=lxml.etree.tostring(tree, xml_declaration=True,
+                                     encoding='utf-8').decode('utf-8'),
+            schema_version=schema_version)
+        schematron_invalid.save()
+        valid = Chunk(data=valid_editable.decode('utf-8'),
+                      schema_version=schema_version)
+        valid.save()
+        abnormal = Chunk(data="", is_normal=False)
+        abnormal.save()
+        unknown = Chunk(data="<div/>", schema_version="0.0")
+        unknown.save()
+
+        reports = {report.pk: report for report in batch.validate_chunks(
+            [schematron_invalid.pk, valid.pk, abnormal.pk, unknown.pk],
+            0, 2)}
+
+        self.assertEqual(reports[schematron_invalid.pk].valid, False)
+        self.assertEqual(reports[valid.pk].valid, True)
+        self.assertEqual(reports[abnormal.pk].valid, False)
+        self.assertIsNone(reports[unknown.pk].valid)
+        self.assertIsNotNone(reports[unknown.pk].error)
+
+    def test_transform_chunks(self):
+        """
+        ``transform_chunks`` transforms the chunks, saves the results and
+        logs the transformations.
+        """
+        valid = Chunk(data=valid_editable.decode('utf-8'),
+                      schema_version=schema_version)
+        valid.save()
+        abnormal = Chunk(data="", is_normal=False)
+        abnormal.save()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            xsl_path = os.path.join(tmpdir, "transform.xsl")
+            with open(xsl_path, 'w') as f:
+                f.write("""\
+<xsl:stylesheet version="2.0"
+  xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <xsl:template match="@*|node()">
+    <xsl:copy><xsl:apply-templates select="@*|node()"/></xsl:copy>
+  </xsl:template>
+</xsl:stylesheet>
+""")
+            log_dir = os.path.join(tmpdir, "log")
+            batches = list(batch.transform_chunks(
+                xsl_path, xml.schema_for_version(schema_version), log_dir,
+                [valid.pk, abnormal.pk], workers=0, batch_size=1))
+
+            self.assertEqual(len(batches), 2)
+            reports = {report.pk: report for reports in batches
+                       for report in reports}
+            report = reports[valid.pk]
+            self.assertIsNone(report.error)
+            self.assertTrue(report.valid)
+            self.assertTrue(Chunk.objects.filter(pk=report.new_pk).exists())
+            self.assertEqual(reports[abnormal.pk].new_pk, abnormal.pk)
+            for pk in (valid.pk, abnormal.pk):
+                for name in ("before.xml", "after.xml"):
+                    self.assertTrue(
+                        os.path.exists(os.path.join(log_dir, pk, name)))
+
     def test_published_false(self):
         """
         ``published`` is false for chunks that have not been published.
@@ -1177,7 +1365,7 @@ class ChunkTestCase(util.DisableMigrationsMixin, TestCase):
         self.assertEqual(len(list_collection(db, self.chunk_collection_path)),
                          1)
 
-        with mock.patch('lexicography.models.ExistDB.load') as load_mock:
+        with mock.patch('lib.existdb.ExistDB.load') as load_mock:
             c.sync_with_exist()
             self.assertEqual(load_mock.call_count, 0,
                              "load should not have been called!")
@@ -1215,6 +1403,60 @@ class ChunkTestCase(util.DisableMigrationsMixin, TestCase):
             # can call ``get``.
             ret.get()
 
+    def test_wait_for_display_data_available(self):
+        """
+        ``wait_for_display_data`` returns immediately if the data is
+        available.
+        """
+        c = Chunk(data="<doc/>", is_normal=True)
+        c.save()
+        with mock.patch.object(Chunk, "get_display_data",
+                               return_value="foo"), \
+                mock.patch("lib.util.subscription") as subscription:
+            self.assertEqual(c.wait_for_display_data(10), "foo")
+            self.assertFalse(subscription.called)
+
+    def test_wait_for_display_data_times_out(self):
+        """
+        ``wait_for_display_data`` returns ``None`` if the data does not
+        become available in time.
+        """
+        c = Chunk(data="<doc/>", is_normal=True)
+        c.save()
+        with mock.patch.object(Chunk, "get_display_data",
+                               return_value=None):
+            self.assertIsNone(c.wait_for_display_data(0.2))
+
+    def test_wait_for_display_data_notified(self):
+        """
+        ``wait_for_display_data`` wakes up when the data is announced.
+        """
+        c = Chunk(data="<doc/>", is_normal=True)
+        c.save()
+        published = threading.Event()
+
+        def publish():
+            published.set()
+            util.publish('article_display',
+                         caching.make_display_channel(c.pk), "xml")
+
+        timer = threading.Timer(0.5, publish)
+        with mock.patch.object(
+                Chunk, "get_display_data",
+                side_effect=lambda: "foo" if published.is_set() else None):
+            start = time.time()
+            timer.start()
+            try:
+                self.assertEqual(c.wait_for_display_data(30), "foo")
+            finally:
+                timer.cancel()
+            elapsed = time.time() - start
+            # We got the data only after the announcement, and well
+            # before the timeout, so it is the announcement that woke
+            # us up.
+            self.assertGreaterEqual(elapsed, 0.5)
+            self.assertLess(elapsed, 10)
+
     def check_remove_data_from_exist_and_cache(self, op):
         """
         Check that invoking ``op`` will remove the data from the eXist
@@ -1290,7 +1532,7 @@ class ChunkTestCase(util.DisableMigrationsMixin, TestCase):
                                              self.display_collection_path)),
                          0)
 
-        with mock.patch('lexicography.models.ExistDB.removeDocument') as \
+        with mock.patch('lib.existdb.ExistDB.removeDocument') as \
                 remove_mock:
             method()
             self.assertEqual(remove_mock.call_count, 0)
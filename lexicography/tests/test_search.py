@@ -0,0 +1,146 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..models import Chunk, ChunkSearchIndex
+from ..search import PostgresBackend, ExistBackend, get_backend, \
+    _make_hit, _START_SEL, _STOP_SEL, _FRAGMENT_DELIMITER, \
+    _is_lucene_query_clean
+from ..xml import btw_namespace
+from lib.util import DisableMigrationsMixin
+
+def make_display(lemma, text):
+    return """\
+<btw:entry xmlns:btw="{ns}"><btw:lemma>{lemma}</btw:lemma>\
+<btw:sense>{text}</btw:sense></btw:entry>""".format(
+        ns=btw_namespace, lemma=lemma, text=text)
+
+class PostgresBackendTestCase(DisableMigrationsMixin, TestCase):
+
+    def setUp(self):
+        self.backend = PostgresBackend()
+        self.chunks = []
+        for data in ("<div>a</div>", "<div>b</div>"):
+            chunk = Chunk(data=data, is_normal=True)
+            chunk.save()
+            self.chunks.append(chunk.pk)
+        self.backend.index(self.chunks[0],
+                           make_display("foo", "one two two"))
+        self.backend.index(self.chunks[1],
+                           make_display("bar", "two foo"))
+        return super(PostgresBackendTestCase, self).setUp()
+
+    def test_index_unchanged(self):
+        """
+        Indexing the same data again does not change the index.
+        """
+        self.assertFalse(self.backend.index(
+            self.chunks[0], make_display("foo", "one two two")))
+        self.assertTrue(self.backend.index(
+            self.chunks[0], make_display("foo", "three")))
+
+    def test_search_lemmata_only(self):
+        """
+        A lemma search matches only the lemmas.
+        """
+        self.assertEqual([name for (name, _score) in
+                          self.backend.search("foo", True)],
+                         [self.chunks[0]])
+
+    def test_search_text(self):
+        """
+        A text search matches the whole text, in order of decreasing
+        score.
+        """
+        self.assertEqual([name for (name, _score) in
+                          self.backend.search("two", False)],
+                         [self.chunks[0], self.chunks[1]])
+
+    def test_hits(self):
+        """
+        ``hits`` highlights the matches.
+        """
+        hits = self.backend.hits("two", {self.chunks[1]})
+        self.assertEqual(list(hits.keys()), [self.chunks[1]])
+        self.assertEqual(hits[self.chunks[1]].xpath("//span[@class='hi']"
+                                                    "/text()"), ["two"])
+
+    def test_remove(self):
+        """
+        ``remove`` removes chunks from the index.
+        """
+        self.assertEqual(self.backend.remove([self.chunks[0]]), 1)
+        self.assertEqual(
+            list(ChunkSearchIndex.objects.values_list("chunk_id", flat=True)),
+            [self.chunks[1]])
+
+    def test_retain(self):
+        """
+        ``retain`` removes the chunks that are not passed.
+        """
+        self.assertEqual(self.backend.retain([self.chunks[0]]), 1)
+        self.assertEqual(
+            list(ChunkSearchIndex.objects.values_list("chunk_id", flat=True)),
+            [self.chunks[0]])
+
+class MakeHitTestCase(TestCase):
+
+    def test_make_hit(self):
+        """
+        ``_make_hit`` produces markup like eXist's ``kwic:summarize``.
+        """
+        hit = _make_hit("a {start}b{stop} c {start}d{stop} e{delim}f".format(
+            start=_START_SEL, stop=_STOP_SEL, delim=_FRAGMENT_DELIMITER))
+        p1, p2 = hit
+        self.assertEqual([(el.get("class"), el.text, el.tail) for el in p1],
+                         [("previous", "a ", None),
+                          ("hi", "b", " c "),
+                          ("hi", "d", None),
+                          ("following", " e", None)])
+        self.assertEqual([(el.get("class"), el.text) for el in p2],
+                         [("previous", "f")])
+
+class GetBackendTestCase(TestCase):
+
+    def test_default(self):
+        """
+        The default backend uses eXist.
+        """
+        self.assertIsInstance(get_backend(), ExistBackend)
+
+    @override_settings(
+        LEXICOGRAPHY_SEARCH_BACKEND="lexicography.search.PostgresBackend")
+    def test_setting(self):
+        """
+        The backend is selected by ``LEXICOGRAPHY_SEARCH_BACKEND``.
+        """
+        self.assertIsInstance(get_backend(), PostgresBackend)
+
+class ExistBackendTestCase(TestCase):
+
+    def setUp(self):
+        _is_lucene_query_clean.cache_clear()
+        return super(ExistBackendTestCase, self).setUp()
+
+    def test_is_query_clean_local(self):
+        """
+        ``is_query_clean`` does not query eXist when the syntax can be
+        checked locally.
+        """
+        with mock.patch("lexicography.search.is_lucene_query_clean") \
+                as exist_check:
+            self.assertTrue(ExistBackend().is_query_clean("foo AND bar"))
+            self.assertFalse(ExistBackend().is_query_clean("foo AND"))
+            self.assertFalse(exist_check.called)
+
+    def test_is_query_clean_fallback(self):
+        """
+        ``is_query_clean`` queries eXist when the syntax cannot be
+        checked locally, and caches the verdict.
+        """
+        with mock.patch("lexicography.search.is_lucene_query_clean",
+                        return_value=False) as exist_check:
+            self.assertFalse(ExistBackend().is_query_clean("*foo"))
+            self.assertFalse(ExistBackend().is_query_clean("*foo"))
+            self.assertEqual(exist_check.call_count, 1)
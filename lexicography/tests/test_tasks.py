@@ -10,7 +10,7 @@ from django.urls import reverse
 from pyexistdb.exceptions import ExistDBException
 
 from ..models import Chunk, ChangeRecord, Entry
-from .. import tasks, depman, xml
+from .. import tasks, depman, xml, caching
 from .util import launch_fetch_task, create_valid_article, \
     extract_inter_article_links
 from bibliography.models import Item, PrimarySource
@@ -253,6 +253,23 @@ class PrepareXMLTestCase(TaskTestCase):
             "the list of semantic fields should be correct")
         self.assertIsNone(sfss[0].getnext())
 
+    def test_unresolvable_bibl(self):
+        """
+        A bibliographical target that cannot be resolved does not
+        prevent preparing the XML, but the bibliographical data is not
+        cached.
+        """
+        # This article refers to /bibliography/2, which does not exist.
+        cr = Entry.objects.get(
+            lemma="citations everywhere possible (subsense)").latest
+        chunk = cr.c_hash
+
+        tasks.prepare_xml.delay(chunk.c_hash).get()
+
+        self.assertIsNotNone(cache.get(chunk.display_key("xml")))
+        self.assertIsNone(cache.get(chunk.display_key("bibl")))
+        self.assertTrue(ExistDB().hasDocument(chunk.exist_path("display")))
+
 @mock.patch.multiple("bibliography.zotero.Zotero", get_all=get_all_mock,
                      get_item=get_item_mock)
 class PrepareBiblTestCase(TaskTestCase):
@@ -433,7 +450,7 @@ class FetchXMLTestCase(TaskTestCase):
         cached = cache.get(key)
         self.assertIsNotNone(cached)
 
-        with mock.patch('lexicography.models.ExistDB.getDocument') as get_mock:
+        with mock.patch('lib.existdb.ExistDB.getDocument') as get_mock:
             self.assertEqual(tasks.fetch_xml(chunk.c_hash), cached)
             self.assertEqual(cache.get(key), cached)
             self.assertEqual(get_mock.call_count, 0)
@@ -449,10 +466,17 @@ class FetchXMLTestCase(TaskTestCase):
         _, xml_doc = xml.strip_xml_decl(xml_doc)
         self.assertIsNotNone(xml)
 
+        text_key = caching.make_text_key(chunk.c_hash)
+        text = cache.get(text_key)
+        self.assertIsNotNone(text)
+
         db = ExistDB()
         cache.delete(key)
-        with mock.patch('lexicography.models.ExistDB.getDocument',
+        cache.delete(text_key)
+        with mock.patch('lib.existdb.ExistDB.getDocument',
                         wraps=db.getDocument) as get_mock:
             self.assertEqual(tasks.fetch_xml(chunk.c_hash), xml_doc)
             self.assertEqual(cache.get(key), xml_doc)
             self.assertEqual(get_mock.call_count, 1)
+        # The text is restored along with the XML.
+        self.assertEqual(cache.get(text_key), text)
@@ -0,0 +1,130 @@
+import os
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import TestCase
+
+from ..batch import TransformReport
+from ..management.commands.transform import Command
+from ..models import ChangeRecord
+from lib.util import DisableMigrationsMixin
+
+dirname = os.path.dirname(__file__)
+
+def make_line(old, new, records):
+    return json.dumps({"old": old, "new": new, "records": records}) + "\n"
+
+class ReadStateTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="btw-test-transform")
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "state")
+
+    def write(self, data):
+        with open(self.path, 'w', encoding="utf-8") as state:
+            state.write(data)
+
+    def read(self):
+        with open(self.path, encoding="utf-8") as state:
+            return state.read()
+
+    def test_read(self):
+        """
+        ``read_state`` maps the change records to the chunks they were
+        made to refer to. Later lines override earlier ones.
+        """
+        self.write(make_line("a", "b", [1, 2]) + make_line("c", "d", [3]) +
+                   make_line("a", "e", [2]))
+        self.assertEqual(Command.read_state(self.path),
+                         {1: "b", 2: "e", 3: "d"})
+
+    def test_partial_last_line(self):
+        """
+        ``read_state`` ignores a truncated last line, and removes it
+        from the file.
+        """
+        first = make_line("a", "b", [1])
+        self.write(first + make_line("c", "d", [3])[:10])
+        self.assertEqual(Command.read_state(self.path), {1: "b"})
+        self.assertEqual(self.read(), first)
+
+    def test_corrupt_line(self):
+        """
+        ``read_state`` fails on a corrupt line that is not the last.
+        """
+        self.write("garbage\n" + make_line("a", "b", [1]))
+        with self.assertRaisesRegex(CommandError, "corrupt line"):
+            Command.read_state(self.path)
+
+class RemapTestCase(DisableMigrationsMixin, TestCase):
+    fixtures = list(os.path.join(dirname, "fixtures", x)
+                    for x in ("users.json", "views.json"))
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="btw-test-transform")
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "state")
+
+        # These two records refer to different chunks.
+        self.first = ChangeRecord.objects.get(pk=1)
+        self.second = ChangeRecord.objects.get(pk=2)
+        self.first_chunk = self.first.c_hash_id
+        self.second_chunk = self.second.c_hash_id
+        self.records = Command.pending_records({})
+        self.reports = [TransformReport(self.first_chunk, self.second_chunk,
+                                        False, True, None)]
+
+    def remap(self):
+        with open(self.path, 'a', encoding="utf-8") as state:
+            Command.remap(state, self.records, self.reports)
+
+    def test_pending_records(self):
+        """
+        ``pending_records`` maps the chunks to the change records that
+        refer to them.
+        """
+        self.assertIn(self.first.pk, self.records[self.first_chunk])
+        self.assertIn(self.second.pk, self.records[self.second_chunk])
+
+    def test_remap(self):
+        """
+        ``remap`` updates the change records and records the change.
+        """
+        self.remap()
+        self.assertEqual(ChangeRecord.objects.get(pk=self.first.pk).c_hash_id,
+                         self.second_chunk)
+        done = Command.read_state(self.path)
+        self.assertEqual(done[self.first.pk], self.second_chunk)
+
+        # On resuming, the records that were remapped are not
+        # transformed again, but those that already referred to the
+        # new chunk are.
+        records = Command.pending_records(done)
+        self.assertNotIn(self.first_chunk, records)
+        for chunk_records in records.values():
+            self.assertNotIn(self.first.pk, chunk_records)
+        self.assertIn(self.second.pk, records[self.second_chunk])
+
+    def test_remap_rolled_back(self):
+        """
+        When the transaction of ``remap`` does not commit, the state is
+        recorded but resuming transforms the records again.
+        """
+        class Abort(Exception):
+            pass
+
+        with self.assertRaises(Abort):
+            with transaction.atomic():
+                self.remap()
+                raise Abort()
+
+        self.assertEqual(ChangeRecord.objects.get(pk=self.first.pk).c_hash_id,
+                         self.first_chunk)
+        done = Command.read_state(self.path)
+        self.assertEqual(done[self.first.pk], self.second_chunk)
+        self.assertIn(self.first.pk,
+                      Command.pending_records(done)[self.first_chunk])
@@ -174,3 +174,30 @@ class SchematronTestCase(unittest.TestCase):
         self.assertFalse(
             util.schematron(xml.schematron_for_version(schema_version),
                             data))
+
+    def test_schematron_many(self):
+        """
+        ``schematron_many`` reports the result of each document.
+        """
+        tree = lxml.etree.fromstring(valid_editable)
+        for el in tree.xpath("//btw:credit",
+                             namespaces=xml.default_namespace_mapping):
+            el.getparent().remove(el)
+
+        invalid = lxml.etree.tostring(
+            tree, xml_declaration=True, encoding='utf-8').decode('utf-8')
+        valid = valid_editable.decode('utf-8')
+        self.assertEqual(
+            util.schematron_many(xml.schematron_for_version(schema_version),
+                                 [valid, invalid, valid]),
+            [True, False, True])
+
+    def test_schematron_many_empty(self):
+        """
+        ``schematron_many`` returns an empty list when there is nothing
+        to check.
+        """
+        self.assertEqual(
+            util.schematron_many(xml.schematron_for_version(schema_version),
+                                 []),
+            [])
@@ -4,19 +4,22 @@ import os
 import datetime
 import string
 import difflib
+from unittest import mock
 
 import lxml.etree
 from django_webtest import WebTest, TransactionWebTest
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.test import TestCase
 from django.test.utils import override_settings
+from django.core.cache import caches
 from django.utils import translation
 from cms.test_utils.testcases import BaseCMSTestCase
 
-from .. import models
+from .. import models, caching
 from ..models import Entry, EntryLock, ChangeRecord, Chunk, PublicationChange
-from ..views import REQUIRED_WED_VERSION
+from ..views import REQUIRED_WED_VERSION, SearchTable
 from ..xml import get_supported_schema_versions, mods_schema_path, XMLTree, \
     default_namespace_mapping, strip_xml_decl
 from . import util as test_util
@@ -972,6 +975,26 @@ class MainTestCase(ViewsTestCase):
         """
         self.search_table_search("abcd", self.foo)
 
+    def test_search_table_hits_for_page(self):
+        """
+        A full-text search produces the hits for the records on the
+        page shown, and reports the total number of matching records.
+        """
+        response = self.app.get(
+            reverse("lexicography_search_table"),
+            params={
+                "length": 1,
+                "search[value]": "abcd",
+                "lemmata_only": "false",
+                "publication_status": "both",
+                "search_all": "false"
+            },
+            user=self.foo)
+        self.assertEqual(response.json["recordsFiltered"], 1)
+        data = response.json["data"]
+        self.assertEqual(len(data), 1)
+        self.assertIn("abcd", data[0][6])
+
     def test_search_by_non_scribe_gets_no_edit_link_on_locked_articles(self):
         """
         Tests that when an article is already locked by user X and user Y
@@ -1222,6 +1245,73 @@ class MainTestCase(ViewsTestCase):
                           "Older entries should not have an edit link")
 
 
+class SearchTableHitsTestCase(TestCase):
+
+    def setUp(self):
+        caches['article_display'].clear()
+        return super(SearchTableHitsTestCase, self).setUp()
+
+    def set_text(self, name, text):
+        caches['article_display'].set(caching.make_text_key(name), text)
+
+    def test_hits_from_cached_text(self):
+        """
+        The hits are produced from the cached text, without the search
+        backend.
+        """
+        self.set_text("a", "one foo two")
+        with mock.patch("lexicography.search.ExistBackend.hits",
+                        return_value={}) as hits:
+            result = SearchTable.get_hits("foo", {"a"})
+            hits.assert_called_once_with("foo", set())
+        self.assertIn('<span class="hi">foo</span>', result["a"])
+
+    def test_hits_from_cached_xml(self):
+        """
+        When only the prepared XML is cached, the hits are produced from
+        its text, without the search backend, and the text is cached.
+        """
+        caches['article_display'].set(
+            caching.make_display_key("xml", "a"),
+            "<doc><p>one foo</p><p>two</p></doc>")
+        with mock.patch("lexicography.search.ExistBackend.hits",
+                        return_value={}) as hits:
+            result = SearchTable.get_hits("foo", {"a"})
+            hits.assert_called_once_with("foo", set())
+        self.assertIn('<span class="hi">foo</span>', result["a"])
+        self.assertEqual(
+            caches['article_display'].get(caching.make_text_key("a")),
+            "one foo two")
+
+    def test_hits_fallback(self):
+        """
+        The search backend produces the hits for the documents whose
+        text is not cached, or in which the terms cannot be found.
+        """
+        self.set_text("a", "one two")
+        hit = lxml.etree.fromstring("<hit><p>x</p></hit>")
+        with mock.patch("lexicography.search.ExistBackend.hits",
+                        return_value={"a": hit, "b": hit}) as hits:
+            result = SearchTable.get_hits("foo", {"a", "b"})
+            hits.assert_called_once_with("foo", {"a", "b"})
+        self.assertEqual(result, {"a": "<hit><p>x</p></hit>",
+                                  "b": "<hit><p>x</p></hit>"})
+
+    @override_settings(LEXICOGRAPHY_KWIC_SNIPPETS_PER_ROW=2,
+                       LEXICOGRAPHY_KWIC_SNIPPETS_PER_REQUEST=3)
+    def test_hits_limits(self):
+        """
+        The number of snippets is limited per document and per request.
+        """
+        self.set_text("a", "foo " * 5)
+        self.set_text("b", "foo " * 5)
+        self.set_text("c", "foo " * 5)
+        with mock.patch("lexicography.search.ExistBackend.hits",
+                        return_value={}):
+            result = SearchTable.get_hits("foo", {"a", "b", "c"})
+        self.assertEqual([result[name].count('class="hi"')
+                          for name in ("a", "b", "c")], [2, 1, 0])
+
 class EditingTestCase(ViewsTransactionTestCase):
 
     def open_new(self, user):
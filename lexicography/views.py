@@ -25,7 +25,9 @@ from django.views.decorators.http import require_POST, require_GET, \
     require_http_methods, etag
 from django.middleware.csrf import get_token
 from django.db import IntegrityError
-from django.db.models import ProtectedError, F
+from django.db.models import ProtectedError, F, Func, Value, IntegerField, \
+    TextField
+from django.db.models.functions import Cast
 from django.conf import settings
 from django.db import transaction
 from django.utils.http import quote_etag
@@ -35,20 +37,17 @@ from django.views.decorators.cache import never_cache
 from django.core.cache import caches
 from django_datatables_view.base_datatable_view import BaseDatatableView
 from django_datatables_view.mixins import LazyEncoder
-from pyexistdb.db import ExistDB
 import lxml.etree
 
 import lib.util as util
-from . import handles, usermod, article, models
+from lib import kwic, lucene
+from . import handles, usermod, article, models, caching, search
 from .models import Entry, ChangeRecord, Chunk, EntryLock
 from .locking import release_entry_lock, drop_entry_lock, \
     entry_lock_required
 from .xml import XMLTree, xhtml_to_xml, clean_xml, \
     get_supported_schema_versions, default_namespace_mapping
 from .forms import SaveForm
-from lib.existdb import query_iterator, is_lucene_query_clean, \
-    get_collection_path
-from lib import xquery
 from lib.decorators import wed_hack
 
 article_display_cache = caches['article_display']
@@ -78,13 +77,17 @@ class SearchTable(BaseDatatableView):
 
     def get(self, *args, **kwargs):
         self.chunk_to_hits = {}
+        # The names of the documents that match the search, in order
+        # of decreasing score.
+        self.search_results = None
+        # The Lucene query for which we must produce hits.
+        self.hit_query = None
         search_value = self.request.GET.get('search[value]', None)
 
         if search_value is not None and len(search_value):
             # Provide an early failure if the Lucene query is not
             # syntactically correct.
-            db = ExistDB()
-            if not is_lucene_query_clean(db, search_value):
+            if not search.get_backend().is_query_clean(search_value):
                 if self.pre_camel_case_notation:
                     ret = {'sEcho': int(self._querydict.get('sEcho', 0)),
                            'badLucene': True}
@@ -145,13 +148,7 @@ class SearchTable(BaseDatatableView):
             return row.schema_version + warn
 
         if column == "hit":
-            hit = self.chunk_to_hits.get(row.c_hash.c_hash, None)
-
-            if hit is not None and len(hit):
-                return lxml.etree.tostring(hit,
-                                           xml_declaration=True,
-                                           encoding='utf-8').decode("utf-8")
-            return ""
+            return self.chunk_to_hits.get(row.c_hash.c_hash, "")
 
         ret = super(SearchTable, self).render_column(row, column)
         #
@@ -200,6 +197,9 @@ class SearchTable(BaseDatatableView):
         lemmata_only = self.request.GET.get('lemmata_only', "false") == \
             "true"
 
+        # These are only meaningful for users who can author.
+        publication_status = None
+        search_all = None
         if usermod.can_author(self.request.user):
             publication_status = self.request.GET.get('publication_status',
                                                       "published")
@@ -234,40 +234,132 @@ class SearchTable(BaseDatatableView):
             active = qs
 
         if search_value:
-            db = ExistDB()
-            chunks = []
-            if lemmata_only:
-                scope = "//btw:lemma"
-                # When we do a lemma search, hits are not useful.
-                hit = ""
-            else:
-                scope = "//btw:entry"
-                hit = "{kwic:summarize($m, <config width='80'/>)}"
-
-            for query_chunk in query_iterator(db, xquery.format(
-                    """\
-import module namespace kwic="http://exist-db.org/xquery/kwic";
-for $m in collection({db}){scope}[ft:query(., {search_text})]
-order by ft:score($m) descending
-return <result><doc>{doc}</doc><hit>{hit}</hit></result>""",
-                    db=get_collection_path("display"),
-                    scope=xquery.Verbatim(scope),
-                    doc=xquery.Verbatim("{util:document-name($m)}"),
-                    hit=xquery.Verbatim(hit),
-                    search_text=search_value)):
-
-                for result in query_chunk.results:
-                    chunk = result[0].text  # Content of <doc>.
-                    self.chunk_to_hits[chunk] = result[1]
-                    chunks.append(chunk)
+            key = caching.make_search_key(search_value, lemmata_only,
+                                          publication_status, search_all)
+            results = article_display_cache.get(key)
+            if results is None:
+                results = search.get_backend().search(search_value,
+                                                      lemmata_only)
+                article_display_cache.set(
+                    key, results,
+                    timeout=settings.LEXICOGRAPHY_SEARCH_TIMEOUT)
+            self.search_results = [name for (name, _score) in results]
+            # When we do a lemma search, hits are not useful.
+            if not lemmata_only:
+                self.hit_query = search_value
 
             # We need to get the changerecords that pertain to these chunks.
-            qs = active.filter(c_hash__in=set(chunks))
+            qs = active.filter(c_hash__in=self.search_results)
         else:
             qs = active
 
         return qs
 
+    def ordering(self, qs):
+        qs = super(SearchTable, self).ordering(qs)
+        if not self.search_results:
+            return qs
+
+        # Records that are not otherwise ordered are ordered by score.
+        qs = qs.annotate(search_rank=Func(
+            Value(self.search_results), Cast("c_hash", TextField()),
+            function="array_position", output_field=IntegerField()))
+        return qs.order_by(*(qs.query.order_by + ("search_rank", )))
+
+    def prepare_results(self, qs):
+        if self.hit_query is not None:
+            # At this point, ``qs`` contains only the records shown
+            # on the current page.
+            qs = list(qs)
+            self.chunk_to_hits = self.get_hits(
+                self.hit_query, {row.c_hash_id for row in qs})
+
+        return super(SearchTable, self).prepare_results(qs)
+
+    @staticmethod
+    def get_hits(query, names):
+        """
+        Produce the hits of a search for a set of documents. The hits
+        are produced from the text of the documents we have in cache.
+        The search backend produces the hits for the documents whose
+        text is not in cache, or in which we cannot find the terms of
+        the query.
+
+        The number of snippets produced for each document, and for the
+        whole request, is limited by the settings
+        ``LEXICOGRAPHY_KWIC_SNIPPETS_PER_ROW`` and
+        ``LEXICOGRAPHY_KWIC_SNIPPETS_PER_REQUEST``.
+
+        :returns: A map of document name to the markup of the hits.
+        :rtype: :class:`dict`
+        """
+        pattern = kwic.make_pattern(lucene.positive_terms(query))
+        names = sorted(names)
+        texts = SearchTable.get_texts(names) if pattern is not None else {}
+
+        hits = {}
+        missing = set()
+        budget = settings.LEXICOGRAPHY_KWIC_SNIPPETS_PER_REQUEST
+        for name in names:
+            text = texts.get(name)
+            if text is None:
+                missing.add(name)
+                continue
+
+            limit = min(settings.LEXICOGRAPHY_KWIC_SNIPPETS_PER_ROW, budget)
+            snippets = list(kwic.summarize(text, pattern, limit=limit))
+            if not snippets and limit:
+                missing.add(name)
+                continue
+
+            budget -= len(snippets)
+            hits[name] = kwic.to_html(snippets) if snippets else ""
+
+        for name, hit in search.get_backend().hits(query, missing).items():
+            hits[name] = lxml.etree.tostring(hit, encoding="unicode") \
+                if len(hit) else ""
+
+        return hits
+
+    @staticmethod
+    def get_texts(names):
+        """
+        Get the text of documents from the cache. The text of a
+        document expires with its prepared XML, but the XML may be put
+        back in the cache without the text. So when the text is missing
+        but the XML is cached, we derive the text from the XML and
+        cache it.
+
+        :returns: A map of document name to text, for the documents
+                  whose text we could get.
+        :rtype: :class:`dict`
+        """
+        text_keys = {caching.make_text_key(name): name for name in names}
+        texts = {text_keys[key]: text for (key, text) in
+                 article_display_cache.get_many(list(text_keys)).items()}
+
+        xml_keys = {caching.make_display_key("xml", name): name
+                    for name in names if name not in texts}
+        if not xml_keys:
+            return texts
+
+        derived = {}
+        for key, xml in article_display_cache.get_many(list(xml_keys)) \
+                                             .items():
+            # The key may hold the marker of a task that is preparing
+            # the XML.
+            if not isinstance(xml, str):
+                continue
+            name = xml_keys[key]
+            texts[name] = derived[caching.make_text_key(name)] = \
+                article.get_text(xml)
+
+        if derived:
+            article_display_cache.set_many(
+                derived, timeout=settings.LEXICOGRAPHY_XML_TIMEOUT)
+
+        return texts
+
 
 @require_GET
 @never_cache
@@ -382,19 +474,23 @@ def mods(request, entry_id, changerecord_id=None):
                   },
                   content_type="application/xml+mods")
 
+# This view may wait for the display data to be prepared. We do not
+# want to hold a transaction open while waiting.
 @require_GET
 @never_cache
+@transaction.non_atomic_requests
 def changerecord_details(request, changerecord_id):
     cr = ChangeRecord.objects.get(pk=changerecord_id)
 
     if request.is_ajax():
         published = not usermod.can_author(request.user)
-        prepared = cr.c_hash.get_display_data()
+        prepared = cr.c_hash.wait_for_display_data(
+            settings.LEXICOGRAPHY_DISPLAY_WAIT)
         if not prepared:
             raise Http404
 
         prepared["xml"] = \
-            article.hyperlink_prepared_data(prepared, published)
+            article.get_hyperlinked_data(cr.c_hash, prepared, published)
 
         return HttpResponse(json.dumps(prepared),
                             content_type=JSON_TYPE)
@@ -437,7 +533,8 @@ def _show_changerecord(request, cr):
         data = None
         bibl_data = '{}'
     else:
-        data = article.hyperlink_prepared_data(prepared, show_published)
+        data = article.get_hyperlinked_data(cr.c_hash, prepared,
+                                            show_published)
         bibl_data = json.dumps(prepared["bibl_data"])
 
     # We want an edit option only if this record is the latest and if
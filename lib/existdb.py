@@ -1,4 +1,6 @@
 import os
+import threading
+from xml.sax.saxutils import escape
 
 import requests
 from django.conf import settings
@@ -42,6 +44,115 @@ class ExistDB(pyexistdb.db.ExistDB):
             if not ignore_nonexistent or self.hasDocument(name):
                 raise
 
+    def load_many(self, docs, batch_size=100, max_bytes=8 * 1024 * 1024):
+        """
+        Load many documents into the database. The documents are sent
+        in batches, one HTTP request per batch, instead of one request
+        per document. Existing documents are overwritten. The
+        collections that do not exist are created, but their parents
+        must exist.
+
+        :param docs: The documents to load.
+        :type docs: An iterable of ``(path, data)`` pairs. The data may
+                    be :class:`str` or :class:`bytes`, in which case it
+                    must be UTF-8.
+        :param batch_size: The maximum number of documents per batch.
+        :type batch_size: :class:`int`
+        :param max_bytes: A batch is sent as soon as it reaches this
+                          size, even if it does not contain
+                          ``batch_size`` documents yet.
+        :type max_bytes: :class:`int`
+        :returns: The number of documents loaded.
+        :rtype: :class:`int`
+        :raises ExistDBException: If a batch fails.
+        """
+        batch = []
+        size = 0
+        loaded = 0
+        for path, data in docs:
+            if isinstance(data, bytes):
+                data = data.decode("utf-8")
+            batch.append((path, data))
+            size += len(data)
+            if len(batch) >= batch_size or size >= max_bytes:
+                loaded += self._load_batch(batch)
+                batch = []
+                size = 0
+
+        if batch:
+            loaded += self._load_batch(batch)
+
+        return loaded
+
+    def _load_batch(self, batch):
+        collections = set()
+        stores = []
+        for path, data in batch:
+            collection, name = path.rsplit("/", 1)
+            collections.add(collection)
+            stores.append(
+                "xmldb:store({collection}, {name}, parse-xml({data}), "
+                "'application/xml')".format(
+                    collection=_string_literal(collection),
+                    name=_string_literal(name),
+                    data=_string_literal(data)))
+
+        creates = []
+        for collection in sorted(collections):
+            parent, name = collection.rsplit("/", 1)
+            creates.append(
+                "(if (xmldb:collection-available({collection})) then () "
+                "else xmldb:create-collection({parent}, {name}))".format(
+                    collection=_string_literal(collection),
+                    parent=_string_literal(parent),
+                    name=_string_literal(name)))
+
+        query = xquery.make("(" + ",\n".join(creates + stores) + ")")
+        body = '<query xmlns="http://exist.sourceforge.net/NS/exist" ' \
+            'start="1" max="{}"><text>{}</text></query>'.format(
+                len(batch) + len(creates), escape(query))
+
+        pyexistdb.db.logger.debug('load_many %d documents', len(batch))
+        response = self.session.post(
+            self.restapi_path(''), data=body.encode("utf-8"),
+            headers={"Content-Type": "application/xml"},
+            stream=False, **self.session_opts)
+        if response.status_code != requests.codes.ok:
+            raise ExistDBException("could not load documents: " +
+                                   response.text)
+
+        return len(batch)
+
+def _string_literal(value):
+    """
+    Make an XQuery string literal that has the value passed. Unlike
+    :func:`lib.xquery.format`, this escapes ampersands so that the
+    literal may contain arbitrary data.
+    """
+    return '"' + value.replace("&", "&amp;").replace('"', "&quot;") + '"'
+
+_local = threading.local()
+
+def get_db():
+    """
+    Get a database client shared by all the callers in the current
+    process and thread. Reusing the client allows reusing its HTTP
+    session, and thus its keep-alive connections, instead of creating
+    a new session each time we need to talk to the database.
+
+    The client is created anew after a fork, as sharing connections
+    with a parent process is a recipe for trouble.
+
+    :returns: The client.
+    :rtype: :class:`ExistDB`
+    """
+    pid = os.getpid()
+    db = getattr(_local, "db", None)
+    if db is None or _local.pid != pid:
+        db = _local.db = ExistDB()
+        _local.pid = pid
+    return db
+
 def running():
     try:
         # We use the admin to check if the server responds.
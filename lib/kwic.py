@@ -0,0 +1,92 @@
+"""
+Produce KWIC (keyword in context) summaries of texts, in the markup
+that eXist-db's ``kwic:summarize`` produces.
+
+The snippets are produced lazily so that the caller may stop as soon
+as it has enough of them, without scanning the rest of the text.
+"""
+import re
+import html
+
+def make_pattern(terms):
+    """
+    Make the regular expression that finds the terms in a text. The
+    matching is case-insensitive and matches only whole words.
+
+    :param terms: The terms to find. A term may contain multiple
+                  words, which match words separated by any
+                  non-word characters. The wildcards ``*`` and ``?``
+                  have their Lucene meaning.
+    :type terms: :class:`list` of :class:`str`
+    :returns: The expression, or ``None`` if there are no terms.
+    :rtype: :class:`re.Pattern`
+    """
+    alternatives = []
+    for term in terms:
+        words = [re.escape(word).replace(r"\*", r"\w*").replace(r"\?", r"\w")
+                 for word in term.split()]
+        if words:
+            alternatives.append(r"\W+".join(words))
+
+    if not alternatives:
+        return None
+
+    # Longer alternatives first, so that a phrase wins over its words.
+    alternatives.sort(key=len, reverse=True)
+    return re.compile(r"(?<!\w)(?:{})(?!\w)".format("|".join(alternatives)),
+                      re.IGNORECASE)
+
+def summarize(text, pattern, width=80, limit=None):
+    """
+    Find the matches of a pattern in a text. This is a generator.
+
+    :param text: The text to search.
+    :type text: :class:`str`
+    :param pattern: The expression to search for. See
+                    :func:`make_pattern`.
+    :type pattern: :class:`re.Pattern`
+    :param width: The number of characters of context to keep on
+                  each side of a match.
+    :type width: :class:`int`
+    :param limit: The maximum number of snippets to produce. ``None``
+                  means no limit.
+    :type limit: :class:`int`
+    :returns: Triples of the text before a match, the match and the
+              text after the match. The context is truncated to
+              ``width`` and the truncation marked with ``...``.
+    """
+    if limit is not None and limit <= 0:
+        return
+
+    count = 0
+    for match in pattern.finditer(text):
+        start, end = match.span()
+        previous = text[max(0, start - width):start]
+        if start > width:
+            previous = "..." + previous
+        following = text[end:end + width]
+        if end + width < len(text):
+            following += "..."
+        yield (previous, match.group(0), following)
+
+        count += 1
+        if limit is not None and count >= limit:
+            return
+
+def to_html(snippets):
+    """
+    Produce the markup of a summary.
+
+    :param snippets: The snippets produced by :func:`summarize`.
+    :returns: The markup.
+    :rtype: :class:`str`
+    """
+    parts = ["<hit>"]
+    for (previous, hit, following) in snippets:
+        parts.append(
+            '<p><span class="previous">{}</span><span class="hi">{}</span>'
+            '<span class="following">{}</span></p>'.format(
+                html.escape(previous), html.escape(hit),
+                html.escape(following)))
+    parts.append("</hit>")
+    return "".join(parts)
@@ -0,0 +1,191 @@
+"""
+A checker for the syntax of Lucene queries.
+
+eXist-db parses the queries passed to ``ft:query`` with Lucene's
+classic query parser. Asking eXist-db whether a query is correct
+costs a round trip to the database, so we check here the subset of
+the classic syntax that users commonly type: terms, wildcard terms,
+phrases, groups, the boolean operators, the ``+``, ``-`` and ``!``
+modifiers, fuzzy and proximity slops and boosts.
+
+Queries that use anything else (fields, ranges, regular expressions,
+escapes, leading wildcards, etc.) are reported as undecided, and must
+be checked by eXist-db.
+"""
+import re
+
+# The characters that end a term.
+_TERM_END = set(" \t\n\r\u3000!():^[]\"{}~\\/")
+
+_WHITESPACE = set(" \t\n\r\u3000")
+
+# The characters that we leave to eXist-db.
+_UNDECIDED = set(":[]{}\\/")
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+# A clause of a query, possibly negated, possibly with a field, a
+# slop or a boost.
+_CLAUSE_RE = re.compile(
+    r'(?P<neg>NOT\s+|[-!])?(?:[^\s():"]+:)?(?P<term>"[^"]*"|[^\s()"~^]+)'
+    r'(?:[~^][\d.]*)*')
+
+_OPERATORS = {
+    "AND": "AND",
+    "&&": "AND",
+    "OR": "OR",
+    "||": "OR",
+    "NOT": "NOT",
+}
+
+class _Undecided(Exception):
+    pass
+
+class _Invalid(Exception):
+    pass
+
+def _tokenize(query):
+    tokens = []
+    ix = 0
+    end = len(query)
+    while ix < end:
+        c = query[ix]
+        if c in _WHITESPACE:
+            ix += 1
+        elif c in _UNDECIDED:
+            raise _Undecided()
+        elif c == '"':
+            close = query.find('"', ix + 1)
+            if close == -1:
+                raise _Invalid()
+            tokens.append("QUOTED")
+            ix = close + 1
+        elif c in "()":
+            tokens.append(c)
+            ix += 1
+        elif c in "+-!":
+            # Newer versions of the parser accept these operators
+            # when they are followed by whitespace. We let eXist-db
+            # decide.
+            if ix + 1 < end and query[ix + 1] in _WHITESPACE:
+                raise _Undecided()
+            tokens.append("NOT" if c == "!" else "MOD")
+            ix += 1
+        elif c == "~":
+            match = _NUMBER_RE.match(query, ix + 1)
+            tokens.append("SLOP")
+            ix = match.end() if match else ix + 1
+        elif c == "^":
+            match = _NUMBER_RE.match(query, ix + 1)
+            if not match:
+                raise _Invalid()
+            tokens.append("BOOST")
+            ix = match.end()
+        else:
+            if c in "*?":
+                # A leading wildcard is an error unless eXist-db is
+                # configured to allow it.
+                raise _Undecided()
+            start = ix
+            while ix < end and query[ix] not in _TERM_END:
+                ix += 1
+            term = query[start:ix]
+            tokens.append(_OPERATORS.get(term, "TERM"))
+    return tokens
+
+class _Parser(object):
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.ix = 0
+
+    def peek(self):
+        return self.tokens[self.ix] if self.ix < len(self.tokens) else None
+
+    def consume(self, *expected):
+        token = self.peek()
+        if token not in expected:
+            raise _Invalid()
+        self.ix += 1
+        return token
+
+    def optional(self, *expected):
+        if self.peek() in expected:
+            self.ix += 1
+            return True
+        return False
+
+    def parse(self):
+        self.query()
+        if self.peek() is not None:
+            raise _Invalid()
+
+    def query(self):
+        self.optional("MOD", "NOT")
+        self.clause()
+        while self.peek() not in (None, ")"):
+            self.optional("AND", "OR")
+            self.optional("MOD", "NOT")
+            self.clause()
+
+    def clause(self):
+        token = self.consume("TERM", "QUOTED", "(")
+        if token == "TERM":
+            self.optional("SLOP")
+            if self.optional("BOOST"):
+                self.optional("SLOP")
+        elif token == "QUOTED":
+            self.optional("SLOP")
+            self.optional("BOOST")
+        else:
+            self.query()
+            self.consume(")")
+            self.optional("BOOST")
+
+def check_syntax(query):
+    """
+    Check the syntax of a Lucene query.
+
+    :param query: The query to check.
+    :type query: :class:`str`
+    :returns: ``True`` if the query is correct, ``False`` if it is
+              not, ``None`` if the query uses syntax that this
+              function does not check.
+    """
+    if not query.strip() or "\\" in query:
+        return None
+
+    try:
+        _Parser(_tokenize(query)).parse()
+    except _Undecided:
+        return None
+    except _Invalid:
+        return False
+
+    return True
+
+def positive_terms(query):
+    """
+    Extract the terms that a document matching a query may contain.
+    Negated terms and operators are left out. The syntax of the query
+    is not checked, so this function never fails.
+
+    :param query: The query.
+    :type query: :class:`str`
+    :returns: The terms. Phrases are returned as a single term
+              without the quotes.
+    :rtype: :class:`list` of :class:`str`
+    """
+    terms = []
+    for match in _CLAUSE_RE.finditer(query):
+        term = match.group("term")
+        if match.group("neg") or term in _OPERATORS:
+            continue
+
+        term = term.lstrip("+")
+        if term.startswith('"'):
+            term = term[1:-1]
+
+        if term:
+            terms.append(term)
+    return terms
@@ -61,6 +61,60 @@ def run_saxon(xsl_path, input_data):
         return ret
 
 
+def run_saxon_many(xsl_path, inputs):
+    """
+    Run a transformation on many documents with a single run of
+    Saxon. Starting the JVM is the bulk of the cost of running Saxon
+    on a single document, so this is much faster than calling
+    :func:`run_saxon` on each document. We use Saxon's ability to
+    transform all the files of a directory in one go.
+
+    If Saxon fails on some documents, these documents are transformed
+    again one by one with :func:`run_saxon`, so that the error is
+    raised the same way it would be with :func:`run_saxon`.
+
+    :param xsl_path: The path of the XSLT to run.
+    :type xsl_path: :class:`str`
+    :param inputs: The documents to transform.
+    :type inputs: :class:`list` of :class:`str`
+    :returns: The transformed documents, in the same order as
+              ``inputs``.
+    :rtype: :class:`list` of :class:`str`
+    """
+    if not inputs:
+        return []
+
+    saxon = os.path.join(settings.TOPDIR, "utils", "saxon")
+    with tempfile.TemporaryDirectory(prefix='btwtmp') as tmpdir:
+        indir = os.path.join(tmpdir, "in")
+        outdir = os.path.join(tmpdir, "out")
+        os.mkdir(indir)
+        os.mkdir(outdir)
+        names = []
+        for ix, input_data in enumerate(inputs):
+            name = "{:08d}.xml".format(ix)
+            names.append(name)
+            with open(os.path.join(indir, name), 'w', encoding="utf-8") \
+                    as f:
+                f.write(input_data)
+
+        # We do not check the return value. Failures are detected
+        # below by the absence of output.
+        subprocess.call([saxon, "-s:" + indir, "-xsl:" + xsl_path,
+                         "-o:" + outdir])
+
+        ret = []
+        for name, input_data in zip(names, inputs):
+            out_path = os.path.join(outdir, name)
+            if os.path.exists(out_path):
+                with open(out_path, 'r', encoding="utf-8") as out:
+                    ret.append(out.read())
+            else:
+                ret.append(run_saxon(xsl_path, input_data))
+
+        return ret
+
+
 def run_xsltproc(xsl_path, input_data):
     with WithTmpFiles(input_data) as (_, tmpinput_path,
                                       tmpoutput_file, tmpoutput_path):
@@ -139,7 +193,21 @@ def schematron(xsl, input_data):
     """
     # The schematron transformation to XSL generates xslt 2. So we
     # cannot use lxml to run the xslt script.
-    output = run_saxon(xsl, input_data)
+    return _schematron_passed(run_saxon(xsl, input_data))
+
+def schematron_many(xsl, inputs):
+    """
+    This is like :func:`schematron` but checks many documents with a
+    single run of Saxon. See :func:`run_saxon_many`.
+
+    :returns: Whether each document is free of errors, in the same
+              order as ``inputs``.
+    :rtype: :class:`list` of :class:`bool`
+    """
+    return [_schematron_passed(output) for output
+            in run_saxon_many(xsl, inputs)]
+
+def _schematron_passed(output):
     tree = lxml.etree.fromstring(output.encode("utf-8"))
     found = tree.xpath("//svrl:failed-assert",
                        namespaces={
@@ -315,6 +383,100 @@ def get_set_union(name, iterator):
     con = con_by_name[name]
     return con.sunion([cache.make_key(i) for i in iterator])
 
+def incr_many(name, keys):
+    """
+    Increment the counters ``keys`` in a single round trip to
+    Redis. The counters that do not exist are created with the value
+    1. The values can be read with the cache's ``get``.
+    """
+    cache = caches[name]
+    con = con_by_name[name]
+    pipe = con.pipeline(transaction=False)
+    for key in keys:
+        pipe.incr(cache.make_key(key))
+    pipe.execute()
+
+# KEYS[1] is the index of the sets to which the member belongs,
+# KEYS[2...] are the sets to which the member must belong. ARGV[1] is
+# the member.
+_REPLACE_MEMBERSHIPS = """
+local member = ARGV[1]
+local wanted = {}
+for i = 2, #KEYS do
+  wanted[KEYS[i]] = true
+end
+local removed = 0
+for _, key in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+  if not wanted[key] then
+    redis.call('SREM', key, member)
+    removed = removed + 1
+  end
+end
+redis.call('DEL', KEYS[1])
+for i = 2, #KEYS do
+  redis.call('SADD', KEYS[i], member)
+  redis.call('SADD', KEYS[1], KEYS[i])
+end
+return removed
+"""
+
+_scripts = {}
+
+def _get_script(con, script):
+    ret = _scripts.get(script)
+    if ret is None:
+        ret = _scripts[script] = con.register_script(script)
+    return ret
+
+def replace_set_memberships(name, index_key, keys, member):
+    """
+    Make ``member`` a member of the sets ``keys`` and remove it from
+    the sets it was previously added to with this function but that are
+    not among ``keys``. The set ``index_key`` records the sets to which
+    ``member`` belongs. This operation is atomic and done in a single
+    round trip to Redis.
+
+    .. warning:: This function uses a Lua script which accesses keys
+                 that are not declared to Redis. It won't work on a
+                 Redis cluster.
+
+    :returns: The number of sets from which ``member`` was removed.
+    :rtype: :class:`int`
+    """
+    cache = caches[name]
+    con = con_by_name[name]
+    script = _get_script(con, _REPLACE_MEMBERSHIPS)
+    return script(keys=[cache.make_key(index_key)] +
+                  [cache.make_key(key) for key in keys],
+                  args=[member], client=con)
+
+def publish(name, channel, message):
+    """
+    Publish ``message`` on the Redis channel ``channel``. The channel
+    name is prefixed like cache keys are.
+    """
+    cache = caches[name]
+    con = con_by_name[name]
+    con.publish(cache.make_key(channel), message)
+
+@contextmanager
+def subscription(name, channel):
+    """
+    Subscribe to the Redis channel ``channel`` for the duration of the
+    context. The channel name is prefixed like cache keys are.
+
+    :returns: The ``PubSub`` object subscribed to the channel. Use its
+              ``get_message`` method to wait for messages.
+    """
+    cache = caches[name]
+    con = con_by_name[name]
+    pubsub = con.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(cache.make_key(channel))
+    try:
+        yield pubsub
+    finally:
+        pubsub.close()
+
 @contextmanager
 def WithStringIO(logger):
     """
@@ -23,6 +23,10 @@ class XQueryBuilder(object):
         if isinstance(value, FormattingObject):
             return value.value
 
+        if isinstance(value, (list, tuple)):
+            return "(" + ", ".join(XQueryBuilder.format_value(item)
+                                   for item in value) + ")"
+
         return "".join(['"' + value.replace('"', '&#34;') + '"'])
 
     def format(self, query, **kwargs):
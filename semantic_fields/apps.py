@@ -5,6 +5,8 @@ class DefaultAppConfig(AppConfig):
     name = 'semantic_fields'
 
     def ready(self):
+        from . import caching  # pylint: disable=unused-import
+
         #
         # Yup, we patch the user model to add some methods for
         # checking permissions that are pertinent to this app. This is
@@ -0,0 +1,110 @@
+import time
+import json
+import hashlib
+
+from django.db import transaction
+from django.dispatch import receiver
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+
+from .models import SemanticField, Lexeme, SearchWord
+from .signals import semantic_field_updated
+
+cache = caches['semantic_fields']
+
+GENERATION_KEY = "generation"
+
+TREE_GENERATION_KEY = "tree_generation"
+"""
+The key of the generation of the semantic fields themselves, as
+opposed to their lexemes and search words. The in-memory tree of
+:mod:`semantic_fields.tree` depends only on this generation.
+"""
+
+def get_generation(key=GENERATION_KEY):
+    """
+    Get the current generation of the semantic field tables. The
+    generation changes whenever the tables change, which makes all
+    cached responses stale.
+
+    :param key: The key of the generation to get. Use
+                :data:`TREE_GENERATION_KEY` to get the generation of the
+                semantic fields themselves.
+    :type key: :class:`str`
+    :returns: The generation.
+    :rtype: :class:`int`
+    """
+    generation = cache.get(key)
+    if generation is None:
+        # We start from the current time rather than 0 so that if the
+        # counter is lost, we do not reuse the generation of responses
+        # that are still cached.
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+def bump_generation(fields=True):
+    """
+    Mark the cached responses as stale. This is done automatically
+    when records saved or deleted through the ORM are committed. Code
+    that modifies the tables in bulk must call it once its changes are
+    committed.
+
+    :param fields: Whether the semantic fields themselves changed. If
+                   ``False``, only their lexemes or search words
+                   changed, and the generation obtained with
+                   :data:`TREE_GENERATION_KEY` does not change.
+    :type fields: :class:`bool`
+    """
+    keys = [GENERATION_KEY]
+    if fields:
+        keys.append(TREE_GENERATION_KEY)
+
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The counter does not exist yet. Creating it is enough to
+            # start a new generation.
+            get_generation(key)
+
+@receiver(semantic_field_updated)
+@receiver(post_save, sender=SemanticField)
+@receiver(post_delete, sender=SemanticField)
+def invalidate_responses(sender, **kwargs):
+    # We bump when the transaction commits. Otherwise, a concurrent
+    # request could cache data from before the commit under the new
+    # generation, and nothing would bump the generation again.
+    transaction.on_commit(bump_generation)
+
+@receiver(post_save, sender=Lexeme)
+@receiver(post_delete, sender=Lexeme)
+@receiver(post_save, sender=SearchWord)
+@receiver(post_delete, sender=SearchWord)
+def invalidate_lexeme_responses(sender, **kwargs):
+    # See invalidate_responses.
+    transaction.on_commit(lambda: bump_generation(fields=False))
+
+def make_response_key(request):
+    """
+    Make the key under which the response to a request is cached, and
+    the ETag of the response. Both include the current generation of
+    the tables so that responses are not reused once the tables have
+    changed.
+
+    The response must not depend on the user who makes the request.
+
+    :param request: The request.
+    :type request: :class:`django.http.HttpRequest`
+    :returns: The key and the ETag.
+    :rtype: (:class:`bytes`, :class:`str`)
+    """
+    sha1 = hashlib.sha1()
+    # The responses contain absolute URLs, so they depend on the host.
+    sha1.update(json.dumps([get_generation(),
+                            request.build_absolute_uri(request.path),
+                            sorted(request.GET.lists())])
+                .encode("utf-8"))
+    digest = sha1.hexdigest()
+    return "response_{}".format(digest).encode("ascii"), \
+        '"{}"'.format(digest)
@@ -2,6 +2,7 @@
 
 import os
 import csv
+import contextlib
 import hashlib
 import itertools
 import random
@@ -10,12 +11,13 @@ import datetime
 import re
 
 from django.core.management.base import BaseCommand, CommandError
-from django.core.exceptions import ValidationError
-from django.db import models, reset_queries, connection
+from django.db import models, reset_queries, connection, transaction
 from django.core import serializers
 from django.conf import settings
 
 from semantic_fields.models import SemanticField, Lexeme, SearchWord
+from semantic_fields.caching import bump_generation
+from semantic_fields.tree import get_tree
 from semantic_fields.util import ParsedExpression, _make_from_hte, \
     parse_local_reference, POS_CHOICES
 from lib.command import SubCommand, required
@@ -126,55 +128,6 @@ categories_filters_by_md5 = {
 #             "where indexrelid = ANY(%s);",
 #             (indexes, ))
 
-class FieldConverter(object):
-    frm = None
-    to = None
-
-    def __init__(self):
-        self.to_idx = None
-        self.frm_idx = None
-        self.header_to_csv_index = None
-
-    def setup(self, header_to_csv_index):
-        # What we are doing here is finding the maximum index used and
-        # setting the field we are converting to as an additional
-        # field in the row. This modifies header_to_csv_index so that
-        # we can then find the new field by field name.
-        if self.to in header_to_csv_index:
-            raise ValueError(("the field we are converting to ({0}) "
-                              "already exists").format(self.to))
-
-        if self.frm not in header_to_csv_index:
-            raise ValueError(("the field we are converting from ({0})"
-                              " is unknown").format(self.frm))
-
-        max_idx = max(header_to_csv_index.values())
-        self.to_idx = max_idx + 1
-        self.frm_idx = header_to_csv_index[self.frm]
-        self.header_to_csv_index = header_to_csv_index
-        header_to_csv_index[self.to] = self.to_idx
-
-    def convert(self, row):
-        raise NotImplementedError("subclasses must implement this")
-
-
-class SemanticFieldFieldConverter(FieldConverter):
-    frm = "catid"
-    to = "semantic_field"
-
-    def __init__(self, catids):
-        super(SemanticFieldFieldConverter, self).__init__()
-        self.catids = catids
-
-    def convert(self, row):
-        # Extend the row if needed.
-        diff = self.to_idx - (len(row) - 1)
-        if diff > 0:
-            row += [None] * diff
-
-        row[self.to_idx] = self.catids[int(row[self.frm_idx])]
-
-
 expected_category_headers = [
     "catid",
     "t1",
@@ -193,6 +146,49 @@ expected_category_headers = [
     "themid"
 ]
 
+expected_lexeme_headers = [
+    "htid",
+    "catid",
+    "word",
+    "wordoe",
+    "wordoed",
+    "fulldate",
+    "apps",
+    "appe",
+    "oe",
+    "oefircon",
+    "firstdac",
+    "firstd",
+    "firstdb",
+    "firstdbr",
+    "firmidcon",
+    "firlastcon",
+    "middac",
+    "midd",
+    "middb",
+    "middbr",
+    "midlascon",
+    "lastdac",
+    "lastd",
+    "lastdb",
+    "lastdbr",
+    "current",
+    "label",
+    "roget",
+    "catorder"
+]
+
+expected_search_word_headers = [
+    "sid",
+    "htid",
+    "searchword",
+    "type"
+]
+
+# The CSV files of the HTE dump, in the order in which they must be
+# loaded.
+STAGES = ('category', 'lexeme', 'lexeme_search_words')
+
 def headers_to_map(headers):
     return {header: index for (index, header) in enumerate(headers)}
 
@@ -203,8 +199,140 @@ step_re = re.compile("^0[1-9]|[1-9][0-9]|[1-9][0-9]{2}$")
 # This allows 2 digit numbers, zero-padded. 00 is disallowed.
 subcat_re = re.compile("^0[1-9]|[1-9][0-9]$")
 
+int_re = re.compile(r"^-?\d+$")
+
 POS_VALS = set(val for (val, _) in POS_CHOICES)
 
+def check_values(row, header_to_csv_index, model, fields):
+    """
+    Extract and check the values of a row that are to be stored in a
+    model.
+
+    :param row: The row.
+    :param header_to_csv_index: A map of CSV header name to index in
+    the row.
+    :param model: The model in which the values are to be stored.
+    :param fields: A sequence of pairs of CSV header name and model
+    field name.
+    :returns: The values, in the order of ``fields``.
+    :raises ValueError: If a value is not valid for its field.
+    """
+    values = []
+    for (header, field_name) in fields:
+        value = row[header_to_csv_index[header]]
+        field = model._meta.get_field(field_name)
+        if isinstance(field, (models.IntegerField, models.ForeignKey)):
+            if not int_re.match(value):
+                raise ValueError("{0} is not an integer in {1}"
+                                 .format(header, row))
+        elif field.max_length is not None and \
+                len(value) > field.max_length:
+            raise ValueError("{0} is longer than {1} characters in {2}"
+                             .format(header, field.max_length, row))
+        values.append(value)
+    return values
+
+def copy_escape(value):
+    """
+    Escape a value for the text format of ``COPY``.
+    """
+    return value.replace("\\", "\\\\").replace("\t", "\\t") \
+        .replace("\n", "\\n").replace("\r", "\\r")
+
+class CopyStream(object):
+    """
+    A file-like object that produces the data of a ``COPY ... FROM
+    STDIN`` in text format from an iterable of rows. The rows are
+    consumed as the data is read, so the whole data set is never held
+    in memory.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.buffer += "\t".join(copy_escape(value)
+                                     for value in row) + "\n"
+
+        if size < 0:
+            size = len(self.buffer)
+        ret = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return ret
+
+
+def resolve_parents(cursor):
+    """
+    Set the ``parent_path`` of each staged category to the nearest of
+    its ancestors that exists among the staged categories.
+    """
+    cursor.execute("""
+CREATE INDEX ON hte_category (path);
+UPDATE hte_category c SET parent_path = (
+    SELECT a.path FROM unnest(c.ancestors) WITH ORDINALITY AS a(path, n)
+    JOIN hte_category p ON p.path = a.path
+    ORDER BY a.n LIMIT 1)""")
+
+def swap(cursor, stages):
+    """
+    Replace the data of the live tables with the staged data. This
+    must be called in a transaction.
+
+    We delete rather than truncate so that readers are not locked out
+    while the transaction runs.
+    """
+    sf_table = SemanticField._meta.db_table
+    lexeme_table = Lexeme._meta.db_table
+    search_word_table = SearchWord._meta.db_table
+
+    # This lock does not prevent reading the tables but it serializes
+    # concurrent loads.
+    cursor.execute("LOCK TABLE {0}, {1}, {2} IN SHARE ROW EXCLUSIVE MODE"
+                   .format(sf_table, lexeme_table, search_word_table))
+
+    cursor.execute("DELETE FROM {0}".format(search_word_table))
+
+    if "lexeme" in stages:
+        cursor.execute("DELETE FROM {0}".format(lexeme_table))
+
+    if "category" in stages:
+        # Many-to-many relations to the semantic fields (e.g. from
+        # lexicography's ChunkMetadata) would be cascaded by the ORM.
+        for rel in SemanticField._meta.related_objects:
+            if rel.many_to_many:
+                cursor.execute("DELETE FROM {0}".format(
+                    rel.through._meta.db_table))
+        cursor.execute("DELETE FROM {0}".format(sf_table))
+        cursor.execute("""
+INSERT INTO {sf} (catid, path, heading)
+SELECT catid, path, heading FROM hte_category ORDER BY catid;
+UPDATE {sf} sf SET parent_id = p.id
+FROM hte_category c JOIN {sf} p ON p.path = c.parent_path
+WHERE sf.path = c.path""".format(sf=sf_table))
+        SemanticField.objects.rebuild_ancestry()
+
+    if "lexeme" in stages:
+        # Filtering at the previous step could have removed some
+        # catids from the database, so we join on the live table.
+        cursor.execute("""
+INSERT INTO {lexeme} (htid, semantic_field_id, word, fulldate, catorder)
+SELECT l.htid, sf.id, l.word, l.fulldate, l.catorder
+FROM hte_lexeme l JOIN {sf} sf ON sf.catid = l.catid"""
+                       .format(lexeme=lexeme_table, sf=sf_table))
+
+    # We want only those records that have a corresponding Lexeme.
+    cursor.execute("""
+INSERT INTO {search_word} (sid, htid_id, searchword, type)
+SELECT w.sid, w.htid, w.searchword, w.type
+FROM hte_search_word w JOIN {lexeme} l ON l.htid = w.htid"""
+                   .format(search_word=search_word_table,
+                           lexeme=lexeme_table))
+
 def using(point=""):
     with open("/proc/self/status") as f:
         for line in f:
@@ -261,10 +389,19 @@ class FixParentsMixin(object):
                                       .format(count))
                     self.stdout.write(using())
 
+        SemanticField.objects.rebuild_ancestry()
+        bump_generation()
 
-class Load(FixParentsMixin, SubCommand):
+class Load(SubCommand):
     """
     Load the HTE data from a HTE dump.
+
+    The CSV files are streamed into temporary staging tables with
+    ``COPY``, which is much faster than creating the records through
+    the ORM. The parents of the categories are resolved in the staging
+    table with a single ``UPDATE``. The live tables are replaced with
+    the staged data in a single transaction, so readers see either the
+    old data or the new data, never a partial load.
     """
 
     name = "load"
@@ -280,7 +417,7 @@ class Load(FixParentsMixin, SubCommand):
         sp.add_argument(
             '--skip-to',
             default='category',
-            choices=('category', 'lexeme', 'lexeme_search_words'),
+            choices=STAGES,
             help='Skip to loading that csv file rather '
             'than load all of them.')
         sp.add_argument(
@@ -296,190 +433,143 @@ class Load(FixParentsMixin, SubCommand):
             'already exist. Otherwise, the command will fail.')
         return sp
 
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        yield
+        self.stdout.write("{0}: {1}".format(
+            name, datetime.timedelta(seconds=time.time() - start)))
+
     def __call__(self, command, options):
         self.stderr = command.stderr
         self.stdout = command.stdout
         directory = options["dir"]
 
-        categories_path = os.path.join(directory, "category.csv")
-        lexemes_path = os.path.join(directory, "lexeme.csv")
-        search_path = os.path.join(directory, "lexeme_search_words.csv")
-
-        categories_sum = md5sum(categories_path)
-        categories_filters = categories_filters_by_md5.get(
-            categories_sum, [])
-
         skip_to = options["skip_to"]
         checks_only = options["checks_only"]
         force_overwrite = options["force_overwrite"]
 
-        self.stdout.write(using("before categories"))
         if any(model.objects.exists() for model in (
                 SemanticField, Lexeme, SearchWord)) and not force_overwrite:
             raise CommandError("would overwrite tables; "
                                "use --force-overwrite to override")
 
-        for model in SemanticField, Lexeme, SearchWord:
-            model.objects.all().delete()
+        stages = STAGES[STAGES.index(skip_to):]
+        with connection.cursor() as cursor:
+            for stage in stages:
+                path = os.path.join(directory, stage + ".csv")
+                with self.phase("staging " + path):
+                    getattr(self, "stage_" + stage)(cursor, path)
 
-        skipped = False
-        if not checks_only and skip_to == 'category':
-            skipped = True
+            if "category" in stages:
+                with self.phase("resolving parents"):
+                    resolve_parents(cursor)
 
-            truncations = \
-                self.load_categories(categories_path, categories_filters)
+            if checks_only:
+                return
 
-            # What we are doing here is making sure that in all truncation
-            # cases we will have something to truncate to. When we prepare
-            # an article, we truncate some semantic fields to 3 levels
-            # (t1, t2, t3) and give the truncation the "n" value for
-            # "pos".
-            for x in truncations:
-                try:
-                    SemanticField.objects.get(path=x)
-                except SemanticField.DoesNotExist:
-                    raise ValueError(("record {0} is missing; this will "
-                                      "prevent truncation").format(x))
-
-        using("before lexemes")
-        if not checks_only and (skipped or skip_to == 'lexeme'):
-
-            # We prefetch the catid values from the database instead of
-            # checking them one by one.
-            catids = {x["catid"]: x["id"] for x in
-                      SemanticField.objects.filter(catid__isnull=False)
-                      .values("id", "catid")}
-
-            self.load(lexemes_path, Lexeme, [
-                "htid",
-                "catid",
-                "word",
-                "wordoe",
-                "wordoed",
-                "fulldate",
-                "apps",
-                "appe",
-                "oe",
-                "oefircon",
-                "firstdac",
-                "firstd",
-                "firstdb",
-                "firstdbr",
-                "firmidcon",
-                "firlastcon",
-                "middac",
-                "midd",
-                "middb",
-                "middbr",
-                "midlascon",
-                "lastdac",
-                "lastd",
-                "lastdb",
-                "lastdbr",
-                "current",
-                "label",
-                "roget",
-                "catorder"
-            ], [lambda row, header_to_csv_index:
-                # We want only those rows for which we have a
-                # catid. Filtering at the previous step could have
-                # removed some catids from the database.
-                (int(row[header_to_csv_index["catid"]]) in catids) and
-                # And which are for "current" words.
-                row[header_to_csv_index["current"]] == "_"],
-                None,
-                [SemanticFieldFieldConverter(catids)])
-            skipped = True
-
-        using("before searchwords")
-        if not checks_only and (skipped or skip_to == 'lexeme_search_words'):
-
-            # We prefetch the htid values from the database instead of
-            # checking them one by one.
-            htids = set(Lexeme.objects.all().values_list("htid", flat=True))
-
-            self.load(search_path, SearchWord, [
-                "sid",
-                "htid",
-                "searchword",
-                "type"
-            ], [lambda row, header_to_csv_index:
-                # We want only those records that have a
-                # corresponding Lexeme.
-                (int(row[header_to_csv_index["htid"]]) in htids) and
-                # Also some searchword fields are blank, which
-                # does not seem meaningful to us.
-                row[header_to_csv_index["searchword"]] != ""])
-            skipped = True
-
-    def load_categories(self, path, include_filters):
-        header_to_csv_index = headers_to_map(expected_category_headers)
+            with self.phase("replacing the live tables"), \
+                    transaction.atomic():
+                swap(cursor, stages)
 
-        truncations = set()
-        with open(path) as csv_file:
-            reader = get_csv_reader(csv_file, expected_category_headers)
+        bump_generation()
 
-            count = 0
-            records = []
-            failures = []
-
-            def insert():
-                if not failures:
-                    SemanticField.objects.bulk_create(records)
-                # In DEBUG mode Django will record all queries made to
-                # the database, which can easily use all memory. Don't
-                # prevent DEBUG=True but flush the queries periodically.
-                if settings.DEBUG:
-                    reset_queries()
-                del records[:]
-
-            for row in reader:
-                count += 1
-                # Check whether we include this row.
-                if any(not include(row, header_to_csv_index)
-                       for include in include_filters):
-                    continue
+    def copy(self, cursor, table, columns, rows):
+        cursor.copy_expert(
+            "COPY {0} ({1}) FROM STDIN".format(table, ", ".join(columns)),
+            CopyStream(rows))
+        cursor.execute("ANALYZE {0}".format(table))
+
+    def report_failures(self, path, failures):
+        if not failures:
+            return
 
-                self.process_category_row(row, header_to_csv_index,
-                                          records, truncations, failures)
+        for failure in failures:
+            self.stderr.write(
+                "failed to validate row: {0}".format(failure[0]))
+            self.stderr.write("{0}".format(failure[1]))
 
-                if len(records) >= 1000:
-                    insert()
+        raise CommandError("loading {0} failed: stopping".format(path))
 
+    def filter_rows(self, reader, process, failures):
+        """
+        Process the rows read from a CSV file. ``process`` is called
+        with each row and returns the values to stage, or ``None`` if
+        the row must be skipped. It raises :class:`ValueError` if the
+        row is invalid.
+        """
+        for row in reader:
+            try:
+                values = process(row)
+            except ValueError as ex:
+                failures.append((row, ex))
                 if len(failures) > 20:
                     # Stop after that many failures. If we get so
                     # many failures, the problem is probably
                     # systematic. We may run out of memory trying
                     # to record all of them.
-                    break
-
-                if count % 1000 == 0:
-                    self.stdout.write(
-                        "processed {0} rows".format(count))
-                    self.stdout.write(using())
-
-            # Don't forget the remnants.
-            if records:
-                insert()
-
-            if not failures:
-                self.fix_parents()
-
-            if failures:
-                for failure in failures:
-                    self.stderr.write(
-                        "failed to validate row: {0}".format(failure[0]))
-                    self.stderr.write("{0}".format(failure[1]))
-
-                self.stderr.write("validation failed: deleting table")
-                SemanticField.objects.all().delete()
-                raise CommandError(
-                    "loading {0} failed: stopping".format(path))
+                    return
+                continue
 
-        return truncations
+            if values is not None:
+                yield values
 
-    def process_category_row(self, row, header_to_csv_index, records,
-                             truncations, failures):
+    def stage_category(self, cursor, path):
+        header_to_csv_index = headers_to_map(expected_category_headers)
+        include_filters = categories_filters_by_md5.get(md5sum(path), [])
+
+        def process(row):
+            # Check whether we include this row.
+            if any(not include(row, header_to_csv_index)
+                   for include in include_filters):
+                return None
+
+            return self.process_category_row(row, header_to_csv_index,
+                                             truncations)
+
+        cursor.execute("""
+DROP TABLE IF EXISTS hte_category;
+CREATE TEMPORARY TABLE hte_category (
+    catid integer NOT NULL,
+    path text NOT NULL,
+    heading text NOT NULL,
+    ancestors text[] NOT NULL,
+    parent_path text
+)""")
+        truncations = set()
+        failures = []
+        with open(path) as csv_file:
+            reader = get_csv_reader(csv_file, expected_category_headers)
+            self.copy(cursor, "hte_category",
+                      ("catid", "path", "heading", "ancestors"),
+                      self.filter_rows(reader, process, failures))
+        self.report_failures(path, failures)
+
+        cursor.execute("""
+SELECT path FROM hte_category GROUP BY path HAVING count(*) > 1
+UNION ALL
+SELECT catid::text FROM hte_category GROUP BY catid HAVING count(*) > 1""")
+        duplicates = [row[0] for row in cursor.fetchall()]
+        if duplicates:
+            raise CommandError("loading {0} failed: duplicate paths or "
+                               "catids: {1}"
+                               .format(path, ", ".join(duplicates)))
+
+        # What we are doing here is making sure that in all truncation
+        # cases we will have something to truncate to. When we prepare
+        # an article, we truncate some semantic fields to 3 levels
+        # (t1, t2, t3) and give the truncation the "n" value for
+        # "pos".
+        cursor.execute("""
+SELECT unnest(%s::text[]) EXCEPT SELECT path FROM hte_category""",
+                       [sorted(truncations)])
+        missing = sorted(row[0] for row in cursor.fetchall())
+        if missing:
+            raise ValueError(("records {0} are missing; this will "
+                              "prevent truncation").format(
+                                  ", ".join(missing)))
+
+    def process_category_row(self, row, header_to_csv_index, truncations):
         steps = ("t1", "t2", "t3", "t4", "t5", "t6", "t7")
         values = [row[header_to_csv_index[step]] for step in steps]
 
@@ -492,180 +582,116 @@ class Load(FixParentsMixin, SubCommand):
             raise ValueError("row contains a sequence of t1-t7 which "
                              "has a non-empty value after an empty "
                              "one: {0}".format(row))
-        try:
-            last = None
-            for value in values[0:first_blank]:
-                if not step_re.match(value):
-                    raise ValueError("unexpected step value in {0}"
-                                     .format(row))
-
-            path = ".".join(values[0:first_blank])
-
-            if first_blank > 3:
-                # Pos is always "n" on truncations.
-                truncations.add(".".join(values[0:3]) + "n")
-
-            subcat = row[header_to_csv_index["subcat"]]
-            subcat = subcat.strip()
-            if subcat != '':
-                parts = subcat.split(".")
-                for part in parts:
-                    if not subcat_re.match(part):
-                        raise ValueError(
-                            "unexpected subcat part value in {0}"
-                            .format(row))
-                path += "|" + subcat
-
-            pos = row[header_to_csv_index["pos"]]
-            if pos not in POS_VALS:
-                raise ValueError("pos not among expected values: {0}"
-                                 .format(row))
-            path += pos
-            last = SemanticField(
-                path=path,
-                heading=row[header_to_csv_index["heading"]],
-                catid=row[header_to_csv_index["catid"]])
-            last.full_clean()
-
-            records.append(last)
-        except ValidationError as ex:
-            failures.append((row, ex))
-
-    def load(self, path, model, expected_headers, include_filters=None,
-             supplied_model_fields=None, convert_fields=None):
-        """
-        Loads a CSV file and stores the result in the database.
-
-        :param path: The path to the file.
-        :param model: The Django model into which to store the data.
-        :param expected_headers: A list of headers we expect to find
-        in the CSV file.
-        :param include_filters: A list of functions called with each
-        row read from the CSV file. The functions will be called with
-        the row data as the first argument, and a map of CSV header
-        names to indexes in the row data. A function returning
-        ``True`` means that the row should be included into the
-        database. If any function in the list returns ``False``, the
-        row won't be included.
-        :param supplied_model_fields: A dictionary of fields names for
-        which to supply default values. Keys are the field names,
-        values are the values to assign. These are fields that do not
-        have an equivalent in the CSV file.
-        :param convert_fields: A list of FieldConverter instances.
 
-        """
-        field_name_to_csv_index = {}
-        used_fields = []
-        foreign_key_fields = set()
-        if include_filters is not None or convert_fields is not None:
-            header_to_csv_index = headers_to_map(expected_headers)
-        else:
-            header_to_csv_index = {}
-
-        if convert_fields:
-            for converter in convert_fields:
-                converter.setup(header_to_csv_index)
-
-        for field in model._meta.local_fields:
-            # An autofield is not filled by us.
-            if isinstance(field, models.AutoField):
-                continue
+        levels = values[0:first_blank]
+        for value in levels:
+            if not step_re.match(value):
+                raise ValueError("unexpected step value in {0}"
+                                 .format(row))
 
-            field_name = field.name
+        catid = row[header_to_csv_index["catid"]]
+        if not int_re.match(catid):
+            raise ValueError("unexpected catid value in {0}".format(row))
 
-            if supplied_model_fields and \
-               field_name in supplied_model_fields:
-                continue
+        heading = row[header_to_csv_index["heading"]]
+        if heading == '':
+            raise ValueError("empty heading in {0}".format(row))
 
-            index = header_to_csv_index.get(field_name, None)
+        if first_blank > 3:
+            # Pos is always "n" on truncations.
+            truncations.add(".".join(values[0:3]) + "n")
 
-            if index is None:
+        subcat = row[header_to_csv_index["subcat"]]
+        subcat = subcat.strip()
+        subcats = subcat.split(".") if subcat != '' else []
+        for part in subcats:
+            if not subcat_re.match(part):
                 raise ValueError(
-                    "{0} is not a known field".format(field_name))
-
-            # If the field is a foreign key, then we need to use the
-            # "_id" version of the field name when constructing the
-            # instance.
-            if isinstance(field, models.ForeignKey):
-                field_name += "_id"
-                foreign_key_fields.add(field_name)
-
-            field_name_to_csv_index[field_name] = index
-            used_fields.append(field_name)
-
+                    "unexpected subcat part value in {0}"
+                    .format(row))
+
+        pos = row[header_to_csv_index["pos"]]
+        if pos not in POS_VALS:
+            raise ValueError("pos not among expected values: {0}"
+                             .format(row))
+
+        # The paths that could be the parent of this field, from the
+        # nearest to the farthest. This follows the same logic as
+        # ParsedExpression.parent, without the cost of parsing.
+        hte_path = ".".join(levels)
+        ancestors = [hte_path + "|" + ".".join(subcats[:end]) + pos
+                     for end in range(len(subcats) - 1, 0, -1)]
+        if subcats:
+            ancestors.append(hte_path + pos)
+        ancestors += [".".join(levels[:end]) + pos
+                      for end in range(len(levels) - 1, 0, -1)]
+
+        path = hte_path + ("|" + subcat if subcats else "") + pos
+        return (catid, path, heading,
+                "{" + ",".join(ancestors) + "}")
+
+    def stage_lexeme(self, cursor, path):
+        header_to_csv_index = headers_to_map(expected_lexeme_headers)
+
+        def process(row):
+            # We want only the "current" words.
+            if row[header_to_csv_index["current"]] != "_":
+                return None
+
+            return check_values(row, header_to_csv_index, Lexeme,
+                                (("htid", "htid"),
+                                 ("catid", "semantic_field"),
+                                 ("word", "word"),
+                                 ("fulldate", "fulldate"),
+                                 ("catorder", "catorder")))
+
+        cursor.execute("""
+DROP TABLE IF EXISTS hte_lexeme;
+CREATE TEMPORARY TABLE hte_lexeme (
+    htid integer NOT NULL,
+    catid integer NOT NULL,
+    word text NOT NULL,
+    fulldate text NOT NULL,
+    catorder integer NOT NULL
+)""")
+        failures = []
         with open(path) as csv_file:
-            reader = get_csv_reader(csv_file, expected_headers)
-
-            count = 0
-            records = []
-            failures = []
-
-            def insert():
-                if not failures:
-                    model.objects.bulk_create(records)
-                # In DEBUG mode Django will record all queries made to
-                # the database, which can easily use all memory. Don't
-                # prevent DEBUG=True but flush the queries periodically.
-                if settings.DEBUG:
-                    reset_queries()
-                del records[:]
-                self.stdout.write("processed: {0}".format(count))
-
-            def convert(row, field):
-                value = row[field_name_to_csv_index[field]]
-                if field not in foreign_key_fields:
-                    return str(value, 'utf8')
-                else:
-                    return int(value)
-
-            for row in reader:
-                # Check whether we include this row.
-                if include_filters is not None and \
-                   any(not include(row, header_to_csv_index)
-                       for include in include_filters):
-                    continue
-
-                # Apply all the converters to the row.
-                if convert_fields:
-                    for converter in convert_fields:
-                        converter.convert(row)
-
-                model_dict = {field: convert(row, field) for field in
-                              used_fields}
-                if supplied_model_fields:
-                    model_dict.update(supplied_model_fields)
-                record = model(**model_dict)
-                try:
-                    record.full_clean()
-                except ValidationError as ex:
-                    failures.append((row, ex))
-                    if len(failures) > 20:
-                        # Stop after that many failures. If we get so
-                        # many failures, the problem is probably
-                        # systematic. We may run out of memory trying
-                        # to record all of them.
-                        break
-                else:
-                    records.append(record)
-
-                count += 1
-                if count % 1000 == 0:
-                    insert()
-
-            # Don't forget to insert the leftovers...
-            if records:
-                insert()
-
-            if failures:
-                for failure in failures:
-                    self.stderr.write(
-                        "failed to validate row: {0}".format(failure[0]))
-                    self.stderr.write("{0}".format(failure[1]))
-
-                self.stderr.write("validation failed: deleting table")
-                model.objects.all().delete()
-                raise CommandError(
-                    "loading {0} failed: stopping".format(path))
+            reader = get_csv_reader(csv_file, expected_lexeme_headers)
+            self.copy(cursor, "hte_lexeme",
+                      ("htid", "catid", "word", "fulldate", "catorder"),
+                      self.filter_rows(reader, process, failures))
+        self.report_failures(path, failures)
+
+    def stage_lexeme_search_words(self, cursor, path):
+        header_to_csv_index = headers_to_map(expected_search_word_headers)
+
+        def process(row):
+            # Some searchword fields are blank, which does not seem
+            # meaningful to us.
+            if row[header_to_csv_index["searchword"]] == "":
+                return None
+
+            return check_values(row, header_to_csv_index, SearchWord,
+                                (("sid", "sid"),
+                                 ("htid", "htid"),
+                                 ("searchword", "searchword"),
+                                 ("type", "type")))
+
+        cursor.execute("""
+DROP TABLE IF EXISTS hte_search_word;
+CREATE TEMPORARY TABLE hte_search_word (
+    sid integer NOT NULL,
+    htid integer NOT NULL,
+    searchword text NOT NULL,
+    type text NOT NULL
+)""")
+        failures = []
+        with open(path) as csv_file:
+            reader = get_csv_reader(csv_file, expected_search_word_headers)
+            self.copy(cursor, "hte_search_word",
+                      ("sid", "htid", "searchword", "type"),
+                      self.filter_rows(reader, process, failures))
+        self.report_failures(path, failures)
 
 
 class Fix(FixParentsMixin, SubCommand):
@@ -749,6 +775,12 @@ class TimingTest(SubCommand):
         sp.add_argument(
             "dir",
             help="the directory that contains the HTE file ``category.csv``")
+        sp.add_argument(
+            "--tree",
+            action="store_true",
+            default=False,
+            help="perform the queries on the in-memory tree of semantic "
+            "fields rather than on the database")
         return sp
 
     def __call__(self, command, options):
@@ -794,6 +826,10 @@ class TimingTest(SubCommand):
                        ("t1", "t2", "t3", "t4", "t5", "t6", "t7",
                         "subcat", "pos")})))
 
+        if options["tree"]:
+            self.time_tree(command, what, requests)
+            return
+
         start = time.time()
         found = 0
         if what == "get":
@@ -820,6 +856,30 @@ class TimingTest(SubCommand):
         command.stdout.write("{0} hits out of {1} requests"
                              .format(found, len(requests)))
 
+    def time_tree(self, command, what, requests):
+        start = time.time()
+        tree = get_tree()
+        command.stdout.write("loaded {0} fields in: {1}"
+                             .format(len(tree), str(datetime.timedelta(
+                                 seconds=time.time() - start))))
+
+        start = time.time()
+        found = 0
+        for request in requests:
+            node = tree.get(request)
+            if node is None:
+                command.stdout.write("cannot find: " + request)
+                continue
+
+            found += 1
+            if what == "children":
+                tree.children(request)
+        command.stdout.write("elapsed time: {0}"
+                             .format(str(datetime.timedelta(
+                                 seconds=time.time() - start))))
+        command.stdout.write("{0} hits out of {1} requests"
+                             .format(found, len(requests)))
+
 
 class Analyze(SubCommand):
 
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('semantic_fields', '0005_delete_specifiedsemanticfield'),
+    ]
+
+    # The searches use case-insensitive lookups, which Django performs
+    # on UPPER(...). So the indexes are on the same expressions, which
+    # Django 2.2 cannot express in Meta.indexes.
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            "CREATE INDEX semantic_fields_heading_trgm "
+            "ON semantic_fields_semanticfield "
+            "USING gin (UPPER(heading::text) gin_trgm_ops)",
+            "DROP INDEX semantic_fields_heading_trgm"),
+        migrations.RunSQL(
+            "CREATE INDEX semantic_fields_searchword_trgm "
+            "ON semantic_fields_searchword "
+            "USING gin (UPPER(searchword::text) gin_trgm_ops)",
+            "DROP INDEX semantic_fields_searchword_trgm"),
+    ]
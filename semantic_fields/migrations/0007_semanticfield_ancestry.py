@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('semantic_fields', '0006_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='semanticfield',
+            name='ancestry',
+            field=django.contrib.postgres.fields.jsonb.JSONField(
+                editable=False, null=True),
+        ),
+        migrations.RunSQL("""
+WITH RECURSIVE tree(id, path, heading, ancestry) AS (
+    SELECT id, path, heading, '[]'::jsonb
+    FROM semantic_fields_semanticfield WHERE parent_id IS NULL
+  UNION ALL
+    SELECT c.id, c.path, c.heading,
+           t.ancestry || jsonb_build_array(
+               jsonb_build_array(t.id, t.path, t.heading))
+    FROM tree t JOIN semantic_fields_semanticfield c ON c.parent_id = t.id
+)
+UPDATE semantic_fields_semanticfield sf SET ancestry = tree.ancestry
+FROM tree WHERE sf.id = tree.id""", migrations.RunSQL.noop),
+    ]
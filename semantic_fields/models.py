@@ -1,9 +1,14 @@
-from django.db import models, IntegrityError
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import models, IntegrityError, connection
+from django.contrib.postgres.fields import JSONField
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.html import mark_safe, escape
 
 from .util import parse_local_reference, parse_local_references, \
-    POS_TO_VERBOSE, ParsedExpression, POS_VALUES_EXPANDED
+    POS_TO_VERBOSE, ParsedExpression, POS_VALUES_EXPANDED, clear_memos
 from .signals import semantic_field_updated
 from lib.util import on_change
 
@@ -22,6 +27,39 @@ def format_duplicate_error(uri, pos, heading):
                               pos_description,
                               heading_description)
 
+def is_subcat_path(path):
+    """
+    Check whether a path is the path of a subcategory, without parsing
+    it. A field is a subcategory if its HTE part (the part before the
+    first branch) contains a subcategory separator.
+    """
+    return "|" in path.split("/", 1)[0]
+
+def _detail_url(pk):
+    return reverse('semantic_fields_semanticfield-detail', args=(pk, ))
+
+def _make_link(url, text, css_class=""):
+    if css_class != "":
+        css_class = " " + css_class
+
+    return mark_safe(
+        ("<a class='btn btn-outline-dark btn-sm sf-link{0}' "
+         "href='{1}'>{2}</a>").format(css_class, url, escape(text)))
+
+# Compute the ancestry of fields from the ancestry of their parents,
+# recursively. The starting set of the recursion is interpolated as
+# ``{start}``.
+_ANCESTRY_SQL = """
+WITH RECURSIVE tree(id, path, heading, ancestry) AS (
+    {start}
+  UNION ALL
+    SELECT c.id, c.path, c.heading,
+           t.ancestry || jsonb_build_array(
+               jsonb_build_array(t.id, t.path, t.heading))
+    FROM tree t JOIN {table} c ON c.parent_id = t.id
+)
+UPDATE {table} sf SET ancestry = tree.ancestry FROM tree
+WHERE sf.id = tree.id AND sf.ancestry IS DISTINCT FROM tree.ancestry"""
 
 def make_field(parent, uri, heading, pos):
     if parent and len(parent.parsed_path) > 1:
@@ -75,6 +113,166 @@ class SemanticFieldManager(models.Manager):
     def roots(self):
         return self.filter(parent__isnull=True)
 
+    def resolve_for_display(self, paths, for_share=False):
+        """
+        Fetch the fields that have the paths passed, together with all
+        the ancestors needed to compute their ``heading_for_display``,
+        in a single query. The ``parent`` of each subcategory is set to
+        the record of its parent, so computing ``heading_for_display``
+        on the records returned does not hit the database.
+
+        Paths that do not correspond to any field are silently
+        skipped.
+
+        :param paths: The paths to fetch.
+        :type paths: An iterable of :class:`str`.
+        :param for_share: Whether to lock the records with ``FOR
+                          SHARE``.
+        :type for_share: :class:`bool`
+        :returns: A map of path to record. This map contains the
+                  ancestors that were fetched, in addition to the
+                  records requested.
+        :rtype: :class:`dict`
+        """
+        paths = list(paths)
+        if not paths:
+            return {}
+
+        table = self.model._meta.db_table
+        # We follow the parent link only for subcategories, which are
+        # the only fields for which ``heading_for_display`` needs the
+        # parent. A field is a subcategory if its HTE part (the part
+        # before the first branch) contains a subcategory separator.
+        sql = """
+WITH RECURSIVE chain(id, parent_id, path) AS (
+    SELECT id, parent_id, path FROM {table} WHERE path = ANY(%s)
+  UNION
+    SELECT p.id, p.parent_id, p.path FROM {table} p
+    JOIN chain c ON p.id = c.parent_id
+    WHERE split_part(c.path, '/', 1) LIKE '%%|%%'
+)
+SELECT * FROM {table} WHERE id IN (SELECT id FROM chain)""".format(table=table)
+        if for_share:
+            sql += " FOR SHARE"
+
+        records = list(self.raw(sql, [paths]))
+        by_id = {record.id: record for record in records}
+        for record in records:
+            parent = by_id.get(record.parent_id)
+            if parent is not None:
+                record.parent = parent
+
+        return {record.path: record for record in records}
+
+    def rebuild_ancestry(self, pks=None):
+        """
+        Recompute the ``ancestry`` of fields in a single query.
+
+        :param pks: The primary keys of the fields whose descendants
+                    must be updated. The ancestry of these fields is
+                    taken to be correct. If ``None``, the ancestry of
+                    all fields is recomputed.
+        :type pks: An iterable of :class:`int`.
+        :returns: The number of fields updated.
+        :rtype: :class:`int`
+        """
+        table = self.model._meta.db_table
+        if pks is None:
+            start = "SELECT id, path, heading, '[]'::jsonb FROM {table} " \
+                "WHERE parent_id IS NULL"
+            params = []
+        else:
+            start = "SELECT id, path, heading, " \
+                "coalesce(ancestry, '[]'::jsonb) FROM {table} " \
+                "WHERE id = ANY(%s)"
+            params = [list(pks)]
+
+        with connection.cursor() as cursor:
+            cursor.execute(_ANCESTRY_SQL.format(
+                start=start.format(table=table), table=table), params)
+            return cursor.rowcount
+
+    def prefetch_parents(self, fields, depth=-1):
+        """
+        Fetch the parents of the fields passed, and set the ``parent``
+        of each field to the record fetched, so that following the
+        ``parent`` links of the fields does not hit the database. The
+        ancestors recorded in the ``ancestry`` of the fields are all
+        fetched at once. Otherwise, the parents are fetched one level
+        at a time, with one query per level.
+
+        :param fields: The fields.
+        :type fields: An iterable of :class:`SemanticField`.
+        :param depth: The number of levels of parents to fetch. A
+                      negative value means all levels.
+        :type depth: :class:`int`
+        """
+        by_id = {}
+        frontier = [sf for sf in fields if sf.parent_id is not None]
+        while frontier and depth != 0:
+            depth -= 1
+            wanted = set()
+            for sf in frontier:
+                wanted.add(sf.parent_id)
+                if sf.ancestry is not None:
+                    wanted.update(pk for (pk, _, _) in sf.ancestry)
+            wanted -= set(by_id)
+
+            if wanted:
+                by_id.update((record.pk, record) for record in
+                             self.filter(pk__in=wanted))
+
+            next_frontier = []
+            for sf in frontier:
+                parent = by_id.get(sf.parent_id)
+                if parent is None:
+                    continue
+                sf.parent = parent
+                if parent.parent_id is not None:
+                    next_frontier.append(parent)
+            frontier = next_frontier
+
+    def prefetch_related_by_pos(self, fields):
+        """
+        Compute the ``related_by_pos`` of the fields passed, in a
+        single query.
+
+        :param fields: The fields.
+        :type fields: An iterable of :class:`SemanticField`.
+        """
+        # Map of path to the fields to which the path is related.
+        wanted = defaultdict(list)
+        for sf in fields:
+            if isinstance(sf, SpecifiedSemanticField) or \
+               sf._related_by_pos is not None:
+                continue
+            sf._related_by_pos = []
+            for related in sf.parsed_path[0].related_by_pos():
+                wanted[str(related)].append(sf)
+
+        if not wanted:
+            return
+
+        for record in self.filter(path__in=list(wanted)):
+            for sf in wanted[record.path]:
+                sf._related_by_pos.append(record)
+
+    def headings_for_display(self, paths):
+        """
+        Compute the ``heading_for_display`` of the fields that have the
+        paths passed, in a single query.
+
+        :param paths: The paths of the fields.
+        :type paths: An iterable of :class:`str`.
+        :returns: A map of path to heading. Paths that do not
+                  correspond to any field are not in the map.
+        :rtype: :class:`dict`
+        """
+        paths = set(paths)
+        return {path: record.heading_for_display
+                for (path, record) in self.resolve_for_display(paths).items()
+                if path in paths}
+
 class SemanticField(models.Model):
     objects = SemanticFieldManager()
     catid = models.IntegerField(unique=True, null=True)
@@ -82,6 +280,27 @@ class SemanticField(models.Model):
     parent = models.ForeignKey("self", on_delete=models.CASCADE,
                                related_name="children", null=True, blank=True)
     heading = models.TextField()
+    # The ancestors of this field, from the root down to the parent,
+    # as a list of [pk, path, heading] triplets. This allows producing
+    # the breadcrumbs and heading_for_display without walking up the
+    # parents. It is ``None`` if it has not been computed (e.g. for
+    # records loaded from fixtures).
+    ancestry = JSONField(null=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.ancestry = self._compute_ancestry()
+        super(SemanticField, self).save(*args, **kwargs)
+
+    def _compute_ancestry(self):
+        parent = self.parent
+        if parent is None:
+            return []
+
+        ancestry = parent.ancestry
+        if ancestry is None:
+            ancestry = parent._compute_ancestry()
+
+        return ancestry + [[parent.pk, parent.path, parent.heading]]
 
     def _branch_assertions(self):
         ref = self.parsed_path[0]
@@ -151,8 +370,19 @@ class SemanticField(models.Model):
         breadcrubs), then it is better to use ``heading``
         directly. Otherwise, the parent will appear twice in the list.
         """
-        return self.heading if not self.is_subcat else \
-            self.parent.heading_for_display + " :: " + self.heading
+        if not self.is_subcat:
+            return self.heading
+
+        if self.ancestry is None:
+            return self.parent.heading_for_display + " :: " + self.heading
+
+        headings = [self.heading]
+        for (_, path, heading) in reversed(self.ancestry):
+            headings.append(heading)
+            if not is_subcat_path(path):
+                break
+
+        return " :: ".join(reversed(headings))
 
     @property
     def is_custom(self):
@@ -162,8 +392,7 @@ class SemanticField(models.Model):
 
     @property
     def detail_url(self):
-        return reverse('semantic_fields_semanticfield-detail',
-                       args=(self.pk, ))
+        return _detail_url(self.pk)
 
     @property
     def add_child_url(self):
@@ -242,11 +471,15 @@ class SemanticField(models.Model):
         if rp is not None:
             return rp
 
-        ref = self.parsed_path[0]
-        related = ref.related_by_pos()
-        related = \
-            SemanticField.objects.filter(
-                path__in=(str(x) for x in related))
+        if settings.SEMANTIC_FIELDS_TREE:
+            from .tree import get_tree
+            related = get_tree().related_by_pos(self.path)
+        else:
+            ref = self.parsed_path[0]
+            related = ref.related_by_pos()
+            related = \
+                SemanticField.objects.filter(
+                    path__in=(str(x) for x in related))
         self._related_by_pos = related
         return related
 
@@ -297,13 +530,7 @@ class SemanticField(models.Model):
         if text is None:
             text = self.heading_for_display
 
-        if css_class != "":
-            css_class = " " + css_class
-
-        return mark_safe(
-            ("<a class='btn btn-outline-dark btn-sm sf-link{0}' "
-             "href='{1}'>{2}</a>").format(css_class, self.detail_url,
-                                          escape(text)))
+        return _make_link(self.detail_url, text, css_class)
 
     @property
     def link(self):
@@ -319,10 +546,24 @@ class SemanticField(models.Model):
     def _breadcrumbs(self, linked, first):
         heading = self.heading_and_pos if first else self.heading
         ret = self.make_link(heading) if linked else escape(heading)
-        if self.parent:
-            ret = self.parent._breadcrumbs(linked, first=False) + \
-                escape(" :: " if self.is_subcat else " > ") + ret
-        return ret
+        if self.ancestry is None:
+            if self.parent:
+                ret = self.parent._breadcrumbs(linked, first=False) + \
+                    escape(" :: " if self.is_subcat else " > ") + ret
+            return ret
+
+        crumbs = []
+        for (pk, path, heading) in self.ancestry:
+            if crumbs:
+                crumbs.append(
+                    escape(" :: " if is_subcat_path(path) else " > "))
+            crumbs.append(_make_link(_detail_url(pk), heading) if linked
+                          else escape(heading))
+
+        if crumbs:
+            crumbs.append(escape(" :: " if self.is_subcat else " > "))
+        crumbs.append(ret)
+        return "".join(crumbs)
 
     @property
     def linked_breadcrumbs(self):
@@ -456,6 +697,20 @@ def emit_change_signal(instance):
 # The only thing that may change is the heading.
 on_change(SemanticField, lambda sf: sf.heading, emit_change_signal)
 
+@receiver(semantic_field_updated)
+def update_descendants_ancestry(sender, instance, **kwargs):
+    # The heading of the instance is recorded in the ancestry of its
+    # descendants.
+    if instance.pk is not None:
+        SemanticField.objects.rebuild_ancestry([instance.pk])
+
+@receiver(semantic_field_updated)
+def clear_memoized_results(sender, **kwargs):
+    # The memoized results do not depend on the headings at the time
+    # of writing but we do not want stale results to survive a change
+    # if this ever changes.
+    clear_memos()
+
 class Lexeme(models.Model):
 
     class Meta:
@@ -1,7 +1,8 @@
 from rest_framework import serializers
-from django.db.models import Max, F
+from django.db import models
+from django.db.models import Max, F, prefetch_related_objects
 
-from .models import SemanticField, Lexeme
+from .models import SemanticField, SpecifiedSemanticField, Lexeme
 from lexicography.models import Entry, ChangeRecord
 from lib.rest.serializers import DynamicFieldsSerializerMixin
 
@@ -11,11 +12,27 @@ class LexemeSerializer(serializers.ModelSerializer):
         model = Lexeme
         fields = ("word", "fulldate")
 
+class SemanticFieldListSerializer(serializers.ListSerializer):
+    """
+    The serializer used when serializing many semantic fields at
+    once. It fetches the related records needed by all the fields
+    before serializing them, so that the queries are made per
+    relation rather than per field.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        instances = list(iterable)
+        self.child.prefetch(instances)
+        return super(SemanticFieldListSerializer, self) \
+            .to_representation(instances)
+
 class SemanticFieldSerializer(DynamicFieldsSerializerMixin,
                               serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = SemanticField
+        list_serializer_class = SemanticFieldListSerializer
         fields = ("url", "path", "heading", "parent", "is_subcat",
                   "heading_for_display",
                   "changerecords", "related_by_pos", "lexemes", "children",
@@ -57,6 +74,34 @@ class SemanticFieldSerializer(DynamicFieldsSerializerMixin,
         self.depths = kwargs.pop("depths", {})
         super(SemanticFieldSerializer, self).__init__(*args, **kwargs)
 
+    def prefetch(self, instances):
+        """
+        Fetch the related records that serializing the instances passed
+        requires, given the fields selected and their depths.
+
+        :param instances: The instances that will be serialized.
+        :type instances: :class:`list` of :class:`SemanticField`.
+        """
+        records = [sf for sf in instances
+                   if not isinstance(sf, SpecifiedSemanticField)]
+        if not records:
+            return
+
+        fields = self.fields
+        if "parent" in fields:
+            # Even when the parent is serialized as a URL, we get the
+            # record. So we need one more level than the depth.
+            depth = self.depths.get("parent", 0)
+            SemanticField.objects.prefetch_parents(
+                records, depth + 1 if depth >= 0 else depth)
+
+        if "related_by_pos" in fields:
+            SemanticField.objects.prefetch_related_by_pos(records)
+
+        for name in ("children", "lexemes"):
+            if name in fields:
+                prefetch_related_objects(records, name)
+
     def get_parent(self, sf):
         return self._generic_get_related(sf, "parent", False, None, True)
 
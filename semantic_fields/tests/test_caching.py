@@ -0,0 +1,58 @@
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from ..models import SemanticField, Lexeme
+from .. import caching
+from lib.util import DisableMigrationsTransactionMixin
+
+class InvalidationTestCase(DisableMigrationsTransactionMixin,
+                           TransactionTestCase):
+
+    def test_bump_on_commit(self):
+        """
+        Changing a semantic field bumps the generation only once the
+        change is committed.
+        """
+        sf = SemanticField(path="01n", heading="foo")
+        sf.save()
+
+        generation = caching.get_generation()
+        with transaction.atomic():
+            sf.heading = "changed"
+            sf.save()
+            self.assertEqual(caching.get_generation(), generation)
+
+        self.assertNotEqual(caching.get_generation(), generation)
+
+    def test_no_bump_on_rollback(self):
+        """
+        A change that is rolled back does not bump the generation.
+        """
+        sf = SemanticField(path="01n", heading="foo")
+        sf.save()
+
+        generation = caching.get_generation()
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                sf.heading = "changed"
+                sf.save()
+                raise ValueError()
+
+        self.assertEqual(caching.get_generation(), generation)
+
+    def test_lexeme_does_not_bump_tree(self):
+        """
+        Changing a lexeme bumps the generation of the responses but not
+        that of the semantic fields.
+        """
+        sf = SemanticField(path="01n", heading="foo")
+        sf.save()
+
+        generation = caching.get_generation()
+        tree_generation = caching.get_generation(caching.TREE_GENERATION_KEY)
+        Lexeme(htid=1, semantic_field=sf, word="foo", fulldate="OE",
+               catorder=0).save()
+
+        self.assertNotEqual(caching.get_generation(), generation)
+        self.assertEqual(caching.get_generation(caching.TREE_GENERATION_KEY),
+                         tree_generation)
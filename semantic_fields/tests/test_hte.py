@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..management.commands.hte import CopyStream, Load, \
+    expected_category_headers, expected_lexeme_headers, \
+    expected_search_word_headers, headers_to_map
+from ..models import SemanticField, Lexeme, SearchWord
+from ..util import ParsedExpression
+
+def make_row(headers, **values):
+    return [values.get(header, "") for header in headers]
+
+def write_csv(path, headers, rows):
+    with open(path, 'w') as f:
+        for row in [headers] + rows:
+            f.write(",".join(row) + "\n")
+
+class CopyStreamTestCase(TestCase):
+
+    def test_read(self):
+        """
+        ``read`` produces the rows in the text format of ``COPY``, in
+        pieces of the size requested.
+        """
+        stream = CopyStream([("a", "b\tc"), ("d\\", "e\nf")])
+        data = stream.read(3) + stream.read(100)
+        self.assertEqual(data, "a\tb\\tc\nd\\\\\te\\nf\n")
+        self.assertEqual(stream.read(100), "")
+
+class ProcessCategoryRowTestCase(TestCase):
+
+    def process(self, **values):
+        row = make_row(expected_category_headers, catid="1",
+                       heading="foo", **values)
+        return Load().process_category_row(
+            row, headers_to_map(expected_category_headers), set())
+
+    def test_ancestors(self):
+        """
+        The ancestors are those that ``ParsedExpression.parent`` would
+        yield, from the nearest to the farthest.
+        """
+        (_, path, _, ancestors) = self.process(t1="01", t2="02", t3="03",
+                                               subcat="04.05", pos="v")
+        self.assertEqual(path, "01.02.03|04.05v")
+
+        expected = []
+        parsed = ParsedExpression(path).parent()
+        while parsed is not None:
+            expected.append(str(parsed))
+            parsed = parsed.parent()
+
+        self.assertEqual(ancestors, "{" + ",".join(expected) + "}")
+
+    def test_invalid_pos(self):
+        """
+        An invalid pos raises ``ValueError``.
+        """
+        with self.assertRaisesRegex(ValueError,
+                                    "pos not among expected values"):
+            self.process(t1="01", pos="x")
+
+class LoadTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="btw-test-hte")
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        write_csv(os.path.join(self.dir, "category.csv"),
+                  expected_category_headers, [
+                      make_row(expected_category_headers, catid="1",
+                               t1="01", pos="n", heading="World"),
+                      make_row(expected_category_headers, catid="2",
+                               t1="01", t2="02", t3="03", pos="n",
+                               heading="Earth"),
+                      make_row(expected_category_headers, catid="3",
+                               t1="01", t2="02", t3="03", subcat="01",
+                               pos="n", heading="Moon"),
+                  ])
+        write_csv(os.path.join(self.dir, "lexeme.csv"),
+                  expected_lexeme_headers, [
+                      make_row(expected_lexeme_headers, htid="10",
+                               catid="2", word="earth", fulldate="OE-",
+                               current="_", catorder="0"),
+                      make_row(expected_lexeme_headers, htid="11",
+                               catid="2", word="middle-earth",
+                               fulldate="OE", catorder="1"),
+                  ])
+        write_csv(os.path.join(self.dir, "lexeme_search_words.csv"),
+                  expected_search_word_headers, [
+                      ["100", "10", "earth", "var"],
+                      ["101", "11", "middle-earth", "var"],
+                      ["102", "10", "", "var"],
+                  ])
+
+    def test_load(self):
+        """
+        The records are loaded, and the parents are set.
+        """
+        call_command("hte", "load", self.dir, stdout=StringIO())
+
+        self.assertEqual(
+            {sf.path: sf.parent and sf.parent.path
+             for sf in SemanticField.objects.all()},
+            {"01n": None, "01.02.03n": "01n", "01.02.03|01n": "01.02.03n"})
+        self.assertEqual(
+            list(Lexeme.objects.values_list("htid", "semantic_field__path")),
+            [(10, "01.02.03n")])
+        self.assertEqual(
+            list(SearchWord.objects.values_list("sid", flat=True)), [100])
+
+    def test_checks_only(self):
+        """
+        ``--checks-only`` leaves the tables untouched.
+        """
+        call_command("hte", "load", "--checks-only", self.dir,
+                     stdout=StringIO())
+        self.assertFalse(SemanticField.objects.exists())
@@ -279,6 +279,49 @@ class SemanticFieldTestCase(TestCase):
 
             self.assertEqual(cat.linked_breadcrumbs, expected)
 
+    def test_ancestry(self):
+        """
+        ``ancestry`` is set on save, and ``breadcrumbs``,
+        ``linked_breadcrumbs`` and ``heading_for_display`` use it
+        without walking up the parents.
+        """
+        top = SemanticField(path="01n", heading="top")
+        top.save()
+        cat = SemanticField(path="01.01n", heading="cat", parent=top)
+        cat.save()
+        subcat = SemanticField(path="01.01|01n", heading="subcat",
+                               parent=cat)
+        subcat.save()
+
+        self.assertEqual(subcat.ancestry, [[top.pk, "01n", "top"],
+                                           [cat.pk, "01.01n", "cat"]])
+
+        subcat = SemanticField.objects.get(pk=subcat.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(subcat.heading_for_display, "cat :: subcat")
+            self.assertEqual(subcat.breadcrumbs,
+                             escape("top > cat :: subcat (Noun)"))
+            self.assertEqual(subcat.linked_breadcrumbs.count("sf-link"), 3)
+
+    def test_ancestry_follows_heading_changes(self):
+        """
+        Changing the heading of a field updates the ``ancestry`` of its
+        descendants.
+        """
+        top = SemanticField(path="01n", heading="top")
+        top.save()
+        cat = SemanticField(path="01.01n", heading="cat", parent=top)
+        cat.save()
+        child = SemanticField(path="01.01.01n", heading="child", parent=cat)
+        child.save()
+
+        top.heading = "changed"
+        top.save()
+
+        child = SemanticField.objects.get(pk=child.pk)
+        self.assertEqual(child.breadcrumbs,
+                         escape("changed > cat > child (Noun)"))
+
     def test_hte_url_on_non_hte_semanticfield(self):
         """
         ``hte_url`` should be ``None`` on non-HTE categories.
@@ -538,6 +581,84 @@ class SemanticFieldManagerTestCase(TestCase):
         self.assertEqual(field.parent, None)
         self.assertEqual(field.catid, None)
 
+    def make_subcats(self):
+        parent = SemanticField(path="01.01n", heading="parent")
+        parent.save()
+        subcat = SemanticField(path="01.01|01n", heading="subcat",
+                               parent=parent)
+        subcat.save()
+        subsubcat = SemanticField(path="01.01|01.01n", heading="subsubcat",
+                                  parent=subcat)
+        subsubcat.save()
+        child = SemanticField(path="01.01.01n", heading="child",
+                              parent=parent)
+        child.save()
+
+    def test_resolve_for_display(self):
+        """
+        ``resolve_for_display`` returns the records requested and the
+        ancestors of subcategories, in one query.
+        """
+        self.make_subcats()
+        with self.assertNumQueries(1):
+            records = SemanticField.objects.resolve_for_display(
+                ["01.01|01.01n", "01.01.01n", "99n"])
+            self.assertEqual(set(records.keys()),
+                             {"01.01|01.01n", "01.01|01n", "01.01n",
+                              "01.01.01n"})
+            self.assertEqual(records["01.01|01.01n"].heading_for_display,
+                             "parent :: subcat :: subsubcat")
+            self.assertEqual(records["01.01.01n"].heading_for_display,
+                             "child")
+
+    def test_resolve_for_display_does_not_fetch_needless_parents(self):
+        """
+        ``resolve_for_display`` does not fetch the parents of fields that
+        are not subcategories.
+        """
+        self.make_subcats()
+        records = SemanticField.objects.resolve_for_display(["01.01.01n"])
+        self.assertEqual(set(records.keys()), {"01.01.01n"})
+
+    def test_resolve_for_display_empty(self):
+        """
+        ``resolve_for_display`` does not query the database when there is
+        nothing to fetch.
+        """
+        with self.assertNumQueries(0):
+            self.assertEqual(SemanticField.objects.resolve_for_display([]),
+                             {})
+
+    def test_headings_for_display(self):
+        """
+        ``headings_for_display`` returns the headings of the fields
+        requested.
+        """
+        self.make_subcats()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                SemanticField.objects.headings_for_display(
+                    ["01.01|01.01n", "01.01n", "99n"]),
+                {
+                    "01.01|01.01n": "parent :: subcat :: subsubcat",
+                    "01.01n": "parent"
+                })
+
+    def test_rebuild_ancestry(self):
+        """
+        ``rebuild_ancestry`` recomputes the ancestry of all fields.
+        """
+        top = SemanticField(path="01n", heading="top")
+        top.save()
+        cat = SemanticField(path="01.01n", heading="cat", parent=top)
+        cat.save()
+        SemanticField.objects.update(ancestry=None)
+
+        self.assertEqual(SemanticField.objects.rebuild_ancestry(), 2)
+        self.assertEqual(SemanticField.objects.get(pk=top.pk).ancestry, [])
+        self.assertEqual(SemanticField.objects.get(pk=cat.pk).ancestry,
+                         [[top.pk, "01n", "top"]])
+
 @override_settings(ROOT_URLCONF='semantic_fields.tests.urls')
 class SemanticFieldManagerTransactionTestCase(TestCase):
 
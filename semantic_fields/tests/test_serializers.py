@@ -245,3 +245,24 @@ class SerializerTestCase(TestCase):
                 for r in self.custom.related_by_pos
             ]
         })
+
+    def test_many(self):
+        """
+        Serializing many fields fetches the related records with one
+        query per relation, and produces the same data as serializing
+        the fields one by one.
+        """
+        kwargs = {
+            "context": self.context,
+            "fields": ["@details"],
+            "depths": {"parent": -1, "related_by_pos": 1},
+        }
+
+        records = list(SemanticField.objects.all().order_by("path"))
+        with self.assertNumQueries(4):
+            data = SemanticFieldSerializer(records, many=True, **kwargs).data
+
+        self.assertEqual(
+            data,
+            [SemanticFieldSerializer(sf, **kwargs).data
+             for sf in SemanticField.objects.all().order_by("path")])
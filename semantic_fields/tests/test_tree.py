@@ -0,0 +1,120 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..models import SemanticField
+from ..tree import SemanticFieldTree, get_tree
+from .. import caching
+
+# We check the generation on every call, unless a test says otherwise.
+@override_settings(SEMANTIC_FIELDS_TREE_CHECK_INTERVAL=0)
+class SemanticFieldTreeTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.top = SemanticField(path="01n", heading="top")
+        cls.top.save()
+        cls.cat = SemanticField(path="01.01n", heading="cat", parent=cls.top,
+                                catid=2)
+        cls.cat.save()
+        cls.subcat = SemanticField(path="01.01|01n", heading="subcat",
+                                   parent=cls.cat)
+        cls.subcat.save()
+        cls.other = SemanticField(path="01.02n", heading="other",
+                                  parent=cls.top)
+        cls.other.save()
+        cls.verb = SemanticField(path="01.01v", heading="verb",
+                                 parent=cls.top)
+        cls.verb.save()
+        cls.second = SemanticField(path="02n", heading="second")
+        cls.second.save()
+
+    def setUp(self):
+        # The database is rolled back between tests, without bumping
+        # the generation.
+        caching.bump_generation()
+        self.tree = SemanticFieldTree.load(0)
+
+    def assertPaths(self, records, paths):
+        self.assertEqual([record.path for record in records], paths)
+
+    def test_get(self):
+        """
+        ``get`` returns the field that has the path, with its ancestry.
+        """
+        with self.assertNumQueries(0):
+            sf = self.tree.get("01.01|01n")
+            self.assertEqual(sf.pk, self.subcat.pk)
+            self.assertEqual(sf.parent_id, self.cat.pk)
+            self.assertEqual(sf.heading_for_display, "cat :: subcat")
+            self.assertEqual(sf.ancestry, self.subcat.ancestry)
+            self.assertEqual(self.tree.get("01.01n").catid, 2)
+            self.assertIsNone(self.tree.get("01n").parent_id)
+            self.assertIsNone(self.tree.get("99n"))
+
+    def test_children(self):
+        """
+        ``children`` returns the children of a field, or the roots, in
+        the order of paths.
+        """
+        with self.assertNumQueries(0):
+            self.assertPaths(self.tree.children("01n"),
+                             ["01.01n", "01.01v", "01.02n"])
+            self.assertPaths(self.tree.children("01.01|01n"), [])
+            self.assertPaths(self.tree.children("99n"), [])
+            self.assertPaths(self.tree.children(), ["01n", "02n"])
+
+    def test_ancestors(self):
+        """
+        ``ancestors`` returns the ancestors from the root down.
+        """
+        with self.assertNumQueries(0):
+            self.assertPaths(self.tree.ancestors("01.01|01n"),
+                             ["01n", "01.01n"])
+            self.assertPaths(self.tree.ancestors("01n"), [])
+
+    def test_related_by_pos(self):
+        """
+        ``related_by_pos`` returns the fields that differ only by pos.
+        """
+        with self.assertNumQueries(0):
+            self.assertPaths(self.tree.related_by_pos("01.01n"), ["01.01v"])
+
+    @override_settings(SEMANTIC_FIELDS_TREE=True)
+    def test_model_related_by_pos(self):
+        """
+        When the tree is enabled, ``SemanticField.related_by_pos`` uses
+        it.
+        """
+        get_tree()
+        sf = SemanticField.objects.get(path="01.01n")
+        with self.assertNumQueries(0):
+            self.assertPaths(sf.related_by_pos, ["01.01v"])
+
+    def test_get_tree_refreshes(self):
+        """
+        ``get_tree`` loads the tree anew when the generation changes.
+        """
+        first = get_tree()
+        self.assertIs(get_tree(), first)
+
+        caching.bump_generation()
+        second = get_tree()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.generation,
+                         caching.get_generation(caching.TREE_GENERATION_KEY))
+        self.assertEqual(len(second), 6)
+
+    def test_get_tree_throttled(self):
+        """
+        ``get_tree`` does not check the generation again before
+        ``SEMANTIC_FIELDS_TREE_CHECK_INTERVAL`` has elapsed.
+        """
+        first = get_tree()
+        caching.bump_generation()
+        with override_settings(SEMANTIC_FIELDS_TREE_CHECK_INTERVAL=60), \
+                mock.patch("semantic_fields.caching.get_generation") \
+                as get_generation:
+            self.assertIs(get_tree(), first)
+            self.assertFalse(get_generation.called)
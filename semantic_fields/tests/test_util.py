@@ -1,8 +1,10 @@
 from django.test import TestCase
 from tatsu.exceptions import FailedParse
 
-from ..util import parse_local_reference, ParsedExpression, POS_CHOICES, \
-    POS_CHOICES_EXPANDED
+from ..util import parse_local_reference, parse_local_references, \
+    ParsedExpression, POS_CHOICES, POS_CHOICES_EXPANDED, memo_info, \
+    clear_memos
+from ..models import emit_change_signal, SemanticField
 
 class UtilTestCase(TestCase):
     # We specifically do not test the failure modes of parse_sf
@@ -73,6 +75,54 @@ class UtilTestCase(TestCase):
         with self.assertRaises(FailedParse):
             parse_local_reference("abcd")
 
+class MemoTestCase(TestCase):
+
+    def setUp(self):
+        clear_memos()
+        return super(MemoTestCase, self).setUp()
+
+    def info(self):
+        return memo_info()["semantic_fields.util._parse_local_references"]
+
+    def test_parse_local_references_memoized(self):
+        """
+        ``parse_local_references`` reuses the results of previous parses.
+        """
+        first = parse_local_references("01.01n@02.02n")
+        info = self.info()
+        self.assertEqual((info.hits, info.misses), (0, 1))
+        second = parse_local_references("01.01n@02.02n")
+        info = self.info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+        self.assertEqual(info.hit_rate, 0.5)
+        self.assertEqual(first, second)
+
+    def test_parse_local_references_returns_new_list(self):
+        """
+        ``parse_local_references`` returns a list that the caller may
+        modify without affecting the memoized result.
+        """
+        first = parse_local_references("01.01n@02.02n")
+        first.pop()
+        self.assertEqual(len(parse_local_references("01.01n@02.02n")), 2)
+
+    def test_hit_rate_is_none_when_unused(self):
+        """
+        The hit rate is ``None`` when a memoized function has not been
+        called.
+        """
+        self.assertIsNone(self.info().hit_rate)
+
+    def test_cleared_by_semantic_field_updated(self):
+        """
+        The memoized results are cleared when a semantic field is
+        updated.
+        """
+        parse_local_references("01.01n")
+        self.assertEqual(self.info().currsize, 1)
+        emit_change_signal(SemanticField(path="01.01n", heading="foo"))
+        self.assertEqual(self.info().currsize, 0)
+
 class ParsedExpressionTest(TestCase):
 
     def test_only_hte(self):
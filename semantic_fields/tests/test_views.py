@@ -21,6 +21,7 @@ from nose.tools import nottest
 from .util import MinimalQuery, FakeChangeRecord
 from ..models import SemanticField, SearchWord, Lexeme
 from ..serializers import SemanticFieldSerializer
+from .. import caching
 from lib import util
 from lib.testutil import wipd
 
@@ -36,6 +37,9 @@ class _Mixin(object):
     def setUp(self):
         super(_Mixin, self).setUp()
         translation.activate('en-us')
+        # The database is rolled back between tests, without bumping
+        # the generation of the cached responses.
+        caching.bump_generation()
 
     # This exists so that we can use setUpTestData and setUp later.
     @classmethod
@@ -1125,6 +1129,48 @@ class ListTestCase(ViewsTestCase):
         transformed = json.loads(json.dumps(serializer.data))
         self.assertCountEqual(response.json, transformed)
 
+    def get_paths(self, paths, **headers):
+        self.app.set_cookie(settings.CSRF_COOKIE_NAME, FAKE_CSRF)
+        headers.update({
+            "Accept": "application/json",
+            "X-CSRFToken": FAKE_CSRF,
+        })
+        return self.app.get(self.url, params={"paths": paths},
+                            headers=headers)
+
+    def test_etag(self):
+        """
+        A response carries an ETag, and a conditional request with the
+        same ETag yields a 304.
+        """
+        response = self.get_paths("01.01n;02n")
+        etag = response.headers["ETag"]
+        self.assertEqual(response.headers["Cache-Control"],
+                         "private, no-cache")
+
+        response = self.get_paths("01.01n;02n", **{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+
+    def test_etag_changes_with_fields(self):
+        """
+        The ETag changes, and the cached response is not reused, when a
+        semantic field changes.
+        """
+        response = self.get_paths("01.01n;02n")
+        etag = response.headers["ETag"]
+
+        self.cat2.heading = "changed"
+        self.cat2.save()
+        # The test never commits, so we do what happens on commit.
+        caching.bump_generation()
+
+        response = self.get_paths("01.01n;02n", **{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertCountEqual([x["heading"] for x in response.json],
+                              ["bwip", "changed"])
+
     def test_expanded_scope(self):
         """
         A query requesting changerecords gets them.
@@ -1263,6 +1309,46 @@ class ListParameterTestCases(ParameterChecksMixin, ViewsTestCase):
         response_headings = [x["heading"] for x in result["results"]]
         self.assertCountEqual(response_headings, headings)
 
+    def order_check(self, aspect):
+        """
+        Test that ``order=relevance`` puts the best matches first.
+        """
+        headings = ["a termite", "term", "terminal", "determinism",
+                    "a term"]
+        for (ix, heading) in enumerate(headings):
+            sf = SemanticField(path="01.{0:02}n".format(ix + 1),
+                               heading=heading)
+            sf.save()
+            lexeme = Lexeme(htid=ix, semantic_field=sf, word=heading,
+                            fulldate="q", catorder=0)
+            lexeme.save()
+            SearchWord(sid=ix, htid=lexeme, searchword=heading,
+                       type="oed").save()
+
+        self.app.set_cookie(settings.CSRF_COOKIE_NAME, FAKE_CSRF)
+        response = self.app.get(self.url,
+                                params={
+                                    "search": "term",
+                                    "scope": "all",
+                                    "aspect": aspect,
+                                    "root": "all",
+                                    "order": "relevance",
+                                },
+                                headers={
+                                    "Accept": "application/json",
+                                    "X-CSRFToken": FAKE_CSRF,
+                                })
+
+        self.assertEqual([x["heading"] for x in response.json["results"]],
+                         ["term", "terminal", "a term", "a termite",
+                          "determinism"])
+
+    def test_order_relevance_sf(self):
+        self.order_check("sf")
+
+    def test_order_relevance_lexemes(self):
+        self.order_check("lexemes")
+
 def init():
     ParameterChecksMixin.make_tests(ListParameterTestCases)
 
@@ -0,0 +1,216 @@
+"""
+An in-memory, read-only copy of the hierarchy of semantic fields.
+
+The hierarchy is large, changes rarely and is queried constantly. When
+the ``SEMANTIC_FIELDS_TREE`` setting is ``True``, some lookups are
+served from a copy of the hierarchy held in each process rather than
+from the database. The copy is loaded lazily, and is loaded anew when
+the generation of the semantic fields maintained by
+:mod:`semantic_fields.caching` changes. The generation is checked at
+most once every ``SEMANTIC_FIELDS_TREE_CHECK_INTERVAL`` seconds, so a
+copy may remain stale for that long.
+
+The records returned by the tree are instances of
+:class:`semantic_fields.models.SemanticField` built from the copy. They
+have their ``ancestry`` set, so computing their breadcrumbs does not
+hit the database. They must not be saved.
+"""
+import sys
+import time
+from array import array
+
+from django.conf import settings
+
+from .models import SemanticField
+from .util import parse_local_references
+from . import caching
+
+class SemanticFieldTree(object):
+    """
+    The hierarchy of semantic fields, stored in arrays indexed by the
+    position of each field in the order of paths. The children of
+    each field are stored contiguously, in the order of paths.
+
+    :param generation: The generation of the data loaded.
+    :type generation: :class:`int`
+    :param rows: The ``(id, parent_id, path, heading, catid)`` tuples
+                 of the fields, in the order of paths.
+    """
+
+    def __init__(self, generation, rows):
+        self.generation = generation
+
+        self.ids = array('l')
+        self.catids = array('l')
+        self.paths = []
+        self.headings = []
+        parent_ids = []
+        for (pk, parent_id, path, heading, catid) in rows:
+            self.ids.append(pk)
+            self.catids.append(-1 if catid is None else catid)
+            self.paths.append(path)
+            # Headings are shared among many fields (e.g. the
+            # subcategories of different categories).
+            self.headings.append(sys.intern(heading))
+            parent_ids.append(parent_id)
+
+        self.path_to_index = {path: ix for (ix, path) in
+                              enumerate(self.paths)}
+        id_to_index = {pk: ix for (ix, pk) in enumerate(self.ids)}
+
+        count = len(self.ids)
+        self.parents = array('l', (-1 if parent_id is None else
+                                   id_to_index[parent_id]
+                                   for parent_id in parent_ids))
+
+        # The children of field ix are child_indexes[child_offsets[ix]:
+        # child_offsets[ix + 1]].
+        counts = [0] * (count + 1)
+        for parent in self.parents:
+            if parent != -1:
+                counts[parent + 1] += 1
+        self.child_offsets = array('l', counts)
+        for ix in range(count):
+            self.child_offsets[ix + 1] += self.child_offsets[ix]
+
+        fill = array('l', self.child_offsets)
+        self.child_indexes = array('l', [0]) * self.child_offsets[count]
+        self.roots = array('l')
+        for (ix, parent) in enumerate(self.parents):
+            if parent == -1:
+                self.roots.append(ix)
+            else:
+                self.child_indexes[fill[parent]] = ix
+                fill[parent] += 1
+
+    @classmethod
+    def load(cls, generation):
+        """
+        Load the tree from the database.
+
+        :param generation: The generation of the data in the
+                           database. It must be read *before* loading.
+        :type generation: :class:`int`
+        :rtype: :class:`SemanticFieldTree`
+        """
+        return cls(generation, SemanticField.objects.order_by("path")
+                   .values_list("id", "parent_id", "path", "heading",
+                                "catid").iterator())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _ancestor_indexes(self, ix):
+        ret = []
+        parent = self.parents[ix]
+        while parent != -1:
+            ret.append(parent)
+            parent = self.parents[parent]
+        ret.reverse()
+        return ret
+
+    def _record(self, ix):
+        parent = self.parents[ix]
+        catid = self.catids[ix]
+        return SemanticField(
+            id=self.ids[ix],
+            path=self.paths[ix],
+            heading=self.headings[ix],
+            catid=None if catid == -1 else catid,
+            parent_id=None if parent == -1 else self.ids[parent],
+            ancestry=[[self.ids[a], self.paths[a], self.headings[a]]
+                      for a in self._ancestor_indexes(ix)])
+
+    def get(self, path):
+        """
+        Get a field by path.
+
+        :param path: The path of the field.
+        :type path: :class:`str`
+        :returns: The field, or ``None`` if there is no such field.
+        :rtype: :class:`semantic_fields.models.SemanticField`
+        """
+        ix = self.path_to_index.get(path)
+        return None if ix is None else self._record(ix)
+
+    def children(self, path=None):
+        """
+        Get the children of a field, in the order of paths.
+
+        :param path: The path of the field. ``None`` means get the
+                     fields that have no parent.
+        :type path: :class:`str`
+        :returns: The children. The list is empty if there is no such
+                  field.
+        :rtype: :class:`list` of
+                :class:`semantic_fields.models.SemanticField`
+        """
+        if path is None:
+            return [self._record(ix) for ix in self.roots]
+
+        ix = self.path_to_index.get(path)
+        if ix is None:
+            return []
+
+        return [self._record(child) for child in
+                self.child_indexes[self.child_offsets[ix]:
+                                   self.child_offsets[ix + 1]]]
+
+    def ancestors(self, path):
+        """
+        Get the ancestors of a field, from the root down to the parent.
+
+        :param path: The path of the field.
+        :type path: :class:`str`
+        :returns: The ancestors. The list is empty if there is no such
+                  field.
+        :rtype: :class:`list` of
+                :class:`semantic_fields.models.SemanticField`
+        """
+        ix = self.path_to_index.get(path)
+        if ix is None:
+            return []
+
+        return [self._record(ancestor) for ancestor in
+                self._ancestor_indexes(ix)]
+
+    def related_by_pos(self, path):
+        """
+        Get the fields that differ from a field only by their pos.
+
+        :param path: The path of the field.
+        :type path: :class:`str`
+        :returns: The related fields, in the order of paths.
+        :rtype: :class:`list` of
+                :class:`semantic_fields.models.SemanticField`
+        """
+        indexes = sorted(
+            ix for ix in (
+                self.path_to_index.get(str(related)) for related in
+                parse_local_references(path)[0].related_by_pos())
+            if ix is not None)
+        return [self._record(ix) for ix in indexes]
+
+_tree = None
+_checked = None
+
+def get_tree():
+    """
+    Get the tree of the current generation, loading it if needed. The
+    generation is checked at most once every
+    ``SEMANTIC_FIELDS_TREE_CHECK_INTERVAL`` seconds.
+
+    :rtype: :class:`SemanticFieldTree`
+    """
+    global _tree, _checked  # pylint: disable=global-statement
+    now = time.monotonic()
+    tree = _tree
+    if tree is not None and \
+       now - _checked < settings.SEMANTIC_FIELDS_TREE_CHECK_INTERVAL:
+        return tree
+
+    generation = caching.get_generation(caching.TREE_GENERATION_KEY)
+    if tree is None or tree.generation != generation:
+        tree = _tree = SemanticFieldTree.load(generation)
+    _checked = now
+    return tree
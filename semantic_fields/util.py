@@ -1,4 +1,6 @@
 import copy
+import functools
+from collections import namedtuple
 
 from tatsu.ast import AST
 from .field import fieldParser
@@ -397,6 +399,56 @@ def _branch_checks(ast):
                 raise ValueError("BTW does not allow branches with URIs")
 
 
+_memos = {}
+
+MemoInfo = namedtuple("MemoInfo",
+                      ("hits", "misses", "maxsize", "currsize", "hit_rate"))
+
+def memoized(maxsize):
+    """
+    A decorator that memoizes a function with a bounded LRU cache and
+    registers the memoized function so that :func:`memo_info` can
+    report on it and :func:`clear_memos` can clear it.
+
+    The function decorated must be pure and its return value must be
+    treated as immutable by callers, as the same value is returned to
+    all callers that pass the same arguments.
+
+    :param maxsize: The maximum number of results to keep.
+    :type maxsize: :class:`int`
+    """
+    def decorator(fn):
+        cached = functools.lru_cache(maxsize=maxsize)(fn)
+        _memos[fn.__module__ + "." + fn.__qualname__] = cached
+        return cached
+
+    return decorator
+
+def memo_info():
+    """
+    :returns: The statistics of all the functions memoized with
+              :func:`memoized`, keyed by the qualified name of the
+              functions.
+    :rtype: :class:`dict` of :class:`MemoInfo`
+    """
+    ret = {}
+    for name, fn in _memos.items():
+        info = fn.cache_info()
+        total = info.hits + info.misses
+        ret[name] = MemoInfo(info.hits, info.misses, info.maxsize,
+                             info.currsize,
+                             info.hits / total if total else None)
+    return ret
+
+def clear_memos():
+    """
+    Clear the caches of all the functions memoized with
+    :func:`memoized`. This also resets their statistics.
+    """
+    for fn in _memos.values():
+        fn.cache_clear()
+
+@memoized(maxsize=10000)
 def parse_local_reference(ref):
     """
     This function parses a semantic field reference. This function is
@@ -447,8 +499,12 @@ def parse_local_references(ref):
     :returns: A the parsed reference.
     :rtype: :class:`list` of :class:`ParsedExpression`
     """
+    return list(_parse_local_references(ref))
+
+@memoized(maxsize=10000)
+def _parse_local_references(ref):
     ref = ref.strip()
     ast = _to_ast(ref)
 
     _branch_checks(ast)
-    return ParsedExpression(ast).specification_to_list()
+    return tuple(ParsedExpression(ast).specification_to_list())
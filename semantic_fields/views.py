@@ -1,3 +1,5 @@
+import re
+
 from django_datatables_view.base_datatable_view import BaseDatatableView
 from django.utils.html import mark_safe
 from django.template.loader import render_to_string
@@ -5,7 +7,13 @@ from django.core.exceptions import PermissionDenied
 from django import forms
 from django.views.decorators.cache import never_cache
 from django.middleware.csrf import CsrfViewMiddleware
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponseBadRequest, HttpResponse, \
+    HttpResponseNotModified
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from django.db.models import Case, When, Value, IntegerField, Min
+from django.db.models.functions import Length
 from rest_framework import viewsets, mixins, renderers, parsers, permissions, \
     generics, filters, pagination, serializers
 from rest_framework.response import Response
@@ -17,8 +25,9 @@ from .models import SemanticField, SpecifiedSemanticField, make_specified_sf
 from .serializers import SemanticFieldSerializer
 from .forms import SemanticFieldForm
 from .util import parse_local_references
+from . import caching
 
-def filter_by_search_params(qs, search, aspect, scope, root):
+def filter_by_search_params(qs, search, aspect, scope, root, order="path"):
     search = search.strip()
 
     if search == "":
@@ -52,10 +61,46 @@ def filter_by_search_params(qs, search, aspect, scope, root):
     else:
         raise ValueError("unknown value for root: " + root)
 
+    # The inexact lookups are served by the trigram indexes created
+    # by migration 0006.
     qs = qs.filter(**{field + exact: search})
 
+    if order == "path":
+        pass
+    elif order == "relevance":
+        qs = order_by_relevance(qs, field, search)
+    else:
+        raise ValueError("unknown value for order: " + order)
+
     return qs
 
+def order_by_relevance(qs, field, search):
+    """
+    Order the fields by how well ``field`` matches ``search``. Exact
+    matches come first, then the matches at the start of the value,
+    then the matches at the start of a word, and then all other
+    matches. Within each group, shorter values come first, as they
+    are closer to what was searched.
+
+    When ``field`` crosses a relation that has many values per
+    semantic field, the best of the values is used.
+    """
+    quality = Case(
+        When(**{field + "__iexact": search}, then=Value(0)),
+        When(**{field + "__istartswith": search}, then=Value(1)),
+        When(**{field + "__iregex": r"\m" + re.escape(search)},
+             then=Value(2)),
+        default=Value(3),
+        output_field=IntegerField())
+    length = Length(field)
+
+    if "__" in field:
+        quality = Min(quality)
+        length = Min(length)
+
+    return qs.annotate(match_quality=quality, match_length=length) \
+             .order_by("match_quality", "match_length", "path")
+
 class SearchTable(BaseDatatableView):
     model = SemanticField
 
@@ -74,6 +119,11 @@ class SearchTable(BaseDatatableView):
 
         return super(SearchTable, self).render_column(row, column)
 
+    def prepare_results(self, qs):
+        rows = list(qs)
+        SemanticField.objects.prefetch_related_by_pos(rows)
+        return super(SearchTable, self).prepare_results(rows)
+
     def filter_queryset(self, qs):
         search_value = self.request.GET.get('search[value]', None)
         aspect = self.request.GET['aspect']
@@ -120,7 +170,9 @@ class SemanticFieldFilter(filters.BaseFilterBackend):
             aspect = request.GET['aspect']
             scope = request.GET['scope']
             root = request.GET['root']
-            qs = filter_by_search_params(qs, search, aspect, scope, root)
+            order = request.GET.get('order', 'path')
+            qs = filter_by_search_params(qs, search, aspect, scope, root,
+                                         order)
         return qs
 
 
@@ -234,6 +286,13 @@ class SemanticFieldViewSet(mixins.RetrieveModelMixin,
           + ``01``, ``02``, ``03``: all fields that have a path
           starting with this number.
 
+        * ``order`` is optional and is the order of the results:
+
+          + ``path``: the default, by path.
+
+          + ``relevance``: the best matches first. This is meant for
+            autocompletion.
+
         Pagination
         ==========
 
@@ -286,8 +345,17 @@ class SemanticFieldViewSet(mixins.RetrieveModelMixin,
         parent would itself contain a URL to its own
         parent. ``depths.parent=-1`` makes the depth infinite.
 
-        ..warning:: Be careful when setting an infinite depth, as it
-                    could cause an enormous amount of queries.
+        When a list of records is returned, the related records are
+        fetched for the whole list, with one query per relation, and
+        one query per level of parents.
+
+        Caching
+        =======
+
+        Unless ``changerecords`` is among the fields requested, the
+        responses carry an ETag, are cached on the server, and the
+        conditional requests made with ``If-None-Match`` are answered
+        with 304 when the semantic fields have not changed.
         """
         saved_method = request.method
         request.method = "POST"
@@ -316,6 +384,22 @@ class SemanticFieldViewSet(mixins.RetrieveModelMixin,
             return HttpResponseBadRequest(
                 "paths or ids or search must be specified")
 
+        # The change records are the only part of the response that
+        # depends on the user and on data outside this app.
+        cacheable = "changerecords" not in request.GET.get("fields", "")
+        if cacheable:
+            key, etag = caching.make_response_key(request)
+            if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH",
+                                                    "")):
+                return self._cacheable_response(HttpResponseNotModified(),
+                                                etag)
+
+            body = caching.cache.get(key)
+            if body is not None:
+                return self._cacheable_response(
+                    HttpResponse(body, content_type="application/json"),
+                    etag)
+
         complex_paths = set()
         if paths is not None:
             # This interface accepts queries on semantic field
@@ -366,8 +450,25 @@ class SemanticFieldViewSet(mixins.RetrieveModelMixin,
             ret.data = [sf for path, sf in sf_by_path.items()
                         if path in paths]
 
+        if cacheable:
+            # We cache the rendered body so that all the responses
+            # that carry the same strong ETag are identical.
+            body = renderers.JSONRenderer().render(ret.data)
+            caching.cache.set(key, body,
+                              settings.SEMANTIC_FIELDS_RESPONSE_TIMEOUT)
+            ret = self._cacheable_response(
+                HttpResponse(body, content_type="application/json"), etag)
+
         return ret
 
+    @staticmethod
+    def _cacheable_response(response, etag):
+        response["ETag"] = etag
+        # The browser may keep the response but must check with us
+        # before reusing it.
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
     @action(detail=True, methods=['get'], url_path="edit-form")
     def edit_form(self, request, *args, **kwargs):
         if not request.user.can_change_semantic_fields:
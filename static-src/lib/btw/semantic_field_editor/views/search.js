@@ -79,6 +79,7 @@ define(/** @lends auto */ function factory(require, _exports, _module) {
       "depths.parent": -1,
       "depths.related_by_pos": 1,
       fields: "@search",
+      order: "relevance",
     },
 
     parseRecords: function parseRecords(data) {
@@ -23,3 +23,30 @@ class ExistDBTest(TestCase):
         """
         db = existdb.ExistDB()
         self.assertFalse(existdb.is_lucene_query_clean(db, '"foo'))
+
+    def test_get_db_reuses_client(self):
+        """
+        ``get_db`` returns the same client when called repeatedly.
+        """
+        self.assertIs(existdb.get_db(), existdb.get_db())
+
+    def test_load_many(self):
+        """
+        ``load_many`` loads all the documents, in multiple batches if
+        needed, and creates the missing collections.
+        """
+        db = existdb.ExistDB()
+        collection = existdb.get_collection_path(None) + "/test_load_many"
+        db.removeCollection(collection, True)
+        docs = [(collection + "/doc" + str(i),
+                 '<doc a="&quot;&amp;">{} &amp; "{}"</doc>'.format(i, i))
+                for i in range(5)]
+        try:
+            self.assertEqual(db.load_many(docs, batch_size=2), 5)
+            self.assertEqual(existdb.list_collection(db, collection),
+                             set(path for path, _ in docs))
+            self.assertIn(
+                '1 &amp; "1"',
+                db.getDocument(collection + "/doc1").decode("utf-8"))
+        finally:
+            db.removeCollection(collection, True)
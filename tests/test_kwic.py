@@ -0,0 +1,50 @@
+from unittest import TestCase
+
+from lib import kwic
+
+class MakePatternTestCase(TestCase):
+
+    def test_no_terms(self):
+        "``make_pattern`` returns ``None`` when there are no terms."
+        self.assertIsNone(kwic.make_pattern([]))
+
+    def test_whole_words(self):
+        "``make_pattern`` matches whole words, ignoring case."
+        pattern = kwic.make_pattern(["foo"])
+        self.assertEqual(pattern.findall("Foo food foo."), ["Foo", "foo"])
+
+    def test_wildcards(self):
+        "``make_pattern`` supports Lucene's wildcards."
+        pattern = kwic.make_pattern(["fo*", "b?r"])
+        self.assertEqual(pattern.findall("fo food bar baar"),
+                         ["fo", "food", "bar"])
+
+    def test_phrase(self):
+        "``make_pattern`` matches phrases across punctuation and spaces."
+        pattern = kwic.make_pattern(["foo bar", "foo"])
+        self.assertEqual(pattern.findall("foo,  bar foo"),
+                         ["foo,  bar", "foo"])
+
+class SummarizeTestCase(TestCase):
+
+    def test_context(self):
+        "``summarize`` truncates the context and marks the truncation."
+        pattern = kwic.make_pattern(["foo"])
+        self.assertEqual(list(kwic.summarize("abcde foo fghij", pattern,
+                                             width=3)),
+                         [("...de ", "foo", " fg...")])
+
+    def test_limit(self):
+        "``summarize`` stops at the limit."
+        pattern = kwic.make_pattern(["foo"])
+        self.assertEqual(len(list(kwic.summarize("foo " * 10, pattern,
+                                                 limit=3))), 3)
+        self.assertEqual(list(kwic.summarize("foo", pattern, limit=0)), [])
+
+    def test_to_html(self):
+        "``to_html`` produces escaped KWIC markup."
+        self.assertEqual(
+            kwic.to_html([("<a ", "foo", " &")]),
+            '<hit><p><span class="previous">&lt;a </span>'
+            '<span class="hi">foo</span>'
+            '<span class="following"> &amp;</span></p></hit>')
@@ -0,0 +1,79 @@
+from unittest import TestCase
+
+from lib.lucene import check_syntax, positive_terms
+
+class CheckSyntaxTestCase(TestCase):
+
+    def assertVerdicts(self, queries, verdict):
+        for query in queries:
+            self.assertIs(check_syntax(query), verdict, query)
+
+    def test_valid(self):
+        "``check_syntax`` accepts correct queries."
+        self.assertVerdicts([
+            "foo",
+            "foo bar",
+            "foo-bar",
+            "fo*o fo?",
+            "\"foo bar\"",
+            "\"foo bar\"~2",
+            "foo~ foo~0.5 foo^2 foo^2.5~1",
+            "foo AND bar",
+            "foo && bar || baz",
+            "foo OR NOT bar",
+            "NOT foo",
+            "+foo -bar !baz",
+            "(foo OR bar) AND baz",
+            "((foo))^3",
+            "and or not",
+        ], True)
+
+    def test_invalid(self):
+        "``check_syntax`` rejects incorrect queries."
+        self.assertVerdicts([
+            "\"foo",
+            "(foo",
+            "foo)",
+            "()",
+            "foo AND",
+            "AND foo",
+            "foo AND OR bar",
+            "foo NOT",
+            "+-foo",
+            "foo^",
+            "foo^bar",
+            "~foo",
+            "(foo)~2",
+            "foo -",
+        ], False)
+
+    def test_undecided(self):
+        "``check_syntax`` leaves the queries it does not handle undecided."
+        self.assertVerdicts([
+            "",
+            "   ",
+            "*foo",
+            "?oo",
+            "title:foo",
+            "[a TO b]",
+            "{a TO b}",
+            "/fo+/",
+            "foo\\:bar",
+            "foo - bar",
+        ], None)
+
+class PositiveTermsTestCase(TestCase):
+
+    def test_terms(self):
+        "``positive_terms`` returns the terms and phrases."
+        self.assertEqual(positive_terms('foo AND "bar baz"~2 +qu*x^2'),
+                         ["foo", "bar baz", "qu*x"])
+
+    def test_negated(self):
+        "``positive_terms`` leaves out the negated terms."
+        self.assertEqual(positive_terms("foo -bar !baz NOT qux"), ["foo"])
+
+    def test_fields(self):
+        "``positive_terms`` drops the field names."
+        self.assertEqual(positive_terms("(title:foo OR bar)"),
+                         ["foo", "bar"])
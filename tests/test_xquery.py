@@ -47,6 +47,15 @@ xquery version '3.0';
 declare namespace btw = 'http://mangalamresearch.org/ns/btw-storage';
 {blah}""")
 
+    def test_format_sequence(self):
+        "``format`` should format lists as sequences."
+        self.assertEqual(self.builder.format(
+            "{foo}",
+            foo=["a", xquery.Verbatim("b")]), """\
+xquery version '3.0';
+declare namespace btw = 'http://mangalamresearch.org/ns/btw-storage';
+("a", b)""")
+
 class XQueryBuilderTest(_BuilderTest):
     """
     Test the XQueryBuilder object.